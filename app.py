@@ -1,25 +1,48 @@
+import asyncio
+import csv
+import hashlib
+import io
+import json
 import logging
+import multiprocessing
 import os
-import tempfile
 import threading
 import time
 import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime
+from functools import partial
 
 import pandas as pd
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import gzip
-from flask import Flask, request, send_file, jsonify
+from flask import Flask, Response, request, send_file, jsonify, stream_with_context
 from flask_cors import CORS
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, PageBreak, Table, TableStyle, KeepTogether
+from reportlab.platypus import (BaseDocTemplate, Frame, PageTemplate, NextPageTemplate, Paragraph, Spacer, Image,
+                                PageBreak, Table, TableStyle, KeepTogether)
+from reportlab.lib.utils import ImageReader
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
 from reportlab.lib import colors
-from openai import OpenAI
+from openai import AsyncOpenAI
 from markdown2 import markdown as md_to_html
 from bs4 import BeautifulSoup
 
+from dvf_cache import DataFrameCache, department_cache
+from dvf_estimation import estimation_fiable, estimer_valeur, indice_annuel, niveau_confiance
+from dvf_index import DvfIndex
+from dvf_routage import departement_probable, lire_routage
+from dvf_store import (DVF_DTYPES, DVF_FOLDER, TOUS_TYPES, TOUTES_COMMUNES, aggregates_path, compute_aggregates,
+                       department_path, partition_path, read_dvf_csv, routage_path)
+from jobs import JOBS_ATTENTE_MAX, TERMINE, FilePleine, JobScheduler, JobStore
+from llm_cache import cle_reponse, contient_identite, llm_cache, personnaliser
+from llm_limiter import LimiteurOpenAI
+from metrics import dans_trace, registre, span, trace_courante
+from pdf_optimisation import PROFILS_PDF, bilan_taille, cout_reference, encoder_couverture, encoder_graphique, profil_pdf
+from report_store import report_store
+
 # Configuration du logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
@@ -27,14 +50,35 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(me
 app = Flask(__name__)
 CORS(app)
 
-# 🔐 Client OpenAI
-client = OpenAI()
+# 🔐 Client OpenAI (asynchrone : les sections sont rédigées en parallèle). Il vit dans
+# une boucle d'événements dédiée, partagée par tous les threads Flask du processus ;
+# débit et nouveaux essais sont gérés par le limiteur, pas par le client.
+async_client = AsyncOpenAI(max_retries=0)
+limiteur_openai = LimiteurOpenAI()
+_boucle_llm = None
+_boucle_llm_lock = threading.Lock()
+
+def boucle_llm():
+    global _boucle_llm
+    with _boucle_llm_lock:
+        if _boucle_llm is None:
+            _boucle_llm = asyncio.new_event_loop()
+            threading.Thread(target=_boucle_llm.run_forever, name="boucle-llm", daemon=True).start()
+    return _boucle_llm
+
+def lancer_llm(coroutine):
+    """
+    Planifie une coroutine sur la boucle LLM et renvoie un concurrent.futures.Future.
+    La coroutine hérite de la trace du thread appelant (ses spans comptent pour le job).
+    """
+    return asyncio.run_coroutine_threadsafe(dans_trace(coroutine, trace_courante.get()), boucle_llm())
+
+tokens_openai = registre.compteur("openai_tokens_total", "Tokens OpenAI consommés", ["type"])
 
 PDF_FOLDER = "./pdf_reports/"
 os.makedirs(PDF_FOLDER, exist_ok=True)
-
-# Dossier contenant les fichiers DVF (.csv.gz)
-DVF_FOLDER = "./dvf_data/"
+# Les rapports stockés ne changent jamais (adressés par contenu) : cache client long
+REPORT_MAX_AGE = int(os.environ.get("REPORT_MAX_AGE_S", "86400"))
 
 # --- Nouvelle fonction de formatage des prix ---
 def format_price(value):
@@ -44,35 +88,6 @@ def format_price(value):
     except Exception:
         return str(value)
 
-def normalize_columns(df):
-    """
-    Nettoie et renomme toutes les colonnes DVF + fusionne adresse + force les types.
-    """
-    df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
-    rename_map = {
-        "valeur_fonciere": "valeur_fonciere",
-        "surface_reelle_bati": "surface_reelle_bati",
-        "date_mutation": "date_mutation",
-        "type_local": "type_local",
-        "code_postal": "code_postal",
-        "adresse_nom_voie": "nom_voie",
-        "adresse_numero": "numero_voie",
-    }
-    df = df.rename(columns=rename_map)
-    if "code_postal" in df.columns:
-        df["code_postal"] = df["code_postal"].apply(
-            lambda x: str(int(float(x))).zfill(5) if pd.notna(x) and str(x).replace('.', '', 1).isdigit() else None
-        )
-    if "numero_voie" in df.columns:
-        df["numero_voie"] = df["numero_voie"].astype(str).str.replace(r"\.0$", "", regex=True).str.strip()
-    if "nom_voie" in df.columns:
-        df["nom_voie"] = df["nom_voie"].astype(str).str.strip()
-    if "numero_voie" in df.columns and "nom_voie" in df.columns:
-        df["adresse"] = df["numero_voie"] + " " + df["nom_voie"]
-    elif "nom_voie" in df.columns:
-        df["adresse"] = df["nom_voie"]
-    return df
-
 def markdown_to_elements(md_text):
     elements = []
     html_content = md_to_html(md_text, extras=["tables"])
@@ -138,107 +153,256 @@ def style_resume(text):
     )
     return Paragraph(text, resume_style)
 
-def generate_estimation_section(prompt, min_tokens=800):
-    logging.info("Génération de la section d'estimation avec OpenAI...")
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {
-                "role": "system",
-                "content": (
-                    "Tu es un expert en immobilier en France. Ta mission est de rédiger un rapport d'analyse détaillé, synthétique et professionnel pour un bien immobilier. "
-                    "Le rapport doit comporter plusieurs sections détaillées et inclure :\n"
-                    "1. Une introduction personnalisée reprenant les informations du client (civilité, prénom, nom, adresse, etc.).\n"
-                    "2. Une comparaison des prix des biens récemment vendus dans le même secteur, avec des tableaux récapitulatifs (prix au m², rendement locatif, etc.).\n"
-                    "3. Des prévisions claires sur l'évolution du marché à 5 et 10 ans.\n"
-                    "4. Une description précise de la localisation du bien sur un plan.\n"
-                    "Utilise intelligemment les données fournies, rédige des phrases complètes et termine-les correctement. "
-                    "Ne répète pas inutilement le titre de la section ni des formules de salutation."
-                )
-            },
-            {"role": "user", "content": prompt}
-        ],
-        max_tokens=min_tokens,
-        temperature=0.8,
-    )
-    logging.info("Section générée par OpenAI.")
-    content = response.choices[0].message.content.strip()
+PROMPT_SYSTEME = (
+    "Tu es un expert en immobilier en France. Ta mission est de rédiger un rapport d'analyse détaillé, synthétique et professionnel pour un bien immobilier. "
+    "Le rapport doit comporter plusieurs sections détaillées et inclure :\n"
+    "1. Une introduction personnalisée reprenant les informations du client (civilité, prénom, nom, adresse, etc.).\n"
+    "2. Une comparaison des prix des biens récemment vendus dans le même secteur, avec des tableaux récapitulatifs (prix au m², rendement locatif, etc.).\n"
+    "3. Des prévisions claires sur l'évolution du marché à 5 et 10 ans.\n"
+    "4. Une description précise de la localisation du bien sur un plan.\n"
+    "Le client est désigné par le marqueur [CLIENT] : écris-le tel quel, sans lui donner de nom. "
+    "Utilise intelligemment les données fournies, rédige des phrases complètes et termine-les correctement. "
+    "Ne répète pas inutilement le titre de la section ni des formules de salutation."
+)
+
+async def rediger_section(prompt, min_tokens=800, personnalisation=None, cache=True, rafraichir=False):
+    """
+    Rédige une section (texte markdown) avec OpenAI. `prompt` peut contenir des marqueurs ([CLIENT]...) :
+    il est envoyé et mis en cache tel quel, les valeurs de `personnalisation` ne sont injectées
+    qu'après la lecture du cache. Une réponse qui cite malgré tout le client n'est pas stockée.
+    `cache=False` force un nouvel appel (et ne stocke pas la réponse) ; `rafraichir=True` force
+    un nouvel appel dont la réponse remplace celle du cache (régénération demandée par ?force=1).
+    Les accès SQLite au cache passent par un thread : ils ne bloquent pas la boucle (boucle LLM
+    ou boucle du service ASGI).
+    """
+    personnalisation = personnalisation or {}
+    params = {"max_tokens": min_tokens, "temperature": 0.8}
+    cle = cle_reponse("gpt-4", PROMPT_SYSTEME, prompt, **params)
+    with span("llm", max_tokens=min_tokens) as attributs:
+        modele = await asyncio.to_thread(llm_cache.get, cle) if cache and not rafraichir else None
+        attributs["cache"] = modele is not None
+        if modele is not None:
+            logging.info("♻️ Section servie par le cache LLM.")
+        else:
+            logging.info("Génération de la section d'estimation avec OpenAI...")
+            messages = [
+                {"role": "system", "content": PROMPT_SYSTEME},
+                {"role": "user", "content": prompt}
+            ]
+            response = await limiteur_openai.appeler(
+                lambda: async_client.chat.completions.create(model="gpt-4", messages=messages, **params),
+                messages, min_tokens,
+            )
+            logging.info("Section générée par OpenAI.")
+            usage = getattr(response, "usage", None)
+            if usage is not None:
+                attributs.update(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+                tokens_openai.inc(usage.prompt_tokens, type="prompt")
+                tokens_openai.inc(usage.completion_tokens, type="completion")
+            modele = response.choices[0].message.content.strip()
+            if cache and contient_identite(modele, personnalisation):
+                logging.warning("⚠️ Réponse citant le client : non stockée dans le cache LLM.")
+            elif cache:
+                await asyncio.to_thread(llm_cache.set, cle, modele)
+    content = personnaliser(modele, personnalisation)
     if not content.endswith(('.', '!', '?')):
         content += "."
     if "Cordialement," in content:
         content = content.split("Cordialement,")[0].strip()
-    return markdown_to_elements(content)
+    return content
 
-def resize_image(image_path, output_path, target_size=(469, 716)):
-    from PIL import Image as PILImage
-    with PILImage.open(image_path) as img:
-        img = img.resize(target_size, PILImage.LANCZOS)
-        img.save(output_path)
+# --- Pages de garde et de fin : préparées une seule fois, puis réutilisées ---
+COVER_IMAGES = ["static/cover_image.png", "static/cover_image1.png"]
+TAILLE_COUVERTURE = (469, 716)  # points
+asset_cache = DataFrameCache(max_bytes=int(os.environ.get("ASSET_CACHE_MAX_MB", "16")) * 1024 * 1024)
+
+def couvertures_disponibles():
+    return [path for path in COVER_IMAGES if os.path.exists(path)]
+
+def image_couverture(image_path, profil):
+    """Couverture encodée pour le profil PDF (ImageOptimisee), recalculée seulement si le fichier source change."""
+    def preparer(path):
+        image = encoder_couverture(path, TAILLE_COUVERTURE, profil)
+        logging.info(f"🖼️ Couverture préparée : {path} (profil {profil}, {image.nbytes / 1024:.0f} Ko)")
+        return image
+    return asset_cache.get(("image", image_path, profil), image_path, preparer)
 
 ### Fonction d'extraction DVF et création du tableau comparatif
+# Colonnes réellement utilisées par le tableau comparatif et l'estimation locale
+COMPARABLE_COLUMNS = ["id_mutation", "date_mutation", "valeur_fonciere", "adresse", "code_postal", "nom_commune",
+                      "type_local", "surface_reelle_bati", "surface_mutation"]
+# Graphiques PNG déjà rendus, par (code postal, type de bien)
+chart_cache = DataFrameCache(max_bytes=int(os.environ.get("CHART_CACHE_MAX_MB", "32")) * 1024 * 1024)
+# Recherche géographique des comparables autour du bien
+DVF_RAYON_M = int(os.environ.get("DVF_RAYON_M", "1000"))
+DVF_K_VOISINS = int(os.environ.get("DVF_K_VOISINS", "100"))
+
+def source_departement(dept_code):
+    """Chemin du fichier DVF brut d'un département (.csv.gz de préférence), ou None."""
+    file_path_gz = os.path.join(DVF_FOLDER, f"{dept_code}.csv.gz")
+    file_path_csv = os.path.join(DVF_FOLDER, f"{dept_code}.csv")
+    logging.info(f"Recherche du fichier DVF pour le département {dept_code}...")
+    if os.path.exists(file_path_gz):
+        return file_path_gz
+    if os.path.exists(file_path_csv):
+        return file_path_csv
+    return None
+
+def charger_departement(dept_code):
+    """
+    Renvoie l'index trié (voir dvf_index.py) de toutes les ventes DVF d'un département,
+    depuis l'entrepôt Parquet si le département a été ingéré (voir dvf_store.py), sinon
+    depuis le fichier départemental brut. L'index est construit une seule fois par
+    processus grâce au cache partagé (voir dvf_cache.py).
+    Renvoie (index, erreur).
+    """
+    store_path = department_path(dept_code)
+    if os.path.exists(store_path):
+        index = department_cache.get(("departement", dept_code), store_path,
+                                     lambda path: DvfIndex(pd.read_parquet(path)))
+        return index, None
+    source_path = source_departement(dept_code)
+    if source_path is None:
+        logging.error(f"Aucun fichier trouvé pour le département {dept_code}.")
+        return None, f"Aucun fichier trouvé pour le département {dept_code}."
+    index = department_cache.get(("departement", dept_code), source_path, lire_departement)
+    return index, None
+
+def departements_code_postal(code_postal):
+    """
+    Départements DVF couvrant un code postal, le plus fourni en ventes d'abord : index de
+    routage de l'entrepôt, sinon règle des préfixes (Corse, outre-mer, voir dvf_routage.py).
+    """
+    path = routage_path()
+    if os.path.exists(path):
+        return department_cache.get(("routage",), path, lire_routage).departements(code_postal)
+    return [departement_probable(code_postal)]
+
+def lire_partitions(paths):
+    """Index sur la réunion de plusieurs partitions (code postal à cheval sur deux départements)."""
+    df = pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+    return DvfIndex(df.astype({c: t for c, t in DVF_DTYPES.items() if c in df.columns}))
+
+def charger_index(code_postal):
+    """
+    Renvoie l'index des ventes DVF couvrant `code_postal` : la ou les partitions du code
+    postal si l'entrepôt existe, sinon l'index départemental complet (département principal).
+    Renvoie (index, erreur).
+    """
+    departements = departements_code_postal(code_postal)
+    partitions = [partition_path(dept_code, code_postal) for dept_code in departements]
+    if any(os.path.isdir(os.path.dirname(partition)) for partition in partitions):
+        partitions = [partition for partition in partitions if os.path.exists(partition)]
+        if not partitions:
+            return None, f"Aucune vente DVF pour le code postal {code_postal}."
+        if len(partitions) == 1:
+            index = department_cache.get(("partition", code_postal), partitions[0],
+                                         lambda path: DvfIndex(pd.read_parquet(path)))
+        else:
+            # L'index de routage est réécrit à chaque version : il sert de date de validité
+            index = department_cache.get(("partition", code_postal), routage_path(),
+                                         lambda _: lire_partitions(partitions))
+        return index, None
+    return charger_departement(departements[0])
+
+def lire_departement(source_path):
+    """Lit, normalise et indexe un fichier DVF départemental complet (chargeur du cache partagé)."""
+    logging.info(f"📂 Chargement du fichier DVF : {source_path}")
+    return DvfIndex(read_dvf_csv(source_path))
+
+def find_comparables(code_postal, type_bien=None, surface_range=None, limit=None, columns=None, adresse=None):
+    """
+    Ventes DVF d'un code postal, filtrées par type de bien, plage de surface et adresse via l'index trié.
+    Renvoie (df, erreur).
+    """
+    index, erreur = charger_index(code_postal)
+    if erreur:
+        return None, erreur
+    return index.find_comparables(code_postal, type_bien, surface_range, limit, columns, adresse), None
+
+def localiser_bien(form_data, index, code_postal, adresse):
+    """
+    (longitude, latitude) du bien : coordonnées transmises par le formulaire si présentes,
+    sinon position médiane des ventes DVF de la voie correspondant à l'adresse. None sinon.
+    """
+    try:
+        return float(form_data["longitude"]), float(form_data["latitude"])
+    except (KeyError, TypeError, ValueError):
+        pass
+    if adresse:
+        return index.localiser_adresse(code_postal, adresse)
+    return None
+
+def surface_formulaire(form_data):
+    """Surface du bien selon son type (0 si absente ou invalide)."""
+    try:
+        if form_data.get("type_bien") == "maison":
+            return float(form_data.get("maison_surface", 0))
+        elif form_data.get("type_bien") == "appartement":
+            return float(form_data.get("app_surface", 0))
+        elif form_data.get("type_bien") == "terrain":
+            return float(form_data.get("terrain_surface", 0))
+    except ValueError:
+        logging.warning("⚠️ Surface invalide ou non renseignée, filtrage DVF large appliqué.")
+    return 0
+
 def load_dvf_data_avance(form_data):
     try:
         start_time = time.time()
         code_postal = str(form_data.get("code_postal", "")).zfill(5)
         adresse = form_data.get("adresse", "").lower()
         type_bien = form_data.get("type_bien", "").capitalize()
-        surface_bien = 0
-        try:
-            if form_data.get("type_bien") == "maison":
-                surface_bien = float(form_data.get("maison_surface", 0))
-            elif form_data.get("type_bien") == "appartement":
-                surface_bien = float(form_data.get("app_surface", 0))
-            elif form_data.get("type_bien") == "terrain":
-                surface_bien = float(form_data.get("terrain_surface", 0))
-        except ValueError:
-            logging.warning("⚠️ Surface invalide ou non renseignée, filtrage DVF large appliqué.")
-            surface_bien = 0
-
-        dept_code = code_postal[:2]
-        file_path_gz = os.path.join(DVF_FOLDER, f"{dept_code}.csv.gz")
-        file_path_csv = os.path.join(DVF_FOLDER, f"{dept_code}.csv")
-        logging.info(f"Recherche du fichier DVF pour le département {dept_code}...")
-        if os.path.exists(file_path_gz):
-            logging.info(f"📂 Chargement du fichier GZ : {file_path_gz}")
-            df = pd.read_csv(file_path_gz, sep=",", low_memory=False)
-            logging.info("✅ Colonnes brutes : %s", df.columns.tolist())
-        elif os.path.exists(file_path_csv):
-            logging.info(f"📂 Chargement du fichier CSV : {file_path_csv}")
-            df = pd.read_csv(file_path_csv, sep=",", low_memory=False)
-            logging.info("✅ Colonnes brutes : %s", df.columns.tolist())
-        else:
-            logging.error(f"Aucun fichier trouvé pour le département {dept_code}.")
-            return None, f"Aucun fichier trouvé pour le département {dept_code}."
-        logging.info("🔍 Exemple brut code_postal (avant normalisation) : %s", df["code_postal"].dropna().astype(str).unique()[:10])
-        df = normalize_columns(df)
-        logging.info("✅ Colonnes après normalisation : %s", df.columns.tolist())
-        if "code_postal" in df.columns:
-            df["code_postal"] = df["code_postal"].astype(str).str.strip().str.zfill(5)
-            logging.info("🔍 code_postal après normalisation : %s", df["code_postal"].dropna().unique()[:10])
-        if "adresse" in df.columns:
-            logging.info("🔍 Exemple d'adresse après normalisation : %s", df["adresse"].dropna().unique()[:5])
-        df = df[df["code_postal"] == code_postal]
-        # --- Filtrage par type de bien (seulement Appartement, Maison ou Terrain) ---
-        if type_bien in ["Appartement", "Maison", "Terrain"]:
-            df = df[df["type_local"] == type_bien]
-        logging.info("📊 Lignes après filtrage type_local=%s : %d", type_bien, len(df))
-        df_initial = df.copy()
-        if adresse:
-            mots = adresse.lower().split()
-            df = df[df["adresse"].notna()]
-            df = df[df["adresse"].apply(lambda x: any(mot in x.lower() for mot in mots))]
-            logging.info(f"📊 Lignes après filtrage adresse='{adresse}' : {len(df)}")
-        if df.empty:
-            logging.warning("⚠️ Aucune correspondance sur l’adresse, on garde tous les biens du code postal.")
-            df = df_initial
-        if "surface_reelle_bati" not in df.columns or "valeur_fonciere" not in df.columns:
-            logging.error("❌ Colonnes 'surface_reelle_bati' ou 'valeur_fonciere' absentes !")
-            return None, "Colonnes manquantes"
-        df = df[(df["surface_reelle_bati"] > 10) & (df["valeur_fonciere"] > 1000)]
-        if surface_bien > 0:
-            df = df[df["surface_reelle_bati"].between(surface_bien * 0.7, surface_bien * 1.3)]
-        df["prix_m2"] = df["valeur_fonciere"] / df["surface_reelle_bati"]
-        df = df.sort_values(by="date_mutation", ascending=False)
+        surface_bien = surface_formulaire(form_data)
+
+        if type_bien not in ["Appartement", "Maison", "Terrain"]:
+            type_bien = None
+        surface_range = (surface_bien * 0.7, surface_bien * 1.3) if surface_bien > 0 else None
+        # --- Filtrage par type de bien (seulement Appartement, Maison ou Terrain) et surface via l'index ---
+        with span("chargement_dvf", code_postal=code_postal):
+            index, erreur = charger_index(code_postal)
+        if erreur:
+            return None, erreur
+        with span("filtrage_dvf"):
+            df = index.find_comparables(code_postal, type_bien, surface_range, columns=COMPARABLE_COLUMNS)
+            logging.info("📊 Lignes après filtrage type_local=%s : %d", type_bien, len(df))
+            point = localiser_bien(form_data, index, code_postal, adresse)
+        dept_indexes = []
+        if point is not None:
+            # --- Ventes les plus proches du bien, y compris hors du code postal ---
+            for dept_code in departements_code_postal(code_postal):
+                with span("chargement_dvf", departement=dept_code):
+                    dept_index, erreur = charger_departement(dept_code)
+                if dept_index is not None:
+                    dept_indexes.append(dept_index)
+        with span("filtrage_dvf") as attributs:
+            if dept_indexes:
+                proches = [dept_index.find_nearby(point[0], point[1], type_bien, surface_range,
+                                                  rayon_m=DVF_RAYON_M, k=DVF_K_VOISINS, columns=COMPARABLE_COLUMNS)
+                           for dept_index in dept_indexes]
+                proches = [df_dept for df_dept in proches if not df_dept.empty] or proches[:1]
+                df_proches = proches[0] if len(proches) == 1 else (
+                    pd.concat(proches, ignore_index=True).sort_values("distance_m", kind="stable").head(DVF_K_VOISINS))
+                logging.info(f"📍 Lignes à moins de {DVF_RAYON_M} m du bien : {len(df_proches)}")
+                if df_proches.empty:
+                    logging.warning("⚠️ Aucune vente à proximité, on garde tous les biens du code postal.")
+                else:
+                    df = df_proches
+            elif point is None and adresse:
+                # --- Filtrage par adresse : index inversé des noms de voie, meilleur score uniquement ---
+                df_adresse = index.find_comparables(code_postal, type_bien, surface_range, columns=COMPARABLE_COLUMNS,
+                                                    adresse=adresse)
+                logging.info(f"📊 Lignes après filtrage adresse='{adresse}' : {len(df_adresse)}")
+                if df_adresse.empty:
+                    logging.warning("⚠️ Aucune correspondance sur l’adresse, on garde tous les biens du code postal.")
+                else:
+                    df = df_adresse
+            if "surface_reelle_bati" not in df.columns or "valeur_fonciere" not in df.columns:
+                logging.error("❌ Colonnes 'surface_reelle_bati' ou 'valeur_fonciere' absentes !")
+                return None, "Colonnes manquantes"
+            df = df[(df["surface_reelle_bati"] > 10) & (df["valeur_fonciere"] > 1000)]
+            df = df.assign(prix_m2=df["valeur_fonciere"] / df["surface_reelle_bati"])
+            df = df.sort_values(by="date_mutation", ascending=False)
+            attributs["lignes"] = len(df)
         elapsed = time.time() - start_time
         logging.info(f"✅ Chargement DVF terminé en {elapsed:.2f}s ({len(df)} lignes après filtrage).")
         return df, None
@@ -246,12 +410,41 @@ def load_dvf_data_avance(form_data):
         logging.error(f"❌ Erreur dans load_dvf_data_avance: {str(e)}")
         return None, f"Erreur DVF : {str(e)}"
 
+def evaluer_bien(form_data, df):
+    """
+    Estimation locale (voir dvf_estimation.py) du bien sur ses comparables filtrés, ou None,
+    y compris quand elle n'est pas fiable : le rapport et le prompt s'appuient alors sur le
+    tableau des comparables.
+    """
+    code_postal = str(form_data.get("code_postal", "")).zfill(5)
+    type_bien = form_data.get("type_bien", "").capitalize()
+    with span("estimation_locale") as attributs:
+        serie, erreur = serie_prix_m2(code_postal, type_bien if type_bien in ["Appartement", "Maison", "Terrain"] else None)
+        valeur = estimer_valeur(df, surface_formulaire(form_data), None if erreur else indice_annuel(serie))
+        attributs["comparables"] = valeur["comparables"] if valeur else 0
+    if valeur:
+        logging.info(f"🧮 Estimation locale : {format_price(valeur['bas'])} - {format_price(valeur['haut'])} € "
+                     f"(confiance {valeur['confiance']}, {valeur['comparables']} comparables).")
+        if not estimation_fiable(valeur):
+            logging.warning("⚠️ Estimation locale peu fiable, non utilisée : tableau des comparables seul.")
+            return None
+    return valeur
+
 def get_dvf_comparables(form_data):
+    """
+    Tableau des 10 dernières ventes similaires (markdown) et estimation locale du bien
+    (dict, ou None si les données ne le permettent pas), sur un seul filtrage DVF.
+    """
     try:
         df, erreur = load_dvf_data_avance(form_data)
         if erreur or df is None or df.empty:
             logging.warning("Aucune donnée DVF trouvée après filtrage.")
-            return f"Données indisponibles pour cette estimation. Erreur : {erreur or 'Aucune donnée trouvée.'}"
+            return f"Données indisponibles pour cette estimation. Erreur : {erreur or 'Aucune donnée trouvée.'}", None
+        try:
+            estimation_locale = evaluer_bien(form_data, df)
+        except Exception as e:
+            logging.error(f"Erreur dans evaluer_bien: {str(e)}")
+            estimation_locale = None
         df["prix_m2"] = df["valeur_fonciere"] / df["surface_reelle_bati"]
         df = df.sort_values(by="date_mutation", ascending=False).head(10)
         table_md = "| Adresse | Ville | Type de bien | Surface (m²) | Prix (€) | Prix/m² (€) |\n"
@@ -265,56 +458,130 @@ def get_dvf_comparables(form_data):
             prix_m2 = row.get("prix_m2", 0)
             table_md += f"| {adresse} | {ville} | {type_local} | {surface:.0f} | {format_price(valeur)} | {format_price(prix_m2)} |\n"
         logging.info("Tableau comparatif DVF généré.")
-        return f"Voici les 10 dernières transactions similaires pour ce secteur :\n\n{table_md}"
+        return f"Voici les 10 dernières transactions similaires pour ce secteur :\n\n{table_md}", estimation_locale
     except Exception as e:
         logging.error(f"Erreur dans get_dvf_comparables: {str(e)}")
-        return f"Données indisponibles pour cette estimation. Erreur : {str(e)}"
+        return f"Données indisponibles pour cette estimation. Erreur : {str(e)}", None
+
+def serie_prix_m2(code_postal, type_bien=None):
+    """
+    Indicateurs de prix au m² (annuels et trimestriels) d'un code postal, toutes communes
+    confondues, pour un type de bien (ou tous types). Lus dans les agrégats calculés à
+    l'ingestion (voir dvf_store.compute_aggregates), sinon calculés à la volée.
+    Renvoie (df, erreur).
+    """
+    departements = departements_code_postal(code_postal)
+    path = aggregates_path(departements[0])
+    if len(departements) == 1 and os.path.exists(path):
+        aggregates = department_cache.get(("agregats", departements[0]), path, pd.read_parquet)
+    else:
+        # Sans agrégats, ou code postal sur plusieurs départements : calcul sur ses seules ventes
+        index, erreur = charger_index(code_postal)
+        if erreur:
+            return None, erreur
+        aggregates = compute_aggregates(index.find_comparables(code_postal))
+    serie = aggregates[(aggregates["code_postal"] == code_postal)
+                       & (aggregates["nom_commune"] == TOUTES_COMMUNES)
+                       & (aggregates["type_local"] == (type_bien or TOUS_TYPES))]
+    return serie.sort_values(["annee", "trimestre"]), None
+
+def resume_marche(form_data):
+    """Résumé en une ligne de l'évolution du prix médian au m², pour les prompts d'analyse."""
+    code_postal = str(form_data.get("code_postal", "")).zfill(5)
+    type_bien = form_data.get("type_bien", "").capitalize()
+    if type_bien not in ["Appartement", "Maison", "Terrain"]:
+        type_bien = None
+    try:
+        serie, erreur = serie_prix_m2(code_postal, type_bien)
+    except Exception as e:
+        logging.error(f"Erreur dans resume_marche: {str(e)}")
+        return "indisponible"
+    if erreur or serie.empty:
+        return "indisponible"
+    return ", ".join(
+        f"{row.annee}{f' T{row.trimestre}' if row.trimestre else ''} : {format_price(row.prix_m2_median)} €/m² "
+        f"({row.nb_ventes} ventes, p25-p75 {format_price(row.prix_m2_p25)}-{format_price(row.prix_m2_p75)})"
+        for row in serie.itertuples()
+    )
+
+GRAPHIQUE_TAILLE = (400, 300)  # points, dans le rapport
+
+def rendre_graphique_dvf(code_postal, type_bien, profil):
+    """
+    Trace l'évolution du prix médian au m² et renvoie l'image PNG (bytes, vide si aucune
+    donnée) à la résolution du profil PDF. Utilise l'API objet de Matplotlib (Figure + Agg) :
+    aucun état global pyplot, donc sûr depuis les threads de génération.
+    """
+    start_time = time.time()
+    serie, erreur = serie_prix_m2(code_postal, type_bien)
+    if erreur:
+        raise ValueError(erreur)
+    if serie.empty:
+        logging.warning(f"Aucune vente exploitable pour le graphique du code postal {code_postal}.")
+        return b""
+    # Une seule année de données : on trace l'évolution trimestrielle
+    annuel = serie[serie["trimestre"] == 0]
+    if len(annuel) >= 2:
+        labels = annuel["annee"].astype(str).tolist()
+        valeurs = annuel["prix_m2_median"].round(0).tolist()
+        xlabel = "Année"
+    else:
+        trimestriel = serie[serie["trimestre"] > 0]
+        labels = [f"{a} T{t}" for a, t in zip(trimestriel["annee"], trimestriel["trimestre"])]
+        valeurs = trimestriel["prix_m2_median"].round(0).tolist()
+        xlabel = "Trimestre"
+    fig = Figure(figsize=(8, 5))
+    ax = fig.subplots()
+    positions = range(len(labels))
+    ax.plot(positions, valeurs, marker="o", linestyle="-",
+            color="#00C7C4", markerfacecolor="#007A7E", markeredgecolor="white")
+    ax.set_xticks(positions, labels)
+    ax.set_title(f"Évolution du prix médian au m² - {code_postal}", fontsize=14, color="#333333")
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel("Prix médian au m² (€)", fontsize=12)
+    ax.grid(True, linestyle="--", alpha=0.6)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    # Largeur de la figure en pouces -> largeur affichée dans le rapport à dpi_graphique
+    fig.savefig(buffer, format="png", dpi=PROFILS_PDF[profil]["dpi_graphique"] * GRAPHIQUE_TAILLE[0] / 72 / 8)
+    png = encoder_graphique(buffer.getvalue(), profil)
+    elapsed = time.time() - start_time
+    logging.info(f"🎨 Graphique DVF {code_postal}/{type_bien or 'Tous'} rendu en {elapsed:.3f}s.")
+    return png
 
 def generate_dvf_chart(form_data):
+    """
+    Graphique d'évolution des prix pour le formulaire, sous forme de flux PNG en mémoire
+    (ou None). Les rendus sont mis en cache par (code postal, type de bien) et invalidés
+    quand les données DVF du département changent sur disque.
+    """
     try:
         start_time = time.time()
         code_postal = str(form_data.get("code_postal", "")).zfill(5)
         if not code_postal or not code_postal.isdigit() or len(code_postal) < 2:
             logging.warning("Code postal invalide.")
             return None
-        dept_code = code_postal[:2]
-        dvf_path = os.path.join(DVF_FOLDER, f"{dept_code}.csv.gz")
-        if not os.path.exists(dvf_path):
-            logging.error(f"Fichier DVF non trouvé pour le département {dept_code}.")
+        type_bien = form_data.get("type_bien", "").capitalize()
+        if type_bien not in ["Appartement", "Maison", "Terrain"]:
+            type_bien = None
+        departements = departements_code_postal(code_postal)
+        # Version des données = fichier dont le graphique est issu (agrégats, index de routage
+        # pour un code postal sur plusieurs départements, ou fichier brut)
+        version_path = aggregates_path(departements[0]) if len(departements) == 1 else routage_path()
+        if not os.path.exists(version_path):
+            version_path = source_departement(departements[0])
+        if version_path is None:
+            logging.error(f"Fichier DVF non trouvé pour le département {departements[0]}.")
             return None
-        logging.info(f"Chargement du fichier DVF pour le graphique: {dvf_path}")
-        df = pd.read_csv(dvf_path, compression="gzip", low_memory=False)
-        df = normalize_columns(df)
-        if "code_postal" not in df.columns:
-            logging.error("❌ La colonne 'code_postal' est absente du fichier après normalisation.")
+        profil = profil_pdf(form_data)
+        with span("graphique", code_postal=code_postal):
+            png = chart_cache.get(("graphique", code_postal, type_bien, profil), version_path,
+                                  lambda _: rendre_graphique_dvf(code_postal, type_bien, profil))
+        if not png:
             return None
-        df["code_postal"] = df["code_postal"].str.strip()
-        code_postal = str(form_data.get("code_postal", "")).zfill(5)
-        type_bien = form_data.get("type_bien", "").capitalize()
-        df = df[df["code_postal"] == code_postal]
-        # --- Filtrage par type de bien dans le graphique ---
-        if type_bien in ["Appartement", "Maison", "Terrain"]:
-            df = df[df["type_local"] == type_bien]
-        df = df[(df["surface_reelle_bati"] > 10) & (df["valeur_fonciere"] > 1000)]
-        df["prix_m2"] = df["valeur_fonciere"] / df["surface_reelle_bati"]
-        df["date_mutation"] = pd.to_datetime(df["date_mutation"], errors="coerce")
-        df = df.dropna(subset=["date_mutation"])
-        df["année"] = df["date_mutation"].dt.year
-        prix_m2_par_annee = df.groupby("année")["prix_m2"].mean().round(0)
-        plt.figure(figsize=(8, 5))
-        plt.plot(prix_m2_par_annee.index, prix_m2_par_annee.values, marker="o", linestyle="-", 
-                 color="#00C7C4", markerfacecolor="#007A7E", markeredgecolor="white")
-        plt.title(f"Évolution du prix moyen au m² - {code_postal}", fontsize=14, color="#333333")
-        plt.xlabel("Année", fontsize=12)
-        plt.ylabel("Prix moyen au m² (€)", fontsize=12)
-        plt.grid(True, linestyle="--", alpha=0.6)
-        plt.tight_layout()
-        tmp_img = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-        plt.savefig(tmp_img.name)
-        plt.close()
         elapsed = time.time() - start_time
         logging.info(f"📈 Graphique DVF généré en {elapsed:.2f} secondes.")
-        return tmp_img.name
+        return io.BytesIO(png)
     except Exception as e:
         logging.error(f"💥 Erreur dans generate_dvf_chart : {str(e)}")
         return None
@@ -351,294 +618,577 @@ def center_image(image_path, width=400, height=300):
     img.hAlign = 'CENTER'
     return img
 
-# --- Fonctions pour la génération section par section et la fusion ---
-from PyPDF2 import PdfMerger
+# --- Construction du rapport en une seule passe ---
+TEXTE_INTRO_FIXE = """
+Nous vous remercions sincèrement pour la confiance que vous nous accordez en nous confiant l’évaluation de votre bien.  
+Nos experts immobiliers ont réalisé une analyse complète et personnalisée, fondée sur les informations que vous nous avez transmises, ainsi que sur une étude approfondie des données de ventes récentes dans votre secteur (données DVF). Ce rapport vise à vous offrir une estimation aussi précise que possible de la valeur actuelle de votre bien, en le comparant à des propriétés similaires récemment vendues, tout en intégrant une projection de l’évolution du marché à moyen et long terme.  
+
+Nous espérons que ce document répondra pleinement à vos attentes et contribuera à éclairer vos réflexions et vos décisions.  
+Nous restons bien entendu à votre disposition pour tout complément d'information.  
+
+Nous vous souhaitons une excellente lecture.  
+Bien à vous.
+"""
+
+def texte_brut(md_text):
+    """Texte affiché d'une section markdown (sans balises), pour en mesurer la longueur."""
+    texte = ""
+    for flowable in markdown_to_elements(md_text):
+        try:
+            texte += flowable.getPlainText() + " "
+        except AttributeError:
+            pass
+    return texte
+
+async def rediger_estimation(prompt, personnalisation, min_tokens=600, rafraichir=False):
+    """Estimation, complétée par un second appel si le texte obtenu est trop court."""
+    estimation = await rediger_section(prompt, min_tokens=min_tokens, personnalisation=personnalisation,
+                                       rafraichir=rafraichir)
+    if len(texte_brut(estimation)) < 500:
+        # cache=False : prompt identique pour tous les rapports, on garde des réponses variées
+        continuation = await rediger_section(
+            "Continue l'analyse pour compléter l'estimation du bien.", min_tokens=300,
+            personnalisation=personnalisation, cache=False
+        )
+        estimation += "\n\n" + continuation
+    return estimation
+
+def personnalisation_client(form_data):
+    """Les prompts désignent le client par des marqueurs : le cache LLM sert tous les clients."""
+    signature = f"{form_data.get('civilite', '')} {form_data.get('prenom', '')} {form_data.get('nom', '')}"
+    return {"[CLIENT]": signature, "[PRENOM]": form_data.get("prenom") or "", "[NOM]": form_data.get("nom") or ""}
+
+def redaction_recommandation(form_data, rafraichir=False):
+    """Les recommandations ignorent le contexte : elles peuvent partir avant tout le reste."""
+    return rediger_section(
+        "Oubliez tout le contexte précédent. À partir de zéro, fournissez uniquement une recommandation pratique et concise pour optimiser la vente du bien de [CLIENT]. "
+        "Donnez une seule phrase complète qui indique le meilleur positionnement du prix et la stratégie de mise en marché idéale. "
+        "N'incluez aucune estimation de prix ni analyse détaillée du marché. Terminez correctement la phrase.",
+        min_tokens=300, personnalisation=personnalisation_client(form_data), rafraichir=rafraichir
+    )
+
+def lancer_recommandation(form_data, rafraichir=False):
+    return lancer_llm(redaction_recommandation(form_data, rafraichir))
+
+def resume_estimation(valeur):
+    """Estimation locale en une phrase : tout ce que le prompt d'estimation reçoit des données DVF."""
+    return (f"fourchette {format_price(valeur['bas'])} € - {format_price(valeur['haut'])} €, valeur médiane "
+            f"{format_price(valeur['median'])} € ({format_price(valeur['prix_m2_bas'])} - "
+            f"{format_price(valeur['prix_m2_haut'])} €/m², médiane {format_price(valeur['prix_m2_median'])} €/m²), "
+            f"calculée sur {valeur['comparables']} ventes comparables pondérées par surface, ancienneté et distance, "
+            f"prix actualisés ; confiance {niveau_confiance(valeur['confiance'])} ({valeur['confiance']:.2f}).")
+
+def prompt_estimation(form_data, dvf_table_md, valeur=None):
+    """
+    (prompt, min_tokens) de l'estimation, qui dépend seulement des données DVF. Avec une
+    estimation locale (`valeur`), le chiffrage est déjà fait : le modèle reçoit la fourchette
+    et la commente.
+    """
+    bien = (
+        f"- Type : {form_data.get('type_bien', '')}\n"
+        f"- Surface : {form_data.get('app_surface') or form_data.get('maison_surface') or form_data.get('terrain_surface', '')} m²\n"
+        f"- Quartier : {form_data.get('quartier', '')}, Code postal : {form_data.get('code_postal', '')}\n"
+        f"- État : {form_data.get('etat_general', '')}, Travaux : {form_data.get('travaux_recent', '')} ({form_data.get('travaux_details', '')})\n"
+        f"- Historique : temps sur le marché ({form_data.get('temps_marche', '')}), offres : {form_data.get('offres', '')}, raison de vente : {form_data.get('raison_vente', '')}\n"
+        f"- Marché (prix médian au m²) : {resume_marche(form_data)}\n"
+        f"- Prix similaires : {form_data.get('prix_similaires', '')}, Prix visé : {form_data.get('prix', '')} (négociable : {form_data.get('negociation', '')}).\n"
+    )
+    if valeur:
+        return (
+            f"Estimation calculée à partir des ventes DVF : {resume_estimation(valeur)}\n\n"
+            "Commente cette estimation pour le bien de [CLIENT] :\n" + bien +
+            "Reprends la fourchette telle quelle sans la recalculer, explique-la au regard des caractéristiques "
+            "du bien et du marché, et précise ce qui pourrait la faire varier. Terminez toutes les phrases.",
+            400
+        )
+    return (
+        f"Voici les données DVF extraites :\n{dvf_table_md}\n\n"
+        "Analyse en détail ces données pour estimer la valeur réelle du bien de [CLIENT] :\n" + bien +
+        "Donnez une estimation chiffrée sous forme de fourchette précise. Terminez toutes les phrases.",
+        600
+    )
+
+def lancer_estimation(form_data, dvf_table_md, valeur=None, rafraichir=False):
+    prompt, min_tokens = prompt_estimation(form_data, dvf_table_md, valeur)
+    return lancer_llm(rediger_estimation(prompt, personnalisation_client(form_data), min_tokens, rafraichir))
 
-def generer_pdf_section(titre, elements):
+def analyse_dvf(form_data):
     """
-    Génère un PDF pour une section donnée avec les marges standard.
-    Si 'titre' est vide, aucun titre ne sera ajouté.
+    Comparables (tableau markdown), estimation locale et prompt d'estimation, qui lit aussi
+    la série DVF : résultat picklable, pour un pool de processus (voir mon_projet/app.py).
     """
-    temp_pdf = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
-    doc = SimpleDocTemplate(temp_pdf.name, pagesize=A4,
-                            topMargin=2*cm, bottomMargin=2*cm,
-                            leftMargin=2*cm, rightMargin=2*cm)
+    dvf_table_md, valeur = get_dvf_comparables(form_data)
+    return dvf_table_md, valeur, prompt_estimation(form_data, dvf_table_md, valeur)
+
+def graphique_dvf(form_data):
+    """Graphique DVF en PNG (bytes) ou None, pour un pool de processus."""
+    dvf_chart = generate_dvf_chart(form_data)
+    return dvf_chart.getvalue() if dvf_chart else None
+
+def attendre_redaction(estimation, recommandation):
+    """Textes (estimation, recommandation) ; si l'un échoue, l'autre est annulé."""
+    try:
+        return estimation.result(), recommandation.result()
+    finally:
+        estimation.cancel()
+        recommandation.cancel()
+
+def calculer_contenu(form_data, progression=None, force=False):
+    """
+    Contenu variable du rapport : tableau DVF (markdown), graphique (PNG ou None) et
+    textes OpenAI. Les appels OpenAI tournent sur la boucle LLM pendant le chargement
+    DVF et le rendu du graphique. Le résultat est picklable (rendu dans un autre processus).
+    `force` : textes régénérés sans lire le cache LLM (les nouveaux y remplacent les anciens).
+    """
+    progression = progression or (lambda etape, pourcentage: None)
+    progression("donnees_dvf", 10)
+    recommandation = lancer_recommandation(form_data, force)
+    dvf_table_md, valeur = get_dvf_comparables(form_data)
+    estimation = lancer_estimation(form_data, dvf_table_md, valeur, force)
+    dvf_chart = generate_dvf_chart(form_data)
+    progression("redaction", 60)
+    with span("attente_redaction"):
+        textes = attendre_redaction(estimation, recommandation)
+    progression("mise_en_page", 90)
+    return {
+        "dvf_table_md": dvf_table_md,
+        "valeur": valeur,
+        "graphique": dvf_chart.getvalue() if dvf_chart else None,
+        "estimation": textes[0],
+        "recommandation": textes[1],
+    }
+
+def composer_sections(form_data, contenu):
+    """
+    Liste ordonnée des sections du rapport : (modèle de page, titre, flowables).
+    Les modèles "couverture" et "fin" sont des pages dessinées par rendre_rapport.
+    """
+    sections = [("couverture", "", [])]
+
+    # Section 1 : Résumé du questionnaire (amélioré)
+    résumé = ""
+    for key, value in form_data.items():
+        if key != "profil_pdf" and isinstance(value, str) and value.strip():
+            label = key.replace("_", " ").capitalize()
+            résumé += f"<b>{label} :</b> {value.strip()}<br/>"
+    sections.append(("section", "Résumé du Questionnaire", [style_resume(résumé.strip())]))
+
+    # Section 2 : Introduction (texte fixe)
+    section_intro = [Paragraph(p.strip(), getSampleStyleSheet()["BodyText"]) for p in TEXTE_INTRO_FIXE.strip().split("\n") if p.strip()]
+    sections.append(("section", "Introduction", section_intro))
+
+    # Section 3 : Analyse des Données DVF
+    with span("section", titre="Analyse des Données DVF"):
+        section_dvf = markdown_to_elements(contenu["dvf_table_md"])
+        if contenu["graphique"]:
+            section_dvf.append(Spacer(1, 12))
+            section_dvf.append(center_image(io.BytesIO(contenu["graphique"]), *GRAPHIQUE_TAILLE))
+            section_dvf.append(Paragraph("Évolution du prix médian au m²", getSampleStyleSheet()['Heading3']))
+    sections.append(("section", "Analyse des Données DVF", section_dvf))
+
+    # Section 4 : Estimation & Analyse (fourchette calculée en tête, puis le commentaire)
+    with span("section", titre="Estimation & Analyse"):
+        section_estimation = []
+        valeur = contenu.get("valeur")
+        if valeur:
+            section_estimation += create_highlighted_box(
+                f"<b>Estimation : {format_price(valeur['bas'])} € - {format_price(valeur['haut'])} €</b> "
+                f"(valeur médiane {format_price(valeur['median'])} €, {format_price(valeur['prix_m2_median'])} €/m²)<br/>"
+                f"Confiance {niveau_confiance(valeur['confiance'])}, {valeur['comparables']} ventes comparables."
+            )
+        section_estimation += markdown_to_elements(contenu["estimation"])
+        sections.append(("section", "Estimation & Analyse", section_estimation))
+
+    # Section 5 : Recommandations (seulement une recommandation en une phrase)
+    with span("section", titre="Recommandations"):
+        sections.append(("section", "Recommandations", markdown_to_elements(contenu["recommandation"])))
+
+    # Page de fin
+    sections.append(("fin", "", []))
+    sections.append(("section", "", [Paragraph("Cordialement, Expert immobilier.", getSampleStyleSheet()["BodyText"])]))
+    return sections
+
+def preparer_sections(form_data, progression=None):
+    """Contenu calculé puis mis en page : sections prêtes pour rendre_rapport."""
+    return composer_sections(form_data, calculer_contenu(form_data, progression))
+
+def dessiner_couverture(image, canvas, doc):
+    """Dessine une couverture pleine page (même position que l'ancienne image en tête de cadre)."""
+    width, height = TAILLE_COUVERTURE
+    x = doc.leftMargin + (doc.width - width) / 2
+    y = doc.bottomMargin + doc.height - 6 - height
+    canvas.drawImage(image, x, y, width=width, height=height)
+
+def rendre_rapport(sections, output, profil, references=()):
+    """
+    Rend toutes les sections en un seul `doc.build` (chemin ou flux binaire `output`).
+    Chaque section commence sur une nouvelle page ; les couvertures sont des modèles de page.
+    Renvoie les attributs du rendu : pages et, pour un flux en mémoire, le bilan de taille
+    (`references` : coût d'origine des images hors couvertures, voir pdf_optimisation.py).
+    """
+    # invariant : pas d'horodatage ni d'identifiant aléatoire, un même contenu donne
+    # les mêmes octets (et donc la même empreinte dans le stockage des rapports)
+    doc = BaseDocTemplate(output, pagesize=A4, invariant=True,
+                          topMargin=2*cm, bottomMargin=2*cm,
+                          leftMargin=2*cm, rightMargin=2*cm)
+    frame = Frame(doc.leftMargin, doc.bottomMargin, doc.width, doc.height, id="normal")
+    covers = {template_id: image_couverture(image_path, profil)
+              for template_id, image_path in zip(["couverture", "fin"], couvertures_disponibles())}
+    templates = {"section": PageTemplate(id="section", frames=[frame])}
+    for template_id, image in covers.items():
+        # Un lecteur par image et par document : JPEG décodé une fois, embarqué une fois
+        templates[template_id] = PageTemplate(id=template_id, frames=[frame],
+                                              onPage=partial(dessiner_couverture, ImageReader(io.BytesIO(image.donnees))))
+    sections = [section for section in sections if section[0] in templates]
+    if not sections:
+        raise ValueError("Rapport vide")
+    # Le premier modèle de la liste est celui de la première page
+    first = sections[0][0]
+    doc.addPageTemplates([templates[first]] + [t for tid, t in templates.items() if tid != first])
+
     story = []
-    if titre:
-        add_section_title(story, titre)
-    story.extend(elements)
-    doc.build(story)
-    return temp_pdf.name
-
-def assembler_pdf(fichiers_pdf, pdf_final_path):
-    """Fusionne une liste de PDF en un seul document final."""
-    merger = PdfMerger()
-    for pdf in fichiers_pdf:
-        merger.append(pdf)
-    with open(pdf_final_path, "wb") as fout:
-        merger.write(fout)
+    for i, (template_id, titre, elements) in enumerate(sections):
+        if i:
+            story.append(NextPageTemplate(template_id))
+            story.append(PageBreak())
+        if titre:
+            add_section_title(story, titre)
+        story.extend(elements)
+    with span("rendu_pdf") as attributs:
+        doc.build(story)
+        attributs["pages"] = doc.page
+        if isinstance(output, io.BytesIO):
+            utilisees = {template_id for template_id, _, _ in sections} & covers.keys()
+            references = list(references) + [covers[template_id].octets_reference for template_id in utilisees]
+            attributs.update(bilan_taille(output.getvalue(), references, profil))
+    return attributs
+
+def rendre_pdf(form_data, contenu, output=None):
+    """
+    Met en page et rend le rapport ; sans `output`, renvoie le PDF en bytes.
+    Fonction de module : utilisable depuis un pool de processus (voir traiter_lot).
+    """
+    start_time = time.time()
+    buffer = io.BytesIO() if output is None else None
+    references = [cout_reference(contenu["graphique"])] if contenu["graphique"] else []
+    rendu = rendre_rapport(composer_sections(form_data, contenu), output or buffer, profil_pdf(form_data), references)
+    if "octets" in rendu:
+        logging.info(f"📄 PDF rendu en une passe en {time.time() - start_time:.2f}s : {rendu['octets'] / 1024:.0f} Ko "
+                     f"(profil {rendu['profil']}, {rendu['octets_sans_optimisation'] / 1024:.0f} Ko sans optimisation, "
+                     f"-{rendu['reduction']:.0%}).")
+    else:
+        logging.info(f"📄 PDF rendu en une passe en {time.time() - start_time:.2f}s.")
+    return buffer.getvalue() if buffer is not None else None
+
+def construire_rapport(form_data, output=None, progression=None, force=False):
+    """
+    Pipeline unique des endpoints synchrone et asynchrone : contenu puis rendu en une passe.
+    Sans `output`, renvoie le PDF en bytes (aucun fichier intermédiaire).
+    """
+    return rendre_pdf(form_data, calculer_contenu(form_data, progression, force), output)
+
+def nom_rapport(form_data):
+    """Nom proposé au téléchargement (le stockage, lui, est adressé par contenu)."""
+    return f"estimation_{str(form_data.get('nom') or 'Client').replace(' ', '_')}.pdf"
+
+def envoyer_rapport(empreinte, nom_fichier, suffixe=".pdf"):
+    """Sert un rapport stocké : ETag = empreinte du contenu, requêtes conditionnelles et Range."""
+    path = report_store.chemin(empreinte, suffixe)
+    if not os.path.exists(path):
+        return jsonify({"error": "Rapport expiré ou introuvable"}), 404
+    response = send_file(path, as_attachment=True, download_name=nom_fichier, etag=empreinte,
+                         conditional=True, max_age=REPORT_MAX_AGE)
+    response.headers["Cache-Control"] = f"private, max-age={REPORT_MAX_AGE}, immutable"
+    return response
+
+# --- Traitement par lot ---
+BATCH_PROCESSUS = int(os.environ.get("BATCH_PROCESSUS", str(os.cpu_count() or 2)))
+BATCH_MAX_BIENS = int(os.environ.get("BATCH_MAX_BIENS", "500"))
+
+def lire_lot(texte):
+    """Formulaires d'un lot : JSONL (un objet JSON par ligne) ou CSV avec en-tête."""
+    texte = texte.lstrip("\ufeff").strip()
+    if texte.startswith("{"):
+        return [json.loads(ligne) for ligne in texte.splitlines() if ligne.strip()]
+    return [{cle: valeur for cle, valeur in ligne.items() if valeur} for ligne in csv.DictReader(io.StringIO(texte))]
+
+def nom_fichier_lot(position, form_data):
+    nom = str(form_data.get("nom") or "Client").replace(" ", "_").replace("/", "_")
+    return f"{position + 1:03d}_estimation_{nom}.pdf"
+
+def criteres_comparables(form_data):
+    """Champs du formulaire dont dépendent les comparables et l'estimation locale (voir load_dvf_data_avance)."""
+    return (str(form_data.get("code_postal", "")).zfill(5), form_data.get("type_bien", "").capitalize(),
+            surface_formulaire(form_data), form_data.get("adresse", "").lower(),
+            form_data.get("longitude"), form_data.get("latitude"))
+
+def comparables_groupe(formulaires, positions):
+    """
+    Comparables d'un groupe du lot en une passe : les index que lit charger_index (partitions
+    des codes postaux du groupe) et les agrégats sont chargés d'abord, puis chaque jeu de
+    critères distinct n'est filtré et estimé qu'une fois, quel que soit le nombre de biens
+    qui le partagent. Renvoie {position: (tableau markdown, estimation locale)}.
+    """
+    codes_postaux = sorted({str(formulaires[i].get("code_postal", "")).zfill(5) for i in positions})
+    with span("chargement_dvf", codes_postaux=len(codes_postaux)):
+        for code_postal in codes_postaux:
+            try:
+                charger_index(code_postal)
+                serie_prix_m2(code_postal)
+            except Exception as e:
+                logging.warning(f"⚠️ Préchargement DVF impossible pour {code_postal} : {str(e)}")
+    resultats = {}
+    comparables = {}
+    for i in positions:
+        cle = criteres_comparables(formulaires[i])
+        if cle not in resultats:
+            resultats[cle] = get_dvf_comparables(formulaires[i])
+        comparables[i] = resultats[cle]
+    logging.info(f"📊 Comparables du groupe : {len(resultats)} recherche(s) pour {len(positions)} bien(s).")
+    return comparables
+
+def traiter_lot(formulaires, zip_path, progression=None):
+    """
+    Génère les rapports d'un lot dans une archive ZIP (PDF + manifest.json) et renvoie
+    le manifeste (un statut par bien). Les biens sont groupés par département : les
+    données DVF d'un groupe (département et partitions de ses codes postaux) sont chargées
+    une fois, les comparables calculés en une passe (comparables_groupe) et chaque graphique
+    (code postal, type) n'est rendu qu'une fois. Les appels OpenAI partent au fil de l'eau
+    et la mise en page est répartie sur un pool de processus.
+    """
+    progression = progression or (lambda etape, pourcentage: None)
+    start_time = time.time()
+    progression("donnees_dvf", 0)
+    manifeste = [{"position": i, "nom": f.get("nom", ""), "code_postal": str(f.get("code_postal", "")),
+                  "statut": "erreur", "fichier": None, "erreur": None} for i, f in enumerate(formulaires)]
+    groupes = {}
+    for i, form_data in enumerate(formulaires):
+        groupes.setdefault(departements_code_postal(str(form_data.get("code_postal", "")).zfill(5))[0], []).append(i)
+
+    redactions = {}
+    contenus = {}
+    for dept_code, positions in sorted(groupes.items()):
+        logging.info(f"📦 Lot : département {dept_code}, {len(positions)} bien(s).")
+        charger_departement(dept_code)
+        comparables = comparables_groupe(formulaires, positions)
+        graphiques = {}
+        for i in positions:
+            form_data = formulaires[i]
+            try:
+                recommandation = lancer_recommandation(form_data)
+                dvf_table_md, valeur = comparables[i]
+                redactions[i] = (lancer_estimation(form_data, dvf_table_md, valeur), recommandation)
+                cle = (str(form_data.get("code_postal", "")).zfill(5), form_data.get("type_bien", "").capitalize())
+                if cle not in graphiques:
+                    dvf_chart = generate_dvf_chart(form_data)
+                    graphiques[cle] = dvf_chart.getvalue() if dvf_chart else None
+                contenus[i] = {"dvf_table_md": dvf_table_md, "valeur": valeur, "graphique": graphiques[cle]}
+            except Exception as e:
+                manifeste[i]["erreur"] = str(e)
+    progression("redaction", 20)
+
+    processus = max(1, min(BATCH_PROCESSUS, len(redactions)))
+    # "spawn" : pas de fork d'un processus qui héberge déjà des threads (boucle LLM, pool de jobs)
+    with ProcessPoolExecutor(max_workers=processus, mp_context=multiprocessing.get_context("spawn")) as pool, \
+            zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+        rendus = {}
+        for i in sorted(redactions):
+            try:
+                contenus[i]["estimation"], contenus[i]["recommandation"] = attendre_redaction(*redactions[i])
+                rendus[pool.submit(rendre_pdf, formulaires[i], contenus.pop(i))] = i
+            except Exception as e:
+                manifeste[i]["erreur"] = str(e)
+        for n, future in enumerate(as_completed(rendus), start=1):
+            i = rendus[future]
+            try:
+                fichier = nom_fichier_lot(i, formulaires[i])
+                archive.writestr(fichier, future.result())
+                manifeste[i].update(statut="ok", fichier=fichier)
+            except Exception as e:
+                manifeste[i]["erreur"] = str(e)
+            progression("mise_en_page", 20 + 75 * n // len(formulaires))
+        archive.writestr("manifest.json", json.dumps(manifeste, ensure_ascii=False, indent=2))
+
+    reussis = sum(1 for item in manifeste if item["statut"] == "ok")
+    logging.info(f"✅ Lot terminé : {reussis}/{len(formulaires)} rapport(s) en {time.time() - start_time:.1f}s.")
+    return manifeste
+
+def lire_formulaire():
+    """Formulaire JSON de la requête et drapeau `force` (paramètre ?force=1 ou clé "force" du JSON)."""
+    form_data = dict(request.json or {})
+    force = str(form_data.pop("force", request.args.get("force", ""))).lower() in ("1", "true", "oui")
+    return form_data, force
+
+def cle_formulaire(form_data):
+    """Clé de rapport : empreinte du formulaire canonique (valeurs nettoyées, champs vides ignorés)."""
+    canonique = {cle: valeur.strip() if isinstance(valeur, str) else valeur for cle, valeur in form_data.items()}
+    canonique = {cle: valeur for cle, valeur in canonique.items() if valeur not in ("", None)}
+    return hashlib.sha256(json.dumps(canonique, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def attendre_job(job_id, timeout=JOBS_ATTENTE_MAX):
+    """
+    Bloque jusqu'au terme du job et renvoie son état final (None s'il a disparu).
+    TimeoutError au-delà de `timeout` secondes (le job, lui, continue).
+    """
+    fin = time.time() + timeout
+    for _ in job_store.suivre(job_id):
+        if time.time() > fin:
+            raise TimeoutError(f"Job {job_id} toujours en cours après {timeout:.0f}s")
+    return job_store.lire(job_id)
 
 # --- Endpoints Flask ---
 @app.route("/generate_estimation", methods=["POST"])
 def generate_estimation():
     try:
-        form_data = request.json
+        form_data, force = lire_formulaire()
         logging.info("Début de la génération synchrone du rapport...")
-        name = form_data.get("nom", "Client")
-        city = form_data.get("quartier", "Non spécifié")
-        adresse = form_data.get("adresse", "Non spécifiée")
-
-        filename = os.path.join(PDF_FOLDER, f"estimation_{name.replace(' ', '_')}.pdf")
-        doc = SimpleDocTemplate(filename, pagesize=A4,
-                                topMargin=2*cm, bottomMargin=2*cm,
-                                leftMargin=2*cm, rightMargin=2*cm)
-        elements = []
-
-        # Page de garde (inchangée)
-        covers = ["static/cover_image.png", "static/cover_image1.png"]
-        resized = []
-        for img_path in covers:
-            if os.path.exists(img_path):
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                    resize_image(img_path, tmp.name)
-                    resized.append(tmp.name)
-        logging.info("Page de garde préparée.")
-        elements.append(Image(resized[0], width=469, height=716))
-        elements.append(PageBreak())
-    
-        # Section 1 : Résumé du questionnaire (amélioré)
-        résumé = ""
-        for key, value in form_data.items():
-            if isinstance(value, str) and value.strip():
-                label = key.replace("_", " ").capitalize()
-                résumé += f"<b>{label} :</b> {value.strip()}<br/>"
-        section_resume = [style_resume(résumé.strip())]
-        elements.append(generer_pdf_section("Résumé du Questionnaire", section_resume))
-        progress_map[name] = 30
-
-        # Section 2 : Introduction (texte fixe)
-        texte_intro_fixe = """
-        Nous vous remercions sincèrement pour la confiance que vous nous accordez en nous confiant l’évaluation de votre bien.  
-        Nos experts immobiliers ont réalisé une analyse complète et personnalisée, fondée sur les informations que vous nous avez transmises, ainsi que sur une étude approfondie des données de ventes récentes dans votre secteur (données DVF). Ce rapport vise à vous offrir une estimation aussi précise que possible de la valeur actuelle de votre bien, en le comparant à des propriétés similaires récemment vendues, tout en intégrant une projection de l’évolution du marché à moyen et long terme.  
-
-        Nous espérons que ce document répondra pleinement à vos attentes et contribuera à éclairer vos réflexions et vos décisions.  
-        Nous restons bien entendu à votre disposition pour tout complément d'information.  
-
-        Nous vous souhaitons une excellente lecture.  
-        Bien à vous.
-        """
-
-        section_intro = [Paragraph(p.strip(), getSampleStyleSheet()["BodyText"]) for p in texte_intro_fixe.strip().split("\n") if p.strip()]
-        pdf_sections.append(generer_pdf_section("Introduction", section_intro))
-        progress_map[name] = 40
-
-
-        # Section 3 : Analyse des Données DVF
-        dvf_table_md = get_dvf_comparables(form_data)
-        section_dvf = markdown_to_elements(dvf_table_md)
-        dvf_chart_path = generate_dvf_chart(form_data)
-        if dvf_chart_path:
-            section_dvf.append(Spacer(1, 12))
-            section_dvf.append(center_image(dvf_chart_path, width=400, height=300))
-            section_dvf.append(Paragraph("Évolution du prix moyen au m²", getSampleStyleSheet()['Heading3']))
-        elements.append(generer_pdf_section("Analyse des Données DVF", section_dvf))
-        progress_map[name] = 60
-
-        # Section 4 : Estimation & Analyse
-        section_estimation = generate_estimation_section(
-            f"Voici les données DVF extraites :\n{dvf_table_md}\n\n"
-            f"Analyse en détail ces données pour estimer la valeur réelle du bien de {form_data.get('civilite', '')} {form_data.get('prenom', '')} {form_data.get('nom', '')} :\n"
-            f"- Type : {form_data.get('type_bien', '')}\n"
-            f"- Surface : {form_data.get('app_surface') or form_data.get('maison_surface') or form_data.get('terrain_surface', '')} m²\n"
-            f"- Quartier : {form_data.get('quartier', '')}, Code postal : {form_data.get('code_postal', '')}\n"
-            f"- État : {form_data.get('etat_general', '')}, Travaux : {form_data.get('travaux_recent', '')} ({form_data.get('travaux_details', '')})\n"
-            f"- Historique : temps sur le marché ({form_data.get('temps_marche', '')}), offres : {form_data.get('offres', '')}, raison de vente : {form_data.get('raison_vente', '')}\n"
-            f"- Prix similaires : {form_data.get('prix_similaires', '')}, Prix visé : {form_data.get('prix', '')} (négociable : {form_data.get('negociation', '')}).\n"
-            "Donnez une estimation chiffrée sous forme de fourchette précise. Terminez toutes les phrases.",
-            min_tokens=600
-        )
-        full_text = ""
-        for flowable in section_estimation:
-            try:
-                full_text += flowable.getPlainText() + " "
-            except AttributeError:
-                pass
-        if len(full_text) < 500:
-            continuation = generate_estimation_section(
-                "Continue l'analyse pour compléter l'estimation du bien.", min_tokens=300
-            )
-            section_estimation.extend(continuation)
-        elements.append(generer_pdf_section("Estimation & Analyse", section_estimation))
-        progress_map[name] = 80
-
-        # Section 5 : Recommandations (seulement une recommandation en une phrase)
-        section_conclusion = generate_estimation_section(
-            f"Oubliez tout le contexte précédent. À partir de zéro, fournissez uniquement une recommandation pratique et concise pour optimiser la vente du bien de {form_data.get('civilite', '')} {form_data.get('prenom', '')} {form_data.get('nom', '')}. "
-            "Donnez une seule phrase complète qui indique le meilleur positionnement du prix et la stratégie de mise en marché idéale. "
-            "N'incluez aucune estimation de prix ni analyse détaillée du marché. Terminez correctement la phrase.",
-            min_tokens=300
-        )
-        elements.append(generer_pdf_section("Recommandations", section_conclusion))
-        progress_map[name] = 90
-
-        # Page de fin
-        if len(resized) > 1:
-            elements.append(Image(resized[1], width=469, height=716))
-        elements.append(Spacer(1, 24))
-        elements.append(Paragraph("Cordialement, Expert immobilier.", getSampleStyleSheet()["BodyText"]))
-        logging.info("Page de fin ajoutée.")
-
-        doc.build(elements)
+        # Même couche que le chemin asynchrone : une demande identique attend le job existant
+        job_id, nouveau = job_store.creer(str(uuid.uuid4()), cle_formulaire(form_data), force)
+        if nouveau:
+            job_scheduler.executer(job_id, generate_estimation_background, form_data, force)
+        else:
+            logging.info(f"♻️ Rapport identique en cours ou récent (job {job_id}) : réutilisé.")
+        job = attendre_job(job_id)
+        if job is None or job["statut"] != TERMINE:
+            raise RuntimeError(job["erreur"] if job else "Job introuvable")
         logging.info("PDF généré avec succès.")
-        return send_file(filename, as_attachment=True)
+        return envoyer_rapport(job["empreinte"], nom_rapport(form_data))
 
     except Exception as e:
         logging.error(f"Erreur dans generate_estimation: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-# --- Endpoints pour génération asynchrone (section par section fusionnée) ---
-progress_map = {}  # job_id -> progression (0-100)
-results_map = {}   # job_id -> chemin du PDF généré
+# --- Endpoints pour génération asynchrone ---
+# État des jobs partagé par tous les workers (SQLite), exécution par un pool borné
+job_store = JobStore()
+job_scheduler = JobScheduler(job_store)
+
+def generate_estimation_background(job_id, form_data, force=False):
+    logging.info(f"Démarrage de la génération asynchrone pour job {job_id}...")
+    pdf = construire_rapport(form_data, progression=partial(job_store.avancer, job_id), force=force)
+    with span("stockage"):
+        empreinte = report_store.ajouter(pdf)
+    job_store.mettre_a_jour(job_id, statut=TERMINE, etape=TERMINE, progression=100,
+                            empreinte=empreinte, chemin=report_store.chemin(empreinte), nom_fichier=nom_rapport(form_data))
+    logging.info(f"✅ Rapport finalisé pour job {job_id}")
 
-def generate_estimation_background(job_id, form_data):
+@app.route("/start_estimation", methods=["POST"])
+def start_estimation():
+    form_data, force = lire_formulaire()
     try:
-        logging.info(f"Démarrage de la génération asynchrone pour job {job_id}...")
-        progress_map[job_id] = 0
-
-        name = form_data.get("nom", "Client")
-        signature = f"{form_data.get('civilite', '')} {form_data.get('prenom', '')} {form_data.get('nom', '')}"
-        final_pdf_path = os.path.join(PDF_FOLDER, f"estimation_{name.replace(' ', '_')}_{job_id}.pdf")
-
-        # Pages de garde (inchangées)
-        covers = ["static/cover_image.png", "static/cover_image1.png"]
-        resized = []
-        for img_path in covers:
-            if os.path.exists(img_path):
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp:
-                    resize_image(img_path, tmp.name)
-                    resized.append(tmp.name)
-
-        pdf_sections = []
-        if resized:
-            pdf_sections.append(generer_pdf_section("", [Image(resized[0], width=469, height=716)]))
-        progress_map[job_id] = 10
-
-        # Section 1 : Résumé du questionnaire (amélioré)
-        résumé = ""
-        for key, value in form_data.items():
-            if isinstance(value, str) and value.strip():
-                label = key.replace("_", " ").capitalize()
-                résumé += f"<b>{label} :</b> {value.strip()}<br/>"
-        section_resume = [style_resume(résumé.strip())]
-        pdf_sections.append(generer_pdf_section("Résumé du Questionnaire", section_resume))
-        progress_map[job_id] = 30
-
-        # Section 2 : Introduction (texte fixe)
-        texte_intro_fixe = """
-        Nous vous remercions sincèrement pour la confiance que vous nous accordez en nous confiant l’évaluation de votre bien.  
-        Nos experts immobiliers ont réalisé une analyse complète et personnalisée, fondée sur les informations que vous nous avez transmises, ainsi que sur une étude approfondie des données de ventes récentes dans votre secteur (données DVF). Ce rapport vise à vous offrir une estimation aussi précise que possible de la valeur actuelle de votre bien, en le comparant à des propriétés similaires récemment vendues, tout en intégrant une projection de l’évolution du marché à moyen et long terme.  
-
-        Nous espérons que ce document répondra pleinement à vos attentes et contribuera à éclairer vos réflexions et vos décisions.  
-        Nous restons bien entendu à votre disposition pour tout complément d'information.  
-
-        Nous vous souhaitons une excellente lecture.  
-        Bien à vous.
-        """
-
-        section_intro = [Paragraph(p.strip(), getSampleStyleSheet()["BodyText"]) for p in texte_intro_fixe.strip().split("\n") if p.strip()]
-        pdf_sections.append(generer_pdf_section("Introduction", section_intro))
-        progress_map[name] = 40
-
-
-        # Section 3 : Analyse des Données DVF
-        dvf_table_md = get_dvf_comparables(form_data)
-        section_dvf = markdown_to_elements(dvf_table_md)
-        dvf_chart_path = generate_dvf_chart(form_data)
-        if dvf_chart_path:
-            section_dvf.append(Spacer(1, 12))
-            section_dvf.append(center_image(dvf_chart_path, width=400, height=300))
-            section_dvf.append(Paragraph("Évolution du prix moyen au m²", getSampleStyleSheet()['Heading3']))
-        pdf_sections.append(generer_pdf_section("Analyse des Données DVF", section_dvf))
-        progress_map[job_id] = 60
-
-        # Section 4 : Estimation & Analyse
-        section_estimation = generate_estimation_section(
-            f"Voici les données DVF extraites :\n{dvf_table_md}\n\n"
-            f"Analyse en détail ces données pour estimer la valeur réelle du bien de {signature} :\n"
-            f"- Type : {form_data.get('type_bien', '')}\n"
-            f"- Surface : {form_data.get('app_surface') or form_data.get('maison_surface') or form_data.get('terrain_surface', '')} m²\n"
-            f"- Quartier : {form_data.get('quartier', '')}, Code postal : {form_data.get('code_postal', '')}\n"
-            f"- État : {form_data.get('etat_general', '')}, Travaux : {form_data.get('travaux_recent', '')} ({form_data.get('travaux_details', '')})\n"
-            f"- Historique : temps sur le marché ({form_data.get('temps_marche', '')}), offres : {form_data.get('offres', '')}, raison de vente : {form_data.get('raison_vente', '')}\n"
-            f"- Prix similaires : {form_data.get('prix_similaires', '')}, Prix visé : {form_data.get('prix', '')} (négociable : {form_data.get('negociation', '')}).\n"
-            "Donnez une estimation chiffrée sous forme de fourchette précise. Terminez toutes les phrases.",
-            min_tokens=600
-        )
-        full_text = ""
-        for flowable in section_estimation:
-            try:
-                full_text += flowable.getPlainText() + " "
-            except AttributeError:
-                pass
-        if len(full_text) < 500:
-            continuation = generate_estimation_section(
-                "Continue l'analyse pour compléter l'estimation du bien.", min_tokens=300
-            )
-            section_estimation.extend(continuation)
-        pdf_sections.append(generer_pdf_section("Estimation & Analyse", section_estimation))
-        progress_map[job_id] = 80
-
-        # Section 5 : Recommandations (seulement une recommandation en une phrase)
-        section_conclusion = generate_estimation_section(
-            f"Oubliez tout le contexte précédent. À partir de zéro, fournissez uniquement une recommandation pratique et concise pour optimiser la vente du bien de {signature}. "
-            "Donnez une seule phrase complète qui indique le meilleur positionnement du prix et la stratégie de mise en marché idéale. "
-            "N'incluez aucune estimation de prix ni analyse détaillée du marché. Terminez correctement la phrase.",
-            min_tokens=300
-        )
-        pdf_sections.append(generer_pdf_section("Recommandations", section_conclusion))
-        progress_map[job_id] = 90
+        job_id, nouveau = job_scheduler.soumettre(str(uuid.uuid4()), generate_estimation_background, form_data,
+                                                  force, cle=cle_formulaire(form_data), force=force)
+    except FilePleine as e:
+        logging.warning(f"⏳ {e}")
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+    if nouveau:
+        logging.info(f"Démarrage du job asynchrone {job_id}...")
+    else:
+        logging.info(f"♻️ Demande identique rattachée au job {job_id}.")
+    return jsonify({"job_id": job_id, "deduplique": not nouveau})
 
-        # Page de fin
-        if len(resized) > 1:
-            pdf_sections.append(generer_pdf_section("", [Image(resized[1], width=469, height=716)]))
-        pdf_sections.append(generer_pdf_section("", [Paragraph("Cordialement, Expert immobilier.", getSampleStyleSheet()["BodyText"])]))
+def generate_batch_background(job_id, formulaires):
+    logging.info(f"Démarrage du lot {job_id} ({len(formulaires)} biens)...")
+    zip_path = report_store.fichier_temporaire(".zip")
+    try:
+        traiter_lot(formulaires, zip_path, partial(job_store.avancer, job_id))
+        empreinte = report_store.importer(zip_path, ".zip")
+    finally:
+        if os.path.exists(zip_path):
+            os.remove(zip_path)
+    job_store.mettre_a_jour(job_id, statut=TERMINE, etape=TERMINE, progression=100, empreinte=empreinte,
+                            chemin=report_store.chemin(empreinte, ".zip"), nom_fichier=f"lot_{job_id}.zip")
 
-        # Fusion finale des sections
-        assembler_pdf(pdf_sections, final_pdf_path)
-        results_map[job_id] = final_pdf_path
-        progress_map[job_id] = 100
-        logging.info(f"✅ Rapport finalisé pour job {job_id}")
+@app.route("/batch_estimation", methods=["POST"])
+def batch_estimation():
+    """Lot de formulaires (fichier JSONL/CSV `fichier`, ou corps brut) ; l'archive se récupère via /download_estimation."""
+    fichier = request.files.get("fichier")
+    try:
+        formulaires = lire_lot((fichier.read() if fichier else request.get_data()).decode("utf-8"))
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": f"Lot illisible : {str(e)}"}), 400
+    if not formulaires or len(formulaires) > BATCH_MAX_BIENS:
+        return jsonify({"error": f"Le lot doit contenir entre 1 et {BATCH_MAX_BIENS} biens."}), 400
+    job_id = str(uuid.uuid4())
+    try:
+        job_scheduler.soumettre(job_id, generate_batch_background, formulaires)
+    except FilePleine as e:
+        logging.warning(f"⏳ {e}")
+        return jsonify({"error": str(e)}), 429, {"Retry-After": str(e.retry_after)}
+    return jsonify({"job_id": job_id, "biens": len(formulaires)})
 
-    except Exception as e:
-        logging.error(f"Erreur dans generate_estimation_background: {str(e)}")
-        progress_map[job_id] = -1
-        results_map[job_id] = None
+SSE_BATTEMENT = 15  # secondes entre deux commentaires de maintien de connexion
 
-@app.route("/start_estimation", methods=["POST"])
-def start_estimation():
-    form_data = request.json or {}
-    job_id = str(uuid.uuid4())
-    logging.info(f"Démarrage du job asynchrone {job_id}...")
-    thread = threading.Thread(target=generate_estimation_background, args=(job_id, form_data))
-    thread.start()
-    return jsonify({"job_id": job_id})
+def evenement_progression(job):
+    """État publié d'un job ; `stages` : temps passé par étape du pipeline (voir metrics.py)."""
+    return {"stage": job["etape"], "percent": job["progression"], "status": job["statut"],
+            "elapsed": round(time.time() - job["cree"], 1), "stages": job["etapes"]}
+
+@app.route("/progress/stream", methods=["GET"])
+def progress_stream():
+    """
+    Flux SSE de la progression d'un job : un événement `progress` par changement d'étape
+    (étape, pourcentage, secondes écoulées depuis la soumission), le dernier à 100 ou -1.
+    """
+    job_id = request.args.get("job_id")
+    if not job_id or job_store.lire(job_id) is None:
+        return jsonify({"error": "Job introuvable"}), 404
+
+    def flux():
+        dernier_envoi = time.time()
+        for job in job_store.suivre(job_id):
+            if job is not None:
+                dernier_envoi = time.time()
+                yield f"event: progress\ndata: {json.dumps(evenement_progression(job))}\n\n"
+            elif time.time() - dernier_envoi >= SSE_BATTEMENT:
+                dernier_envoi = time.time()
+                yield ": ping\n\n"
+
+    return Response(stream_with_context(flux()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.route("/progress", methods=["GET"])
 def get_progress():
+    """Compatibilité : état instantané du job (préférer /progress/stream)."""
     job_id = request.args.get("job_id")
-    if not job_id or job_id not in progress_map:
+    job = job_store.lire(job_id) if job_id else None
+    if job is None:
         return jsonify({"error": "Job introuvable"}), 404
-    return jsonify({"progress": progress_map[job_id]})
+    return jsonify({"progress": job["progression"], **evenement_progression(job)})
 
 @app.route("/download_estimation", methods=["GET"])
 def download_estimation():
     job_id = request.args.get("job_id")
-    if not job_id or job_id not in results_map:
+    job = job_store.lire(job_id) if job_id else None
+    if job is None:
         return jsonify({"error": "Job introuvable"}), 404
-    pdf_path = results_map[job_id]
-    if not pdf_path or not os.path.exists(pdf_path):
+    if not job["empreinte"]:
         return jsonify({"error": "PDF introuvable ou non généré"}), 404
-    return send_file(pdf_path, as_attachment=True)
+    return envoyer_rapport(job["empreinte"], job["nom_fichier"], os.path.splitext(job["chemin"])[1])
+
+# --- Métriques Prometheus ---
+def compteurs_caches():
+    caches = {"dvf": department_cache, "graphiques": chart_cache, "couvertures": asset_cache, "llm": llm_cache}
+    for nom, cache in caches.items():
+        stats = cache.stats()
+        yield (nom, "hit"), stats["hits"]
+        yield (nom, "miss"), stats["misses"]
+
+registre.collecteur("cache_requetes_total", "Lectures des caches (dvf, graphiques, couvertures, llm)", "counter",
+                    ["cache", "resultat"], compteurs_caches)
+registre.collecteur("jobs_file_attente", "Jobs en file d'attente", "gauge", [],
+                    lambda: [((), job_scheduler.stats()["file"])])
+registre.collecteur("jobs_actifs", "Jobs en cours d'exécution", "gauge", [],
+                    lambda: [((), job_scheduler.stats()["actifs"])])
+registre.collecteur("openai_requetes_total", "Appels OpenAI par issue (limiteur)", "counter", ["issue"],
+                    lambda: [(("succes",), limiteur_openai.succes), (("nouvel_essai",), limiteur_openai.nouveaux_essais),
+                             (("echec",), limiteur_openai.echecs)])
+registre.collecteur("openai_en_vol", "Appels OpenAI en cours", "gauge", [],
+                    lambda: [((), limiteur_openai.en_vol)])
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return Response(registre.exposer(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/")
 def home():
@@ -0,0 +1,8 @@
+import os
+
+import uvicorn
+
+from mon_projet.app import app  # Service ASGI : uvicorn asgi:app
+
+if __name__ == "__main__":
+    uvicorn.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
@@ -0,0 +1,39 @@
+"""
+Accès SQLite commun aux bases partagées par les workers (jobs.py, llm_cache.py).
+
+- connexions courtes : une par opération, la transaction est validée puis la connexion fermée
+- schéma créé ou migré une seule fois, à la construction de la base, sous verrou d'écriture
+  (BEGIN IMMEDIATE) : des workers qui démarrent ensemble ne migrent pas deux fois
+"""
+import sqlite3
+from contextlib import contextmanager
+
+SQLITE_TIMEOUT = 10  # secondes d'attente d'un verrou tenu par un autre worker
+
+
+def initialiser(path, schema):
+    """Passe la base en WAL puis exécute `schema(conn)` (création, migrations) dans une seule transaction d'écriture."""
+    conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            schema(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+@contextmanager
+def connexion(path, row_factory=None):
+    """Connexion courte (une par opération) : valide la transaction puis se ferme."""
+    conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT)
+    conn.row_factory = row_factory
+    try:
+        with conn:
+            yield conn
+    finally:
+        conn.close()
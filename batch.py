@@ -0,0 +1,35 @@
+"""
+Estimation par lot en ligne de commande : un fichier JSONL ou CSV de formulaires en entrée,
+une archive ZIP (un PDF par bien + manifest.json) en sortie. Même pipeline que l'endpoint
+/batch_estimation (voir app.traiter_lot).
+
+Usage :
+    python batch.py biens.jsonl -o lot.zip
+"""
+import argparse
+import logging
+import os
+
+from app import BATCH_MAX_BIENS, lire_lot, traiter_lot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimation immobilière par lot")
+    parser.add_argument("fichier", help="Formulaires : JSONL (un objet par ligne) ou CSV avec en-tête")
+    parser.add_argument("-o", "--sortie", help="Archive ZIP produite (par défaut : <fichier>.zip)")
+    args = parser.parse_args()
+
+    with open(args.fichier, encoding="utf-8") as f:
+        formulaires = lire_lot(f.read())
+    if len(formulaires) > BATCH_MAX_BIENS:
+        logging.warning(f"⚠️ {len(formulaires)} biens, au-delà de la limite de l'API ({BATCH_MAX_BIENS}).")
+    zip_path = args.sortie or f"{os.path.splitext(args.fichier)[0]}.zip"
+    manifeste = traiter_lot(formulaires, zip_path)
+    for item in manifeste:
+        detail = item["fichier"] if item["statut"] == "ok" else item["erreur"]
+        print(f"{item['position'] + 1:>4} | {item['code_postal']:>5} | {item['statut']:<6} | {detail}")
+    print(f"Archive : {zip_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare la recherche de comparables par masques booléens successifs (code postal,
+type de bien puis plage de surface) à l'index trié de dvf_index.
+
+Usage :
+    python benchmarks/bench_comparables.py 75 59 13
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dvf_index import DvfIndex  # noqa: E402
+from dvf_store import DVF_FOLDER, read_dvf_csv, source_files  # noqa: E402
+
+REPETITIONS = 200
+
+
+def recherche_par_masques(df, code_postal, type_local, surface_range):
+    df = df[df["code_postal"] == code_postal]
+    df = df[df["type_local"] == type_local]
+    return df[df["surface_reelle_bati"].between(*surface_range)]
+
+
+def chronometrer(fonction, *args):
+    start = time.perf_counter()
+    for _ in range(REPETITIONS):
+        result = fonction(*args)
+    return (time.perf_counter() - start) / REPETITIONS * 1000, len(result)
+
+
+def main():
+    departements = sys.argv[1:] or ["75", "59", "13"]
+    sources = source_files(DVF_FOLDER)
+    print("dept | code postal | construction index | masques (ms) | index (ms) | lignes")
+    for dept_code in departements:
+        if dept_code not in sources:
+            print(f"{dept_code:>4} | fichier absent")
+            continue
+        df = read_dvf_csv(sources[dept_code])
+        start = time.perf_counter()
+        index = DvfIndex(df)
+        build_ms = (time.perf_counter() - start) * 1000
+        code_postal = df["code_postal"].value_counts().index[0]
+        surface_range = (42.0, 78.0)
+        masques_ms, n_masques = chronometrer(recherche_par_masques, df, code_postal, "Appartement", surface_range)
+        index_ms, n_index = chronometrer(index.find_comparables, code_postal, "Appartement", surface_range)
+        assert n_masques == n_index
+        print(f"{dept_code:>4} | {code_postal:>11} | {build_ms:15.1f} ms | {masques_ms:12.3f} | {index_ms:10.3f} | {n_index}")
+
+
+if __name__ == "__main__":
+    main()
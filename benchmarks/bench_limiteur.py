@@ -0,0 +1,133 @@
+"""
+Met le limiteur OpenAI à l'épreuve d'un serveur local qui imite l'API chat.completions :
+budget de requêtes par minute (429 + Retry-After au-delà), latence qui croît avec la
+longueur demandée (`max_tokens`) et le nombre d'appels simultanés, et quelques 500.
+Les appels alternent réponses courtes et longues, comme un rapport (recommandation
+d'une phrase, estimation de 600 tokens). Compare des appels directs au client
+(sans nouvel essai) aux mêmes appels passés par llm_limiter.LimiteurOpenAI.
+
+Usage :
+    python benchmarks/bench_limiteur.py 200   # nombre d'appels
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from openai import AsyncOpenAI  # noqa: E402
+
+from llm_limiter import LimiteurOpenAI  # noqa: E402
+
+RPM_SERVEUR = 600          # 10 requêtes/s
+LATENCE_BASE = 0.1         # secondes, plus 0.5 ms par token demandé et 50 ms par appel simultané
+LATENCE_TOKEN = 0.0005
+TAILLES_APPELS = (50, 600)  # max_tokens, en alternance
+TAUX_ERREUR_500 = 0.02
+
+
+class ServeurSimule:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fenetre = []   # horodatages des requêtes acceptées sur la dernière minute
+        self.en_cours = 0
+        self.refus = 0
+
+    def admettre(self):
+        now = time.monotonic()
+        with self.lock:
+            self.fenetre = [t for t in self.fenetre if t > now - 60]
+            if len(self.fenetre) >= RPM_SERVEUR * (min(now - DEBUT, 60) / 60) + 5:
+                self.refus += 1
+                return False
+            self.fenetre.append(now)
+            self.en_cours += 1
+            return True
+
+
+ETAT = ServeurSimule()
+DEBUT = time.monotonic()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _repondre(self, code, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for nom, valeur in headers:
+            self.send_header(nom, valeur)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        requete = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        max_tokens = int(requete.get("max_tokens", 300))
+        if not ETAT.admettre():
+            self._repondre(429, {"error": {"message": "Rate limit", "type": "requests"}}, [("retry-after", "1")])
+            return
+        try:
+            time.sleep(LATENCE_BASE + LATENCE_TOKEN * max_tokens + 0.05 * ETAT.en_cours)
+            if random.random() < TAUX_ERREUR_500:
+                self._repondre(500, {"error": {"message": "Erreur simulée"}})
+                return
+            self._repondre(200, {
+                "id": "simule", "object": "chat.completion", "created": 0, "model": "gpt-4",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "Réponse simulée."}}],
+                "usage": {"prompt_tokens": 50, "completion_tokens": max_tokens, "total_tokens": 50 + max_tokens},
+            })
+        finally:
+            with ETAT.lock:
+                ETAT.en_cours -= 1
+
+
+async def scenario(client, appels, limiteur=None):
+    messages = [{"role": "user", "content": "Estimation du bien."}]
+    reussis = 0
+
+    async def un_appel(max_tokens):
+        nonlocal reussis
+        creer = lambda: client.chat.completions.create(model="gpt-4", messages=messages, max_tokens=max_tokens)  # noqa: E731
+        try:
+            if limiteur is None:
+                await creer()
+            else:
+                await limiteur.appeler(creer, messages, max_tokens)
+            reussis += 1
+        except Exception:
+            pass
+
+    start = time.perf_counter()
+    await asyncio.gather(*(un_appel(TAILLES_APPELS[i % len(TAILLES_APPELS)]) for i in range(appels)))
+    return reussis, time.perf_counter() - start
+
+
+def main():
+    global DEBUT
+    appels = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    serveur = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+    client = AsyncOpenAI(api_key="benchmark", base_url=f"http://127.0.0.1:{serveur.server_port}/v1", max_retries=0)
+
+    print("mode        | réussis | 429 serveur | durée (s) | débit (appels/s)")
+    for nom, limiteur in [("direct", None), ("limiteur", LimiteurOpenAI(rpm=RPM_SERVEUR, tpm=1_000_000))]:
+        ETAT.fenetre, ETAT.refus = [], 0
+        DEBUT = time.monotonic()
+        reussis, duree = asyncio.run(scenario(client, appels, limiteur))
+        print(f"{nom:<11} | {reussis:7d} | {ETAT.refus:11d} | {duree:9.1f} | {reussis / duree:.1f}")
+        if limiteur is not None:
+            print(f"            stats du limiteur : {limiteur.stats()}")
+    serveur.shutdown()
+
+
+if __name__ == "__main__":
+    main()
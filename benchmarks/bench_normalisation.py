@@ -0,0 +1,83 @@
+"""
+Compare l'ancienne normalisation DVF (toutes les colonnes en object/float64, lambda
+ligne par ligne sur code_postal) au chemin typé et vectorisé de dvf_store.
+
+Chaque normalisation est mesurée REPETITIONS fois sur une copie du fichier lu ; le
+meilleur temps est retenu (une mesure unique de quelques dizaines de ms est trop bruitée).
+
+Usage :
+    python benchmarks/bench_normalisation.py 75 59 13
+"""
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from dvf_store import DVF_CSV_DTYPES, DVF_FOLDER, normalize_columns, source_files  # noqa: E402
+
+REPETITIONS = 5
+
+
+def legacy_normalize_columns(df):
+    """Copie de la normalisation d'origine, conservée comme référence."""
+    df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
+    df = df.rename(columns={"adresse_nom_voie": "nom_voie", "adresse_numero": "numero_voie"})
+    if "code_postal" in df.columns:
+        df["code_postal"] = df["code_postal"].apply(
+            lambda x: str(int(float(x))).zfill(5) if pd.notna(x) and str(x).replace('.', '', 1).isdigit() else None
+        )
+    if "numero_voie" in df.columns:
+        df["numero_voie"] = df["numero_voie"].astype(str).str.replace(r"\.0$", "", regex=True).str.strip()
+    if "nom_voie" in df.columns:
+        df["nom_voie"] = df["nom_voie"].astype(str).str.strip()
+    if "numero_voie" in df.columns and "nom_voie" in df.columns:
+        df["adresse"] = df["numero_voie"] + " " + df["nom_voie"]
+    return df
+
+
+def meilleur_temps(normaliser, raw):
+    """(meilleur temps sur REPETITIONS normalisations d'une copie de `raw`, dernier résultat)."""
+    temps = []
+    for _ in range(REPETITIONS):
+        copie = raw.copy()
+        start = time.perf_counter()
+        resultat = normaliser(copie)
+        temps.append(time.perf_counter() - start)
+    return min(temps), resultat
+
+
+def mesurer(dept_code, source_path):
+    t0 = time.perf_counter()
+    raw = pd.read_csv(source_path, sep=",", low_memory=False)
+    lecture_legacy = time.perf_counter() - t0
+    normalisation_legacy, legacy = meilleur_temps(legacy_normalize_columns, raw)
+    legacy_bytes = legacy.memory_usage(deep=True).sum()
+
+    t0 = time.perf_counter()
+    raw = pd.read_csv(source_path, sep=",", usecols=lambda c: c in DVF_CSV_DTYPES, dtype=DVF_CSV_DTYPES)
+    lecture_typed = time.perf_counter() - t0
+    normalisation_typed, typed = meilleur_temps(normalize_columns, raw)
+    typed_bytes = typed.memory_usage(deep=True).sum()
+
+    print(f"{dept_code:>4} | {len(legacy):>8} | "
+          f"{lecture_legacy + normalisation_legacy:6.2f}s {normalisation_legacy:6.3f}s {legacy_bytes / 1e6:7.1f} Mo | "
+          f"{lecture_typed + normalisation_typed:6.2f}s {normalisation_typed:6.3f}s {typed_bytes / 1e6:7.1f} Mo | "
+          f"x{normalisation_legacy / normalisation_typed:5.1f} x{legacy_bytes / typed_bytes:5.1f}")
+
+
+def main():
+    departements = sys.argv[1:] or ["75", "59", "13"]
+    sources = source_files(DVF_FOLDER)
+    print("dept |   lignes | ancien : total  normalis.  mémoire | nouveau : total  normalis.  mémoire | gain temps  mémoire")
+    for dept_code in departements:
+        if dept_code not in sources:
+            print(f"{dept_code:>4} | fichier absent")
+            continue
+        mesurer(dept_code, sources[dept_code])
+
+
+if __name__ == "__main__":
+    main()
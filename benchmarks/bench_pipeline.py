@@ -0,0 +1,206 @@
+"""
+Banc de mesure du pipeline de rapport sur des départements DVF synthétiques
+(voir dvf_synthetique.py) avec un faux client OpenAI déterministe à latence réglable.
+
+Pour chaque taille de département : chargement à froid, puis `--rapports` rapports
+générés par `--jobs` threads concurrents. Mesure chaque étape (percentiles), le bout
+en bout, le débit et le pic de mémoire (RSS), et enregistre le tout en JSON pour
+comparer les commits entre eux.
+
+Usage :
+    python benchmarks/bench_pipeline.py --tailles 10000 100000 1000000 --latence 0.5 --jobs 4 \
+        --rapports 40 --sortie bench_pipeline.json
+"""
+import argparse
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+RACINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RACINE)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Tout ce que l'application écrit va dans un dossier jetable, avant son import
+TRAVAIL = tempfile.mkdtemp(prefix="bench_pipeline_")
+atexit.register(shutil.rmtree, TRAVAIL, ignore_errors=True)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+# Budget OpenAI illimité par défaut : on mesure le pipeline, pas le limiteur (bench_limiteur.py)
+os.environ.setdefault("OPENAI_RPM", "1000000")
+os.environ.setdefault("OPENAI_TPM", "100000000")
+os.environ["DVF_STORE_FOLDER"] = os.path.join(TRAVAIL, "dvf_store")
+os.environ["JOBS_DB_PATH"] = os.path.join(TRAVAIL, "jobs.sqlite3")
+os.environ["LLM_CACHE_PATH"] = os.path.join(TRAVAIL, "llm_cache.sqlite3")
+os.environ["REPORT_STORE_FOLDER"] = os.path.join(TRAVAIL, "rapports")
+
+import app  # noqa: E402
+from dvf_synthetique import ecrire_departement  # noqa: E402
+
+DEPARTEMENT = "75"
+# Étapes chronométrées : fonctions de module d'app remplacées par une version mesurée
+ETAPES = ["load_dvf_data_avance", "get_dvf_comparables", "generate_dvf_chart", "rendre_graphique_dvf",
+          "markdown_to_elements", "calculer_contenu", "composer_sections", "rendre_rapport"]
+
+
+class LLMSimule:
+    """Remplace chat.completions : texte déterministe (fonction du prompt), latence fixe."""
+
+    def __init__(self, latence):
+        self.latence = latence
+        self.appels = 0
+
+    async def create(self, model, messages, max_tokens, **kwargs):
+        self.appels += 1
+        await asyncio.sleep(self.latence)
+        graine = hashlib.sha256(messages[-1]["content"].encode("utf-8")).hexdigest()[:8]
+        texte = (f"Analyse {graine} : le bien se situe dans la moyenne du secteur. " * (max_tokens // 15)).strip()
+        message = types.SimpleNamespace(content=texte)
+        usage = types.SimpleNamespace(prompt_tokens=len(messages[-1]["content"]) // 4, completion_tokens=max_tokens,
+                                      total_tokens=len(messages[-1]["content"]) // 4 + max_tokens)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)], usage=usage)
+
+
+class Chronos:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durees = defaultdict(list)
+
+    def instrumenter(self, nom):
+        fonction = getattr(app, nom)
+
+        def mesuree(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fonction(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.durees[nom].append(time.perf_counter() - start)
+
+        setattr(app, nom, mesuree)
+
+    def reinitialiser(self):
+        with self._lock:
+            self.durees = defaultdict(list)
+
+
+def percentiles(valeurs):
+    valeurs = np.array(valeurs) * 1000
+    return {"n": len(valeurs), "moyenne_ms": round(float(valeurs.mean()), 2),
+            **{f"p{p}_ms": round(float(np.percentile(valeurs, p)), 2) for p in (50, 90, 99)}}
+
+
+def rss_max_mo():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def commit_courant():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RACINE, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def formulaires(n, seed=0):
+    """Formulaires variés : codes postaux, types et surfaces tirés au sort (graine fixe)."""
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        type_bien = ["appartement", "maison"][int(rng.random() < 0.3)]
+        surface = str(int(rng.integers(20, 150)))
+        yield {"civilite": "M.", "prenom": "Client", "nom": f"Bench{i}",
+               "code_postal": f"{int(DEPARTEMENT) * 1000 + 1 + int(rng.integers(0, 20)):05d}",
+               "type_bien": type_bien, "app_surface": surface, "maison_surface": surface}
+
+
+def mesurer_taille(lignes, args, chronos):
+    dossier_dvf = os.path.join(TRAVAIL, f"dvf_{lignes}")
+    start = time.perf_counter()
+    ecrire_departement(dossier_dvf, DEPARTEMENT, lignes)
+    generation_s = time.perf_counter() - start
+    app.DVF_FOLDER = dossier_dvf
+    app.department_cache.clear()
+    app.chart_cache.clear()
+
+    start = time.perf_counter()
+    app.charger_departement(DEPARTEMENT)
+    chargement_froid_s = time.perf_counter() - start
+
+    chronos.reinitialiser()
+    bout_en_bout = []
+
+    def un_rapport(form_data):
+        start = time.perf_counter()
+        app.construire_rapport(form_data)
+        bout_en_bout.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        list(pool.map(un_rapport, formulaires(args.rapports)))
+    duree = time.perf_counter() - start
+
+    return {
+        "lignes": lignes,
+        "generation_s": round(generation_s, 2),
+        "chargement_froid_s": round(chargement_froid_s, 3),
+        "etapes": {nom: percentiles(durees) for nom, durees in chronos.durees.items()},
+        "bout_en_bout": percentiles(bout_en_bout),
+        "debit_rapports_s": round(args.rapports / duree, 3),
+        "rss_max_mo": round(rss_max_mo(), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de mesure du pipeline de rapport")
+    parser.add_argument("--tailles", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Lignes par département synthétique (10k à 2M)")
+    parser.add_argument("--latence", type=float, default=0.5, help="Latence simulée d'un appel OpenAI (s)")
+    parser.add_argument("--jobs", type=int, default=4, help="Rapports générés en parallèle")
+    parser.add_argument("--rapports", type=int, default=40, help="Rapports par taille de département")
+    parser.add_argument("--sortie", default="bench_pipeline.json")
+    args = parser.parse_args()
+
+    llm = LLMSimule(args.latence)
+    app.async_client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=llm))
+    app.llm_cache.get = lambda cle: None  # chaque rapport paie ses appels (simulés)
+    app.llm_cache.set = lambda cle, contenu: None
+    chronos = Chronos()
+    for nom in ETAPES:
+        chronos.instrumenter(nom)
+
+    resultats = []
+    print("lignes    | chargement froid | p50 rapport | p99 rapport | débit (rapports/s) | RSS max")
+    for lignes in sorted(args.tailles):
+        resultat = mesurer_taille(lignes, args, chronos)
+        resultats.append(resultat)
+        print(f"{lignes:>9} | {resultat['chargement_froid_s']:14.2f} s | {resultat['bout_en_bout']['p50_ms']:8.0f} ms "
+              f"| {resultat['bout_en_bout']['p99_ms']:8.0f} ms | {resultat['debit_rapports_s']:18.2f} "
+              f"| {resultat['rss_max_mo']:.0f} Mo")
+
+    rapport = {
+        "commit": commit_courant(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "parametres": vars(args),
+        "appels_llm": llm.appels,
+        "resultats": resultats,
+    }
+    with open(args.sortie, "w", encoding="utf-8") as f:
+        json.dump(rapport, f, ensure_ascii=False, indent=2)
+    print(f"Résultats : {args.sortie}")
+
+
+if __name__ == "__main__":
+    main()
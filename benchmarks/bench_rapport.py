@@ -0,0 +1,119 @@
+"""
+Compare l'ancien assemblage du rapport (un PDF temporaire par section, fusionnés par
+PyPDF2.PdfMerger, couverture redimensionnée dans un PNG temporaire) au rendu en une
+seule passe de app.rendre_rapport. Les sections sont préparées une seule fois (appels
+OpenAI remplacés par un texte fixe) : seul le rendu est chronométré.
+
+Usage :
+    python benchmarks/bench_rapport.py 75020 appartement 60
+"""
+import os
+import sys
+import tempfile
+import time
+import types
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import app  # noqa: E402
+from PIL import Image as PILImage  # noqa: E402
+from PyPDF2 import PdfMerger  # noqa: E402
+from reportlab.lib.pagesizes import A4  # noqa: E402
+from reportlab.lib.units import cm  # noqa: E402
+from reportlab.platypus import Image, SimpleDocTemplate  # noqa: E402
+
+REPETITIONS = 10
+TEXTE_LLM = "Le bien est estimé entre 400 000 et 450 000 euros au vu des ventes comparables. " * 12
+
+
+class _ReponsesFixes:
+    async def create(self, **kwargs):
+        message = types.SimpleNamespace(content=TEXTE_LLM)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def redimensionner_png(image_path, output_path, target_size=(469, 716)):
+    """Ancienne préparation des couvertures : PNG à 1 pixel par point."""
+    with PILImage.open(image_path) as img:
+        img.resize(target_size, PILImage.LANCZOS).save(output_path, format="PNG")
+
+
+def generer_pdf_section(titre, elements):
+    """Ancien chemin : un SimpleDocTemplate temporaire par section."""
+    temp_pdf = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+    doc = SimpleDocTemplate(temp_pdf.name, pagesize=A4,
+                            topMargin=2*cm, bottomMargin=2*cm,
+                            leftMargin=2*cm, rightMargin=2*cm)
+    story = []
+    if titre:
+        app.add_section_title(story, titre)
+    story.extend(elements)
+    doc.build(story)
+    return temp_pdf.name
+
+
+def rendu_fusion(sections, output):
+    """
+    Ancien chemin : couvertures en PNG temporaire, PDF par section puis PdfMerger.
+    Renvoie (nombre de fichiers écrits, octets écrits), PDF final compris.
+    """
+    covers = app.couvertures_disponibles()
+    fichiers, octets = [], 0
+    for template_id, titre, elements in sections:
+        if template_id == "section":
+            fichiers.append(generer_pdf_section(titre, elements))
+            continue
+        index = 0 if template_id == "couverture" else 1
+        if index >= len(covers):
+            continue
+        png = tempfile.NamedTemporaryFile(delete=False, suffix=".png").name
+        redimensionner_png(covers[index], png)
+        fichiers.append(generer_pdf_section("", [Image(png, width=469, height=716)]))
+        octets += os.path.getsize(png)
+        os.remove(png)
+    merger = PdfMerger()
+    for pdf in fichiers:
+        merger.append(pdf)
+    with open(output, "wb") as fout:
+        merger.write(fout)
+    for pdf in fichiers:
+        octets += os.path.getsize(pdf)
+        os.remove(pdf)
+    nb_png = sum(1 for template_id, _, _ in sections if template_id != "section")
+    return len(fichiers) + min(nb_png, len(covers)) + 1, octets + os.path.getsize(output)
+
+
+def chronometrer(rendu, form_data, output):
+    total = 0.0
+    for _ in range(REPETITIONS):
+        sections = app.preparer_sections(form_data)
+        start = time.perf_counter()
+        rendu(sections, output)
+        total += time.perf_counter() - start
+    return total / REPETITIONS * 1000
+
+
+def main():
+    code_postal, type_bien, surface = (sys.argv[1:] + ["75020", "appartement", "60"][len(sys.argv[1:]):])[:3]
+    app.async_client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_ReponsesFixes()))
+    form_data = {"civilite": "M.", "prenom": "Jean", "nom": "Dupont", "code_postal": code_postal,
+                 "type_bien": type_bien, "app_surface": surface, "maison_surface": surface}
+    with tempfile.TemporaryDirectory() as dossier:
+        sortie_fusion = os.path.join(dossier, "fusion.pdf")
+        sortie_passe = os.path.join(dossier, "passe_unique.pdf")
+
+        nb_fichiers, octets_fusion = rendu_fusion(app.preparer_sections(form_data), sortie_fusion)
+        fusion_ms = chronometrer(rendu_fusion, form_data, sortie_fusion)
+        passe_ms = chronometrer(partial(app.rendre_rapport, profil=app.profil_pdf(form_data)), form_data, sortie_passe)
+        taille_fusion = os.path.getsize(sortie_fusion)
+        taille_passe = os.path.getsize(sortie_passe)
+
+    print("chemin        | rendu (ms) | fichiers écrits | octets écrits | PDF final")
+    print(f"fusion        | {fusion_ms:10.1f} | {nb_fichiers:15d} | {octets_fusion:13d} | {taille_fusion}")
+    print(f"passe unique  | {passe_ms:10.1f} | {1:15d} | {taille_passe:13d} | {taille_passe}")
+
+
+if __name__ == "__main__":
+    main()
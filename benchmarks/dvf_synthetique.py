@@ -0,0 +1,108 @@
+"""
+Générateur de fichiers DVF synthétiques au schéma réel (40 colonnes, mêmes formats que
+les fichiers data.gouv) : taille choisie, tirages déterministes (graine fixe).
+
+Usage :
+    python benchmarks/dvf_synthetique.py 75 100000 --dossier /tmp/dvf_synthetique
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+COLONNES_DVF = [
+    "id_mutation", "date_mutation", "numero_disposition", "nature_mutation", "valeur_fonciere",
+    "adresse_numero", "adresse_suffixe", "adresse_nom_voie", "adresse_code_voie", "code_postal",
+    "code_commune", "nom_commune", "code_departement", "ancien_code_commune", "ancien_nom_commune",
+    "id_parcelle", "ancien_id_parcelle", "numero_volume", "lot1_numero", "lot1_surface_carrez",
+    "lot2_numero", "lot2_surface_carrez", "lot3_numero", "lot3_surface_carrez", "lot4_numero",
+    "lot4_surface_carrez", "lot5_numero", "lot5_surface_carrez", "nombre_lots", "code_type_local",
+    "type_local", "surface_reelle_bati", "nombre_pieces_principales", "code_nature_culture", "nature_culture",
+    "code_nature_culture_speciale", "nature_culture_speciale", "surface_terrain", "longitude", "latitude",
+]
+
+TYPES_LOCAL = ["Appartement", "Maison", "Dépendance", "Local industriel. commercial ou assimilé"]
+CODES_TYPE_LOCAL = [2, 1, 3, 4]
+PROBAS_TYPE_LOCAL = [0.5, 0.2, 0.25, 0.05]
+PRIX_M2_TYPE = [5000.0, 3500.0, 1500.0, 2500.0]
+TYPES_VOIE = ["RUE", "AV", "BD", "IMP", "PL", "CHE", "ALL"]
+NOMS_VOIE = ["DES LILAS", "VICTOR HUGO", "JEAN JAURES", "DE LA REPUBLIQUE", "PASTEUR", "DES ECOLES",
+             "DU MOULIN", "DE LA GARE", "GAMBETTA", "DES PEUPLIERS", "DU CHATEAU", "SAINT MARTIN"]
+
+
+def generer_departement(dept, lignes, annees=(2020, 2024), codes_postaux=20, voies=400, seed=0):
+    """DataFrame DVF synthétique d'un département (toutes colonnes en texte, comme le CSV source)."""
+    rng = np.random.default_rng(seed)
+    # Une mutation regroupe 1 à 3 lignes, comme dans les fichiers réels
+    mutations = np.cumsum(rng.random(lignes) < 0.6)
+    jours = rng.integers(0, (annees[1] - annees[0] + 1) * 365, mutations.max() + 1)[mutations]
+    dates = pd.Timestamp(f"{annees[0]}-01-01") + pd.to_timedelta(jours, unit="D")
+
+    cp_index = rng.integers(0, codes_postaux, lignes)
+    base_cp = int(dept) * 1000 if dept.isdigit() and len(dept) == 2 else 20000
+    codes_postaux_possibles = np.array([f"{base_cp + 1 + i:05d}" for i in range(codes_postaux)])
+    communes = np.array([f"{dept}{101 + i:03d}" for i in range(codes_postaux)])
+    noms_communes = np.array([f"Commune synthétique {i + 1}" for i in range(codes_postaux)])
+
+    voie_index = rng.integers(0, voies, lignes)
+    noms_voies = np.array([f"{TYPES_VOIE[i % len(TYPES_VOIE)]} {NOMS_VOIE[i % len(NOMS_VOIE)]} {i // len(NOMS_VOIE) + 1}"
+                           for i in range(voies)])
+
+    type_index = rng.choice(len(TYPES_LOCAL), size=lignes, p=PROBAS_TYPE_LOCAL)
+    surfaces = np.round(rng.lognormal(np.log(55), 0.5, lignes)).clip(9, 600)
+    surfaces[type_index == 1] *= 1.8
+    prix_m2 = np.array(PRIX_M2_TYPE)[type_index] * rng.lognormal(0, 0.25, lignes)
+    valeurs = np.round(surfaces * prix_m2, -2)
+
+    # Coordonnées : un centre par code postal, les ventes autour (quelques centaines de mètres)
+    centres_lon = 2.3 + rng.normal(0, 0.05, codes_postaux)
+    centres_lat = 48.85 + rng.normal(0, 0.03, codes_postaux)
+    longitudes = centres_lon[cp_index] + rng.normal(0, 0.004, lignes)
+    latitudes = centres_lat[cp_index] + rng.normal(0, 0.003, lignes)
+
+    vide = np.full(lignes, "", dtype=object)
+    df = pd.DataFrame({colonne: vide for colonne in COLONNES_DVF})
+    df["id_mutation"] = [f"{annees[0]}-{m}" for m in mutations]
+    df["date_mutation"] = dates.strftime("%Y-%m-%d")
+    df["numero_disposition"] = "000001"
+    df["nature_mutation"] = "Vente"
+    df["valeur_fonciere"] = valeurs.astype(np.int64).astype(str)
+    df["adresse_numero"] = rng.integers(1, 200, lignes).astype(str)
+    df["adresse_nom_voie"] = noms_voies[voie_index]
+    df["adresse_code_voie"] = np.char.zfill(voie_index.astype(str), 4)
+    df["code_postal"] = codes_postaux_possibles[cp_index]
+    df["code_commune"] = communes[cp_index]
+    df["nom_commune"] = noms_communes[cp_index]
+    df["code_departement"] = dept
+    df["id_parcelle"] = [f"{c}000AB{n:04d}" for c, n in zip(communes[cp_index], rng.integers(0, 9999, lignes))]
+    df["nombre_lots"] = "0"
+    df["code_type_local"] = np.array(CODES_TYPE_LOCAL)[type_index].astype(str)
+    df["type_local"] = np.array(TYPES_LOCAL)[type_index]
+    df["surface_reelle_bati"] = surfaces.astype(np.int64).astype(str)
+    df["nombre_pieces_principales"] = np.maximum(1, surfaces // 20).astype(np.int64).astype(str)
+    df["surface_terrain"] = np.where(type_index == 1, rng.integers(100, 2000, lignes).astype(str), "")
+    df["longitude"] = np.round(longitudes, 6).astype(str)
+    df["latitude"] = np.round(latitudes, 6).astype(str)
+    return df
+
+
+def ecrire_departement(dossier, dept, lignes, **options):
+    """Écrit {dossier}/{dept}.csv.gz et renvoie son chemin."""
+    os.makedirs(dossier, exist_ok=True)
+    path = os.path.join(dossier, f"{dept}.csv.gz")
+    generer_departement(dept, lignes, **options).to_csv(path, index=False, compression="gzip")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fichiers DVF synthétiques")
+    parser.add_argument("departement")
+    parser.add_argument("lignes", type=int)
+    parser.add_argument("--dossier", default="./dvf_synthetique/")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    path = ecrire_departement(args.dossier, args.departement, args.lignes, seed=args.seed)
+    print(f"{path} : {args.lignes} lignes, {os.path.getsize(path) / 1e6:.1f} Mo en {time.perf_counter() - start:.1f}s")
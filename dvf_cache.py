@@ -0,0 +1,126 @@
+"""
+Cache mémoire partagé (par processus) des DataFrames DVF départementaux normalisés
+(ou des index construits dessus, voir dvf_index.py).
+
+- LRU avec un budget en octets (les départements ont des tailles très différentes)
+- invalidation automatique quand le mtime du fichier source change
+- les chargements concurrents d'une même clé sont fusionnés en un seul
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+DVF_CACHE_MAX_BYTES = int(os.environ.get("DVF_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+
+def _taille(valeur):
+    """Taille mémoire d'une entrée : DataFrame, bytes ou objet exposant `nbytes`."""
+    if isinstance(valeur, (bytes, bytearray)):
+        return len(valeur)
+    if hasattr(valeur, "memory_usage"):
+        return int(valeur.memory_usage(deep=True).sum())
+    return int(valeur.nbytes)
+
+
+class _Chargement:
+    """Chargement en cours : les autres threads attendent son résultat."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class DataFrameCache:
+    def __init__(self, max_bytes=DVF_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # clé -> (mtime, df, taille en octets)
+        self._inflight = {}            # clé -> _Chargement
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key, source_path, loader):
+        """
+        Renvoie le DataFrame associé à `key`, en appelant `loader(source_path)` si besoin.
+        Le DataFrame renvoyé est partagé : l'appelant ne doit pas le modifier en place.
+        """
+        mtime = os.path.getmtime(source_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == mtime:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                logging.info(f"♻️ Cache DVF : {key} modifié sur disque, entrée invalidée.")
+                self._drop(key)
+            pending = self._inflight.get(key)
+            owner = pending is None
+            if owner:
+                pending = _Chargement()
+                self._inflight[key] = pending
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            pending.event.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            df = loader(source_path)
+            pending.value = df
+        except Exception as e:
+            pending.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+                if pending.error is None:
+                    self._store(key, mtime, pending.value)
+            pending.event.set()
+        return df
+
+    def _store(self, key, mtime, df):
+        size = _taille(df)
+        if size > self.max_bytes:
+            logging.warning(f"⚠️ Cache DVF : {key} ({size / 1e6:.0f} Mo) dépasse le budget, non mis en cache.")
+            return
+        self._entries[key] = (mtime, df, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.evictions += 1
+
+    def _drop(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Instance unique partagée par tous les threads du processus
+department_cache = DataFrameCache()
@@ -0,0 +1,133 @@
+"""
+Estimation locale et déterministe d'un bien à partir de ses ventes DVF comparables.
+
+- une ligne par vente : une mutation de plusieurs lots répète son prix total sur chacune
+  de ses lignes, il est rapporté à la surface bâtie de toute la mutation
+- chaque vente est pondérée par sa proximité en surface (écart des logarithmes), son
+  ancienneté (demi-vie) et sa distance au bien quand elle est connue (colonne `distance_m`)
+- les prix au m² sont actualisés par l'indice annuel du prix médian au m² du secteur
+- fourchette = quantiles pondérés 25 / 50 / 75 % du prix au m² actualisé, multipliés par
+  la surface du bien ; confiance (0 à 1) selon le nombre effectif de comparables et la
+  dispersion de la fourchette
+
+Tout est vectorisé sur les colonnes NumPy du DataFrame filtré (voir app.load_dvf_data_avance).
+"""
+import numpy as np
+
+DEMI_VIE_ANS = 2.0              # une vente de 2 ans pèse moitié moins qu'une vente récente
+ECART_SURFACE = 0.25            # écart-type de log(surface comparable / surface du bien)
+DISTANCE_CARACTERISTIQUE_M = 500
+COMPARABLES_CIBLES = 20         # nombre effectif de comparables pour une confiance pleine
+VENTES_MIN_INDICE = 10          # ventes minimales d'une année pour qu'elle compte dans l'indice
+CONFIANCE_MIN = 0.2             # en dessous, la fourchette n'est ni affichée ni donnée au modèle
+RAPPORT_HAUT_BAS_MAX = 2.0      # fourchette plus large : données incohérentes, même règle
+
+
+def quantiles_ponderes(valeurs, poids, quantiles):
+    """Quantiles pondérés (interpolation entre les centres des masses cumulées)."""
+    ordre = np.argsort(valeurs, kind="stable")
+    valeurs, poids = valeurs[ordre], poids[ordre]
+    cumul = (np.cumsum(poids) - 0.5 * poids) / poids.sum()
+    return np.interp(quantiles, cumul, valeurs)
+
+
+def facteurs_actualisation(annees, indice_annuel):
+    """
+    Coefficient qui ramène un prix de l'année de vente au niveau de la dernière année
+    de `indice_annuel` ({année: prix médian au m²}) ; 1 pour les années absentes.
+    """
+    if not indice_annuel:
+        return np.ones(len(annees))
+    annees_indice = np.array(sorted(indice_annuel), dtype=np.int64)
+    niveaux = np.array([indice_annuel[annee] for annee in annees_indice], dtype=np.float64)
+    position = np.clip(np.searchsorted(annees_indice, annees), 0, len(annees_indice) - 1)
+    connues = (annees_indice[position] == annees) & (niveaux[position] > 0)
+    return np.where(connues, niveaux[-1] / np.where(connues, niveaux[position], 1.0), 1.0)
+
+
+def ventes_par_mutation(df):
+    """
+    Une ligne par mutation, dont la surface est la surface bâtie de toute la mutation
+    (colonne surface_mutation de l'index, à défaut somme des lignes présentes).
+    Les lignes sans id_mutation sont gardées telles quelles.
+    """
+    if "id_mutation" not in df.columns:
+        return df
+    ids = df["id_mutation"]
+    if "surface_mutation" in df.columns:
+        surfaces = df["surface_mutation"]
+    else:
+        surfaces = df.groupby(ids, observed=True, sort=False)["surface_reelle_bati"].transform("sum")
+    premieres = ids.isna().to_numpy() | ~ids.duplicated().to_numpy()
+    return df.assign(surface_reelle_bati=surfaces.fillna(df["surface_reelle_bati"]))[premieres]
+
+
+def estimer_valeur(df, surface, indice_annuel=None):
+    """
+    Fourchette de valeur d'un bien de `surface` m² d'après les ventes de `df` (colonnes
+    valeur_fonciere, surface_reelle_bati, date_mutation et éventuellement id_mutation,
+    surface_mutation et distance_m), comptées une fois par mutation (ventes_par_mutation).
+    Renvoie un dict (bas, median, haut en euros, prix au m² correspondants, confiance,
+    nombre de comparables) ou None si l'estimation est impossible.
+    """
+    if df is None or df.empty or not surface or surface <= 0:
+        return None
+    df = ventes_par_mutation(df)
+    valeurs = df["valeur_fonciere"].to_numpy(np.float64)
+    surfaces = df["surface_reelle_bati"].to_numpy(np.float64)
+    dates = df["date_mutation"].to_numpy("datetime64[D]")
+    # Distance inconnue (bien non localisé) : aucune pénalité
+    distances = (np.nan_to_num(df["distance_m"].to_numpy(np.float64), nan=0.0) if "distance_m" in df.columns
+                 else np.zeros(len(df)))
+    valides = np.isfinite(valeurs) & np.isfinite(surfaces) & (surfaces > 0) & (valeurs > 0) & ~np.isnat(dates)
+    if not valides.any():
+        return None
+    valeurs, surfaces, dates, distances = valeurs[valides], surfaces[valides], dates[valides], distances[valides]
+
+    annees = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    prix_m2 = valeurs / surfaces * facteurs_actualisation(annees, indice_annuel)
+    # Ventes aberrantes (lots, erreurs de saisie) : hors du 1er-99e centile
+    if len(prix_m2) >= 20:
+        bas, haut = np.percentile(prix_m2, [1, 99])
+        gardees = (prix_m2 >= bas) & (prix_m2 <= haut)
+        prix_m2, surfaces, dates, distances = prix_m2[gardees], surfaces[gardees], dates[gardees], distances[gardees]
+
+    poids = np.exp(-0.5 * (np.log(surfaces / surface) / ECART_SURFACE) ** 2)
+    age_ans = (dates.max() - dates).astype(np.float64) / 365.25
+    poids *= 0.5 ** (age_ans / DEMI_VIE_ANS)
+    poids *= np.exp(-distances / DISTANCE_CARACTERISTIQUE_M)
+    if not poids.sum() > 0:
+        return None
+
+    p25, p50, p75 = quantiles_ponderes(prix_m2, poids, [0.25, 0.5, 0.75])
+    comparables_effectifs = poids.sum() ** 2 / (poids ** 2).sum()
+    dispersion = (p75 - p25) / p50 if p50 > 0 else 1.0
+    confiance = min(1.0, comparables_effectifs / COMPARABLES_CIBLES) * float(np.clip(1 - dispersion, 0, 1))
+    return {
+        "bas": round(float(p25 * surface), -3),
+        "median": round(float(p50 * surface), -3),
+        "haut": round(float(p75 * surface), -3),
+        "prix_m2_bas": round(float(p25)),
+        "prix_m2_median": round(float(p50)),
+        "prix_m2_haut": round(float(p75)),
+        "surface": float(surface),
+        "confiance": float(round(confiance, 2)),
+        "comparables": int(len(prix_m2)),
+        "comparables_effectifs": round(float(comparables_effectifs), 1),
+    }
+
+
+def estimation_fiable(valeur):
+    """Vrai si la fourchette peut être présentée : confiance suffisante et haut/bas plausible."""
+    return (valeur["confiance"] >= CONFIANCE_MIN and valeur["bas"] > 0
+            and valeur["haut"] <= RAPPORT_HAUT_BAS_MAX * valeur["bas"])
+
+
+def niveau_confiance(confiance):
+    return "élevée" if confiance >= 0.66 else "moyenne" if confiance >= 0.33 else "faible"
+
+
+def indice_annuel(serie):
+    """{année: prix médian au m²} des lignes annuelles assez fournies d'une série d'agrégats (app.serie_prix_m2)."""
+    annuel = serie[(serie["trimestre"] == 0) & (serie["nb_ventes"] >= VENTES_MIN_INDICE)]
+    return dict(zip(annuel["annee"].astype(int), annuel["prix_m2_median"].astype(float)))
@@ -0,0 +1,294 @@
+"""
+Index trié des ventes DVF pour la recherche de comparables.
+
+Les lignes sont triées par (code_postal, type_local, surface_reelle_bati) et une table
+d'offsets donne, pour chaque couple (code postal, type de bien), la tranche contiguë
+correspondante. Une recherche se résume alors à une lecture de dictionnaire, deux
+recherches dichotomiques sur les surfaces et un découpage, sans balayer tout le DataFrame.
+
+Pour le filtrage par adresse, un index inversé par code postal associe chaque mot
+normalisé des noms de voie (sans accents, abréviations DVF développées, mots vides
+retirés) aux lignes qui le contiennent ; les ventes sont classées par nombre de mots
+en commun avec l'adresse du bien.
+
+Enfin une grille spatiale (cellules carrées de TAILLE_CELLULE_M, construite à la demande
+sur longitude/latitude) permet les recherches par rayon et des k plus proches voisins
+autour du bien, y compris au-delà de la limite du code postal.
+
+Chaque ligne porte aussi la surface bâtie totale de sa mutation (`surface_mutation`) :
+une vente de plusieurs lots répète son prix total sur chacune de ses lignes.
+"""
+import re
+import unicodedata
+
+import numpy as np
+
+SORT_COLUMNS = ["code_postal", "type_local", "surface_reelle_bati"]
+
+# Formes longues / variantes -> abréviation DVF (ou forme développée pour les titres)
+ABREVIATIONS = {
+    "avenue": "av", "ave": "av",
+    "boulevard": "bd", "boul": "bd", "bld": "bd",
+    "allee": "all", "allees": "all",
+    "chemin": "che", "chem": "che",
+    "impasse": "imp",
+    "place": "pl",
+    "route": "rte",
+    "residence": "res",
+    "lotissement": "lot",
+    "square": "sq",
+    "passage": "pas", "pass": "pas",
+    "quai": "qua",
+    "cours": "crs",
+    "villa": "vla",
+    "ruelle": "rle",
+    "terrasse": "tsse",
+    "quartier": "qrt",
+    "hameau": "ham",
+    "traverse": "tra",
+    "sentier": "sen",
+    "montee": "mte",
+    "lieudit": "ldt",
+    "faubourg": "fg", "fbg": "fg",
+    "r": "rue",
+    "st": "saint", "ste": "sainte",
+    "gal": "general", "gen": "general",
+    "mal": "marechal",
+    "pdt": "president",
+    "dr": "docteur",
+    "cdt": "commandant", "cmdt": "commandant",
+    "lt": "lieutenant",
+    "cne": "capitaine", "capt": "capitaine",
+    "prof": "professeur",
+    "mgr": "monseigneur",
+}
+# Types de voie : comptent peu dans le score (presque toutes les adresses en ont un)
+TYPES_VOIE = {
+    "rue", "av", "bd", "all", "che", "imp", "pl", "rte", "res", "lot", "sq", "pas", "qua",
+    "crs", "vla", "rle", "tsse", "qrt", "ham", "tra", "sen", "mte", "ldt", "fg", "cite",
+    "voie", "vc", "cd", "clos", "parc",
+}
+POIDS_TYPE_VOIE = 0.25
+
+TAILLE_CELLULE_M = 250
+METRES_PAR_DEGRE = 111_320
+RAYON_MAX_M = 20_000
+# Clé de cellule = cx * DECALAGE_CELLULE + cy (|cy| reste très inférieur au décalage)
+DECALAGE_CELLULE = 10_000_000
+MOTS_VIDES = {
+    "de", "du", "des", "d", "la", "le", "les", "l", "a", "au", "aux", "et", "en", "sur", "sous",
+    "bis", "ter",
+}
+
+
+def tokeniser_adresse(texte):
+    """Mots significatifs d'une adresse : minuscules, sans accents, abréviations unifiées."""
+    texte = unicodedata.normalize("NFKD", str(texte)).encode("ascii", "ignore").decode("ascii")
+    tokens = []
+    for mot in re.split(r"[^a-z0-9]+", texte.lower()):
+        if not mot or mot.isdigit() or mot in MOTS_VIDES:
+            continue
+        mot = ABREVIATIONS.get(mot, mot)
+        if mot not in tokens:
+            tokens.append(mot)
+    return tokens
+
+
+def _labels(serie):
+    """Libellé de chaque ligne via les codes de catégorie (None pour les valeurs manquantes)."""
+    serie = serie.astype("category")
+    categories = np.append(serie.cat.categories.astype(str).to_numpy(dtype=object), None)
+    return serie.cat.codes.to_numpy(), categories
+
+
+class DvfIndex:
+    def __init__(self, df):
+        self.df = df.sort_values(SORT_COLUMNS, kind="stable", ignore_index=True)
+        if "id_mutation" in self.df.columns:
+            self.df["surface_mutation"] = (self.df.groupby("id_mutation", observed=True, sort=False)
+                                           ["surface_reelle_bati"].transform("sum").astype("float32"))
+        self._surface = self.df["surface_reelle_bati"].to_numpy()
+
+        cp_codes, cp_labels = _labels(self.df["code_postal"])
+        type_codes, type_labels = _labels(self.df["type_local"])
+        n = len(self.df)
+        changes = np.flatnonzero((cp_codes[1:] != cp_codes[:-1]) | (type_codes[1:] != type_codes[:-1])) + 1
+        starts = np.r_[0, changes] if n else np.array([], dtype=np.int64)
+        ends = np.r_[changes, n] if n else np.array([], dtype=np.int64)
+
+        # (code_postal, type_local) -> (début, fin) et code_postal -> (début, fin)
+        self._offsets = {}
+        self._cp_offsets = {}
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            code_postal = cp_labels[cp_codes[start]]
+            type_local = type_labels[type_codes[start]]
+            self._offsets[(code_postal, type_local)] = (start, end)
+            cp_start, _ = self._cp_offsets.get(code_postal, (start, end))
+            self._cp_offsets[code_postal] = (cp_start, end)
+
+        self._type_codes = type_codes
+        self._type_labels = {label: code for code, label in enumerate(type_labels[:-1])}
+
+        # Index inversé des adresses, construit à la demande pour chaque code postal
+        self._adresses = {}
+        # Grille spatiale, construite à la première recherche géographique
+        self._grille = None
+
+    @property
+    def nbytes(self):
+        return int(self.df.memory_usage(deep=True).sum())
+
+    def codes_postaux(self):
+        return [cp for cp in self._cp_offsets if cp is not None]
+
+    def _index_adresses(self, code_postal):
+        """{mot: positions des lignes} pour les noms de voie d'un code postal."""
+        index = self._adresses.get(code_postal)
+        if index is not None:
+            return index
+        start, end = self._cp_offsets.get(code_postal, (0, 0))
+        colonne = "nom_voie" if "nom_voie" in self.df.columns else "adresse"
+        voies = self.df[colonne].iloc[start:end].astype("category").cat.remove_unused_categories()
+        codes = voies.cat.codes.to_numpy()
+        ordre = np.argsort(codes, kind="stable")
+        bornes = np.flatnonzero(np.diff(codes[ordre])) + 1
+        postings = {}
+        for groupe in np.split(ordre, bornes):
+            if not len(groupe) or codes[groupe[0]] < 0:
+                continue
+            for token in tokeniser_adresse(voies.cat.categories[codes[groupe[0]]]):
+                postings.setdefault(token, []).append(groupe + start)
+        index = {token: np.sort(np.concatenate(listes)) for token, listes in postings.items()}
+        self._adresses[code_postal] = index
+        return index
+
+    def score_adresse(self, code_postal, adresse):
+        """
+        Score de chaque ligne du code postal : +1 par mot du nom de voie en commun avec
+        `adresse`, +0,25 par type de voie en commun. Renvoie (positions, scores) ; seules
+        les lignes partageant au moins un mot du nom de voie sont retenues.
+        """
+        index = self._index_adresses(code_postal)
+        positions, poids = [], []
+        for token in tokeniser_adresse(adresse):
+            lignes = index.get(token)
+            if lignes is not None:
+                positions.append(lignes)
+                poids.append(np.full(len(lignes), POIDS_TYPE_VOIE if token in TYPES_VOIE else 1.0))
+        if not positions:
+            return np.array([], dtype=np.int64), np.array([])
+        lignes, inverse = np.unique(np.concatenate(positions), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(poids))
+        retenues = scores >= 1
+        return lignes[retenues], scores[retenues]
+
+    def localiser_adresse(self, code_postal, adresse):
+        """(longitude, latitude) médianes des ventes de la voie la mieux appariée, ou None."""
+        lignes, scores = self.score_adresse(code_postal, adresse)
+        if not len(lignes) or "longitude" not in self.df.columns:
+            return None
+        coordonnees = self.df[["longitude", "latitude"]].iloc[lignes[scores == scores.max()]].median()
+        if coordonnees.isna().any():
+            return None
+        return float(coordonnees["longitude"]), float(coordonnees["latitude"])
+
+    def _projeter(self, longitude, latitude):
+        """Projection équirectangulaire locale en mètres (suffisante à l'échelle d'un département)."""
+        return longitude * self._cos_lat0 * METRES_PAR_DEGRE, latitude * METRES_PAR_DEGRE
+
+    def _construire_grille(self):
+        longitude = self.df["longitude"].to_numpy(np.float64)
+        latitude = self.df["latitude"].to_numpy(np.float64)
+        valides = np.flatnonzero(~np.isnan(longitude) & ~np.isnan(latitude))
+        lat0 = np.nanmean(latitude[valides]) if len(valides) else 0.0
+        self._cos_lat0 = np.cos(np.radians(lat0))
+        self._x, self._y = self._projeter(longitude, latitude)
+        cles = (np.floor(self._x[valides] / TAILLE_CELLULE_M).astype(np.int64) * DECALAGE_CELLULE
+                + np.floor(self._y[valides] / TAILLE_CELLULE_M).astype(np.int64))
+        ordre = np.argsort(cles, kind="stable")
+        self._grille = (cles[ordre], valides[ordre])
+
+    def _candidats(self, x, y, rayon_m):
+        """Positions des lignes situées dans les cellules qui recoupent le cercle (x, y, rayon)."""
+        cles, positions = self._grille
+        cx = np.arange(np.floor((x - rayon_m) / TAILLE_CELLULE_M), np.floor((x + rayon_m) / TAILLE_CELLULE_M) + 1)
+        cy_min = np.floor((y - rayon_m) / TAILLE_CELLULE_M)
+        cy_max = np.floor((y + rayon_m) / TAILLE_CELLULE_M)
+        colonnes = cx.astype(np.int64) * DECALAGE_CELLULE
+        debuts = np.searchsorted(cles, colonnes + int(cy_min), side="left")
+        fins = np.searchsorted(cles, colonnes + int(cy_max), side="right")
+        if not len(debuts):
+            return np.array([], dtype=np.int64)
+        return np.concatenate([positions[d:f] for d, f in zip(debuts, fins)])
+
+    def find_nearby(self, longitude, latitude, type_local=None, surface_range=None, rayon_m=None, k=None,
+                    columns=None):
+        """
+        Ventes autour d'un point, filtrées par type de bien et plage de surface, triées par
+        distance (colonne `distance_m`). `rayon_m` limite la distance ; `k` garde les k plus
+        proches. Sans rayon, la recherche s'élargit jusqu'à trouver k ventes (ou RAYON_MAX_M).
+        """
+        if self._grille is None:
+            self._construire_grille()
+        x, y = self._projeter(longitude, latitude)
+        if type_local is not None:
+            type_code = self._type_labels.get(type_local)
+        rayon = rayon_m if rayon_m is not None else TAILLE_CELLULE_M
+        while True:
+            lignes = self._candidats(x, y, rayon)
+            masque = np.ones(len(lignes), dtype=bool)
+            if type_local is not None:
+                masque &= self._type_codes[lignes] == type_code if type_code is not None else False
+            if surface_range is not None:
+                surfaces = self._surface[lignes]
+                masque &= (surfaces >= surface_range[0]) & (surfaces <= surface_range[1])
+            lignes = lignes[masque]
+            distances = np.hypot(self._x[lignes] - x, self._y[lignes] - y)
+            dans_rayon = distances <= rayon
+            lignes, distances = lignes[dans_rayon], distances[dans_rayon]
+            if rayon_m is not None or k is None or len(lignes) >= k or rayon >= RAYON_MAX_M:
+                break
+            rayon = min(rayon * 2, RAYON_MAX_M)
+        ordre = np.argsort(distances, kind="stable")
+        if k is not None:
+            ordre = ordre[:k]
+        result = self.df.iloc[lignes[ordre]]
+        if columns:
+            result = result[[c for c in columns if c in result.columns]]
+        result = result.copy()
+        result["distance_m"] = distances[ordre].round(0)
+        return result
+
+    def find_comparables(self, code_postal, type_local=None, surface_range=None, limit=None, columns=None,
+                         adresse=None):
+        """
+        Renvoie les ventes du code postal (et du type de bien si précisé) dont la surface
+        est comprise dans `surface_range` (bornes incluses). Avec `adresse`, seules les
+        ventes ayant le meilleur score d'adresse (voir score_adresse) sont gardées.
+        Avec `limit`, seules les `limit` ventes les plus récentes sont gardées.
+        """
+        if type_local is None:
+            start, end = self._cp_offsets.get(code_postal, (0, 0))
+            result = self.df.iloc[start:end]
+            if surface_range is not None:
+                surfaces = self._surface[start:end]
+                result = result[(surfaces >= surface_range[0]) & (surfaces <= surface_range[1])]
+        else:
+            start, end = self._offsets.get((code_postal, type_local), (0, 0))
+            if surface_range is not None:
+                surfaces = self._surface[start:end]
+                low = np.searchsorted(surfaces, surface_range[0], side="left")
+                high = np.searchsorted(surfaces, surface_range[1], side="right")
+                start, end = start + low, start + high
+            result = self.df.iloc[start:end]
+        if adresse:
+            lignes, scores = self.score_adresse(code_postal, adresse)
+            dans_resultat = np.isin(lignes, result.index.to_numpy())
+            lignes, scores = lignes[dans_resultat], scores[dans_resultat]
+            result = result.loc[lignes[scores == scores.max()]] if len(lignes) else result.iloc[0:0]
+        if limit is not None:
+            result = result.sort_values("date_mutation", ascending=False).head(limit)
+        if columns:
+            result = result[[c for c in columns if c in result.columns]]
+        return result.copy()
+
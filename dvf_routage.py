@@ -0,0 +1,60 @@
+"""
+Routage code postal → département(s) DVF et communes.
+
+Les deux premiers chiffres d'un code postal ne désignent pas toujours le fichier DVF :
+- Corse : 20xxx → 2A (Corse-du-Sud, 200xx-201xx) ou 2B (Haute-Corse, 202xx et 206xx)
+- outre-mer : 971xx-976xx → 971 à 976 (il n'existe pas de 97.csv.gz)
+- quelques codes postaux regroupent des communes de deux départements
+
+L'index de routage est construit à l'ingestion à partir des colonnes code_postal,
+code_departement et code_commune (voir dvf_store.py) et donne la réponse exacte. La règle
+des préfixes sert quand il est absent (lecture des fichiers bruts) ou ignore le code postal.
+"""
+import pandas as pd
+
+COLONNES_ROUTAGE = ["code_postal", "code_departement", "code_commune", "nom_commune"]
+
+
+def departement_probable(code_postal):
+    """Département déduit du seul code postal (Corse et outre-mer compris)."""
+    if code_postal.startswith("20"):
+        return "2A" if code_postal[:3] in ("200", "201") else "2B"
+    if code_postal.startswith("97"):
+        return code_postal[:3]
+    return code_postal[:2]
+
+
+def table_routage(df):
+    """Triplets (code postal, département, commune) distincts d'un DataFrame DVF, avec leur nombre de ventes."""
+    table = (df.dropna(subset=["code_postal", "code_departement"])
+             .groupby(COLONNES_ROUTAGE, observed=True, dropna=False).size().rename("ventes").reset_index())
+    return table.astype({c: str for c in COLONNES_ROUTAGE}).astype({"ventes": "int32"})
+
+
+class RoutageCodesPostaux:
+    def __init__(self, table):
+        ventes = (table.groupby(["code_postal", "code_departement"])["ventes"].sum().reset_index()
+                  .sort_values(["code_postal", "ventes"], ascending=[True, False], kind="stable"))
+        # code postal -> départements, le plus fourni en ventes d'abord
+        self._departements = {cp: tuple(groupe["code_departement"])
+                              for cp, groupe in ventes.groupby("code_postal", sort=False)}
+        communes = table.drop_duplicates(["code_postal", "code_commune"])
+        self._communes = {cp: list(zip(groupe["code_commune"], groupe["nom_commune"]))
+                          for cp, groupe in communes.groupby("code_postal", sort=False)}
+        self._taille = int(table.memory_usage(deep=True).sum())
+
+    @property
+    def nbytes(self):
+        return self._taille
+
+    def departements(self, code_postal):
+        """Départements couvrant le code postal (au moins un : la règle des préfixes à défaut)."""
+        return list(self._departements.get(code_postal) or [departement_probable(code_postal)])
+
+    def communes(self, code_postal):
+        """[(code_commune, nom_commune)] des ventes du code postal ([] s'il est inconnu)."""
+        return list(self._communes.get(code_postal, []))
+
+
+def lire_routage(path):
+    return RoutageCodesPostaux(pd.read_parquet(path))
@@ -0,0 +1,576 @@
+"""
+Entrepôt DVF colonnaire : conversion des fichiers dvf_data/{dept}.csv(.gz) en fichiers
+Parquet typés, partitionnés par département puis par code postal.
+
+L'ingestion est incrémentale et versionnée :
+- un manifeste (manifest.json) enregistre pour chaque fichier source son empreinte, son
+  nombre de lignes et sa plage de dates de mutation ; seuls les fichiers nouveaux ou
+  modifiés sont relus, les mutations déjà connues sont remplacées (par id_mutation)
+- chaque ingestion écrit une nouvelle version complète (les départements inchangés sont
+  des liens physiques vers la version précédente), publiée en remplaçant atomiquement le
+  manifeste : les processus en cours basculent à leur prochaine requête, sans redémarrage
+- les copies parasites ("01 (1).csv.gz", "01 2.csv"...) sont ignorées et signalées
+
+Usage :
+    python dvf_store.py ingest            # tous les départements
+    python dvf_store.py ingest 75 13 59   # seulement certains départements
+    python dvf_store.py ingest --force    # relit les sources même inchangées
+    python dvf_store.py statut            # version publiée et sources ingérées
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from dvf_routage import table_routage
+from metrics import span
+
+# Dossier contenant les fichiers DVF (.csv.gz)
+DVF_FOLDER = "./dvf_data/"
+# Dossier de l'entrepôt Parquet : {DVF_STORE_FOLDER}/{dept}/{code_postal}.parquet
+# et {DVF_STORE_FOLDER}/{dept}.parquet pour le département complet,
+# plus {DVF_STORE_FOLDER}/agregats/{dept}.parquet pour les indicateurs de marché
+DVF_STORE_FOLDER = os.environ.get("DVF_STORE_FOLDER", "./dvf_store/")
+
+# Versions conservées après une publication (les processus qui lisent encore l'ancienne
+# version au moment de la bascule terminent leur requête)
+DVF_STORE_VERSIONS = int(os.environ.get("DVF_STORE_VERSIONS", "3"))
+MANIFESTE = "manifest.json"
+
+# Seuls les fichiers canoniques sont ingérés ("75.csv.gz", "2A.csv", "971.csv.gz"...)
+SOURCE_PATTERN = re.compile(r"^(\d{2,3}|2A|2B)\.csv(\.gz)?$")
+# Copies parasites d'un fichier canonique : "01 (1).csv.gz", "01 2.csv", "06-copie.csv.gz"...
+COPIE_PATTERN = re.compile(r"^(\d{2,3}|2A|2B)\b.+\.csv(\.gz)?$")
+
+# Colonnes lues dans les fichiers DVF bruts et leur type à la lecture.
+# Les ~25 autres colonnes (id_parcelle, lots, nature_culture...) ne sont jamais lues.
+DVF_CSV_DTYPES = {
+    "id_mutation": "category",
+    "date_mutation": "category",
+    "valeur_fonciere": "float64",
+    "adresse_numero": "float32",
+    "adresse_nom_voie": "category",
+    "code_postal": "category",
+    "code_commune": "category",
+    "nom_commune": "category",
+    "code_departement": "category",
+    "type_local": "category",
+    "surface_reelle_bati": "float32",
+    "nombre_pieces_principales": "float32",
+    "surface_terrain": "float32",
+    "longitude": "float32",
+    "latitude": "float32",
+}
+
+# Types cibles après normalisation. valeur_fonciere reste en float64 : en float32 les
+# montants au-delà de 16,7 M€ perdraient leur précision à l'euro près.
+DVF_DTYPES = {
+    "id_mutation": "category",
+    "date_mutation": "datetime64[ns]",
+    "valeur_fonciere": "float64",
+    "numero_voie": "category",
+    "nom_voie": "category",
+    "adresse": "category",
+    "code_postal": "category",
+    "code_commune": "category",
+    "nom_commune": "category",
+    "code_departement": "category",
+    "type_local": "category",
+    "surface_reelle_bati": "float32",
+    "nombre_pieces_principales": "float32",
+    "surface_terrain": "float32",
+    "longitude": "float32",
+    "latitude": "float32",
+}
+
+# Colonnes conservées dans l'entrepôt (après normalisation)
+STORE_COLUMNS = list(DVF_DTYPES)
+
+# Libellés des agrégats toutes communes / tous types de bien confondus
+TOUTES_COMMUNES = "Toutes"
+TOUS_TYPES = "Tous"
+
+
+CODE_ALPHANUMERIQUE = re.compile(r"\d*[AB]\d*")
+
+
+def _map_categories(serie, fonction):
+    """
+    Applique `fonction` (str -> str ou None) aux seules valeurs distinctes d'une colonne
+    puis reprojette le résultat sur toutes les lignes par les codes de catégorie : aucune
+    chaîne n'est traitée ni hachée ligne par ligne.
+    """
+    serie = serie.astype("category")
+    labels = [fonction(valeur) for valeur in serie.cat.categories.astype(str).tolist()]
+    codes_labels, categories = pd.factorize(pd.Series(labels, dtype=object))
+    codes = np.append(codes_labels, -1)[serie.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=serie.index)
+
+
+def _normaliser_code(serie, width):
+    """
+    Normalise un code numérique (75020.0 -> "75020", 1076 -> "01076"). Les codes
+    alphanumériques ("2A004") sont conservés tels quels, les valeurs invalides deviennent NaN.
+    """
+    def normaliser(valeur):
+        valeur = valeur.strip()
+        try:
+            nombre = float(valeur)
+        except ValueError:
+            return valeur if CODE_ALPHANUMERIQUE.fullmatch(valeur) else None
+        return str(int(nombre)).zfill(width) if nombre.is_integer() else None
+    return _map_categories(serie, normaliser)
+
+
+def _concatener_adresse(numero, nom_voie):
+    """
+    Construit "numero nom_voie" sans concaténer ligne par ligne : seules les paires
+    (numéro, voie) distinctes sont assemblées, puis réindexées par leurs codes.
+    """
+    nb_voies = len(nom_voie.cat.categories) + 1
+    paires = (numero.cat.codes.to_numpy(np.int64) + 1) * nb_voies + (nom_voie.cat.codes.to_numpy(np.int64) + 1)
+    codes, uniques = pd.factorize(paires)
+    numeros = np.append("", numero.cat.categories.astype(str))[uniques // nb_voies].tolist()
+    voies = np.append("", nom_voie.cat.categories.astype(str))[uniques % nb_voies].tolist()
+    labels = pd.Series([f"{n} {v}".strip() for n, v in zip(numeros, voies)])
+    if labels.is_unique:
+        adresse = pd.Categorical.from_codes(codes, categories=labels)
+    else:
+        adresse = pd.Categorical(labels.to_numpy()[codes])
+    return pd.Series(adresse, index=numero.index)
+
+
+def normalize_columns(df):
+    """
+    Nettoie et renomme toutes les colonnes DVF + fusionne adresse + force les types.
+    Toutes les opérations sont vectorisées ; les colonnes texte répétitives sont
+    stockées en catégories et les numériques réduits en float32.
+    """
+    df.columns = [c.strip().lower().replace(" ", "_") for c in df.columns]
+    rename_map = {
+        "valeur_fonciere": "valeur_fonciere",
+        "surface_reelle_bati": "surface_reelle_bati",
+        "date_mutation": "date_mutation",
+        "type_local": "type_local",
+        "code_postal": "code_postal",
+        "adresse_nom_voie": "nom_voie",
+        "adresse_numero": "numero_voie",
+    }
+    df = df.rename(columns=rename_map)
+    if "code_postal" in df.columns:
+        df["code_postal"] = _normaliser_code(df["code_postal"], 5)
+    if "code_commune" in df.columns:
+        df["code_commune"] = _normaliser_code(df["code_commune"], 5)
+    if "code_departement" in df.columns:
+        df["code_departement"] = _normaliser_code(df["code_departement"], 2)
+    if "date_mutation" in df.columns:
+        # Quelques centaines de dates distinctes : chacune n'est lue qu'une fois
+        dates = df["date_mutation"].astype("category")
+        jours = pd.to_datetime(dates.cat.categories.astype(str), format="%Y-%m-%d", errors="coerce")
+        jours = np.append(jours.to_numpy("datetime64[ns]"), np.datetime64("NaT", "ns"))
+        df["date_mutation"] = pd.Series(jours[dates.cat.codes.to_numpy()], index=df.index)
+    if "numero_voie" in df.columns:
+        df["numero_voie"] = _normaliser_code(df["numero_voie"], 1)
+    if "nom_voie" in df.columns:
+        df["nom_voie"] = _map_categories(df["nom_voie"], str.strip)
+    if "numero_voie" in df.columns and "nom_voie" in df.columns:
+        df["adresse"] = _concatener_adresse(df["numero_voie"], df["nom_voie"])
+    elif "nom_voie" in df.columns:
+        df["adresse"] = df["nom_voie"]
+    for column, dtype in DVF_DTYPES.items():
+        if column in df.columns and str(df[column].dtype) != dtype:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def read_dvf_csv(source_path):
+    """Lit un fichier DVF brut en ne chargeant que les colonnes utiles, déjà typées, puis le normalise."""
+    with span("lecture_dvf", fichier=os.path.basename(source_path)) as attributs:
+        df = pd.read_csv(
+            source_path,
+            sep=",",
+            usecols=lambda c: c in DVF_CSV_DTYPES,
+            dtype=DVF_CSV_DTYPES,
+        )
+        attributs["lignes"] = len(df)
+    with span("normalisation_dvf"):
+        return normalize_columns(df)
+
+
+def regrouper_mutations(df):
+    """
+    Une ligne par mutation, sur ses seuls locaux bâtis (surface_reelle_bati > 0) : une mutation
+    de plusieurs lots répète son prix total sur chacune de ses lignes, il est rapporté ici à la
+    surface bâtie de toute la mutation. `types_locaux` : nombre de types de local de la mutation.
+    Les lignes sans id_mutation comptent chacune pour une vente.
+    """
+    bati = df[df["surface_reelle_bati"] > 0]
+    mutations, _ = pd.factorize(bati["id_mutation"]) if "id_mutation" in bati.columns else (None, None)
+    if mutations is None:
+        mutations = np.full(len(bati), -1)
+    mutations = np.where(mutations < 0, -1 - np.arange(len(bati)), mutations)
+    return bati.groupby(mutations, sort=False).agg(
+        date_mutation=("date_mutation", "first"),
+        valeur_fonciere=("valeur_fonciere", "first"),
+        code_postal=("code_postal", "first"),
+        nom_commune=("nom_commune", "first"),
+        type_local=("type_local", "first"),
+        types_locaux=("type_local", "nunique"),
+        surface_reelle_bati=("surface_reelle_bati", "sum"),
+    ).reset_index(drop=True)
+
+
+def compute_aggregates(df):
+    """
+    Indicateurs de prix au m² (nombre de ventes, moyenne, médiane, p25, p75) par année et
+    par trimestre, pour chaque code postal, par commune et par type de bien, ainsi que
+    toutes communes (TOUTES_COMMUNES) et tous types (TOUS_TYPES) confondus.
+    Les lignes annuelles ont trimestre = 0. Chaque mutation compte pour une vente (voir
+    regrouper_mutations).
+    """
+    ventes = regrouper_mutations(df.dropna(subset=["code_postal", "date_mutation"]))
+    ventes = ventes[(ventes["surface_reelle_bati"] > 10) & (ventes["valeur_fonciere"] > 1000)]
+    base = pd.DataFrame({
+        "code_postal": ventes["code_postal"].astype(str),
+        "nom_commune": ventes["nom_commune"].astype(str),
+        # Locaux de types différents : la vente ne compte que tous types confondus (NaN écarté du groupby)
+        "type_local": ventes["type_local"].astype(str).where(ventes["types_locaux"] == 1),
+        "annee": ventes["date_mutation"].dt.year.astype("int16"),
+        "trimestre": ventes["date_mutation"].dt.quarter.astype("int8"),
+        "prix_m2": ventes["valeur_fonciere"] / ventes["surface_reelle_bati"].astype("float64"),
+    })
+    frames = []
+    for par_commune in (True, False):
+        for par_type in (True, False):
+            for periode in (["annee"], ["annee", "trimestre"]):
+                keys = (["code_postal"] + (["nom_commune"] if par_commune else [])
+                        + (["type_local"] if par_type else []) + periode)
+                groupes = base.groupby(keys, sort=True)["prix_m2"]
+                stats = pd.concat({
+                    "nb_ventes": groupes.count(),
+                    "prix_m2_moyen": groupes.mean(),
+                    "prix_m2_median": groupes.median(),
+                    "prix_m2_p25": groupes.quantile(0.25),
+                    "prix_m2_p75": groupes.quantile(0.75),
+                }, axis=1).reset_index()
+                if not par_commune:
+                    stats["nom_commune"] = TOUTES_COMMUNES
+                if not par_type:
+                    stats["type_local"] = TOUS_TYPES
+                if "trimestre" not in periode:
+                    stats["trimestre"] = 0
+                frames.append(stats)
+    columns = ["code_postal", "nom_commune", "type_local", "annee", "trimestre",
+               "nb_ventes", "prix_m2_moyen", "prix_m2_median", "prix_m2_p25", "prix_m2_p75"]
+    aggregates = pd.concat(frames, ignore_index=True)[columns]
+    return aggregates.astype({"code_postal": "category", "nom_commune": "category", "type_local": "category",
+                              "trimestre": "int8", "nb_ventes": "int32"})
+
+
+def empreinte_fichier(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for bloc in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(bloc)
+    return sha.hexdigest()
+
+
+def inventaire_sources(folder=DVF_FOLDER):
+    """
+    Renvoie ({dept: chemin} des fichiers canoniques, [fichiers ignorés avec leur raison]).
+    Un seul fichier par département : le .csv.gz l'emporte sur le .csv, les copies sont écartées.
+    """
+    sources, ignores = {}, []
+    noms = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+    for filename in noms:
+        match = SOURCE_PATTERN.match(filename)
+        if not match:
+            continue
+        dept = match.group(1)
+        if dept in sources:
+            # "75.csv" est trié avant "75.csv.gz" : le .csv.gz l'emporte
+            ignores.append({"fichier": os.path.basename(sources[dept]), "raison": f"doublon de {filename}"})
+        sources[dept] = os.path.join(folder, filename)
+    for filename in noms:
+        if SOURCE_PATTERN.match(filename) or not filename.endswith((".csv", ".csv.gz")):
+            continue
+        match = COPIE_PATTERN.match(filename)
+        if match and match.group(1) in sources:
+            raison = f"copie de {os.path.basename(sources[match.group(1)])}"
+        else:
+            raison = "nom de fichier non reconnu"
+        ignores.append({"fichier": filename, "raison": raison})
+    return sources, ignores
+
+
+def source_files(folder=DVF_FOLDER):
+    """Renvoie {dept: chemin} pour les fichiers sources canoniques (le .csv.gz l'emporte sur le .csv)."""
+    return inventaire_sources(folder)[0]
+
+
+def lire_manifeste(store_folder=DVF_STORE_FOLDER):
+    """Manifeste publié (dict) ou None pour un entrepôt vide ou antérieur au versionnement."""
+    try:
+        with open(os.path.join(store_folder, MANIFESTE), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+_version = {}  # store_folder -> (mtime du manifeste, dossier de la version publiée)
+
+
+def dossier_donnees(store_folder=DVF_STORE_FOLDER):
+    """
+    Dossier de la version publiée. Le manifeste n'est relu que lorsqu'il change (un stat par
+    appel) : c'est ce qui fait basculer les processus en cours sur une nouvelle version.
+    Sans manifeste (entrepôt d'avant le versionnement), les fichiers sont à la racine.
+    """
+    try:
+        mtime = os.stat(os.path.join(store_folder, MANIFESTE)).st_mtime_ns
+    except FileNotFoundError:
+        return store_folder
+    connu = _version.get(store_folder)
+    if connu is None or connu[0] != mtime:
+        manifeste = lire_manifeste(store_folder)
+        dossier = os.path.join(store_folder, "versions", manifeste["version"]) if manifeste else store_folder
+        if connu is not None:
+            logging.info(f"🔄 Données DVF : bascule sur la version {manifeste['version'] if manifeste else 'racine'}.")
+        connu = (mtime, dossier)
+        _version[store_folder] = connu
+    return connu[1]
+
+
+def partition_path(dept_code, code_postal, store_folder=None):
+    return os.path.join(store_folder or dossier_donnees(), dept_code, f"{code_postal}.parquet")
+
+
+def department_path(dept_code, store_folder=None):
+    """Fichier départemental complet, pour les recherches qui traversent les codes postaux."""
+    return os.path.join(store_folder or dossier_donnees(), f"{dept_code}.parquet")
+
+
+def aggregates_path(dept_code, store_folder=None):
+    return os.path.join(store_folder or dossier_donnees(), "agregats", f"{dept_code}.parquet")
+
+
+def routage_path(dept_code=None, store_folder=None):
+    """Index de routage des codes postaux : global (sans `dept_code`) ou d'un département."""
+    if dept_code is None:
+        return os.path.join(store_folder or dossier_donnees(), "routage.parquet")
+    return os.path.join(store_folder or dossier_donnees(), "routage", f"{dept_code}.parquet")
+
+
+def _write_parquet(df, target):
+    # Écriture atomique : un lecteur ne voit jamais un fichier à moitié écrit
+    tmp_path = f"{target}.tmp"
+    df.to_parquet(tmp_path, index=False, compression="zstd")
+    os.replace(tmp_path, target)
+
+
+def ecrire_departement(df, dept_code, dossier):
+    """Écrit les partitions par code postal, le fichier départemental et les agrégats de `df`."""
+    df = df.dropna(subset=["code_postal"])
+    df = df[[c for c in STORE_COLUMNS if c in df.columns]]
+    # Partitions pré-triées pour l'index de comparables (voir dvf_index.py)
+    df = df.sort_values(["code_postal", "type_local", "surface_reelle_bati"], kind="stable")
+
+    dept_folder = os.path.join(dossier, dept_code)
+    os.makedirs(dept_folder, exist_ok=True)
+    count = 0
+    for code_postal, part in df.groupby("code_postal", sort=False, observed=True):
+        # Chaque partition ne garde que les catégories qu'elle utilise
+        categories = part.select_dtypes("category").columns
+        part = part.assign(**{c: part[c].cat.remove_unused_categories() for c in categories})
+        _write_parquet(part, partition_path(dept_code, code_postal, dossier))
+        count += 1
+    _write_parquet(df, department_path(dept_code, dossier))
+    os.makedirs(os.path.dirname(aggregates_path(dept_code, dossier)), exist_ok=True)
+    _write_parquet(compute_aggregates(df), aggregates_path(dept_code, dossier))
+    os.makedirs(os.path.dirname(routage_path(dept_code, dossier)), exist_ok=True)
+    _write_parquet(table_routage(df), routage_path(dept_code, dossier))
+    return len(df), count
+
+
+def fusionner_mutations(precedent, nouveau):
+    """
+    Ventes de `precedent` dont la mutation n'apparaît pas dans `nouveau`, plus toutes celles
+    de `nouveau` : une mutation republiée (plusieurs lignes par id_mutation) remplace l'ancienne.
+    """
+    if precedent is None or precedent.empty:
+        return nouveau
+    if "id_mutation" in precedent.columns and "id_mutation" in nouveau.columns:
+        precedent = precedent[~precedent["id_mutation"].isin(nouveau["id_mutation"].unique())]
+    fusion = pd.concat([precedent, nouveau], ignore_index=True)
+    return fusion.astype({c: t for c, t in DVF_DTYPES.items() if c in fusion.columns})
+
+
+def ingest_department(dept_code, source_path, dossier, precedent_folder=None):
+    """
+    Ingère un fichier DVF départemental dans la version `dossier`, fusionné par id_mutation
+    avec les ventes déjà ingérées dans `precedent_folder`. Renvoie l'entrée du manifeste.
+    """
+    start_time = time.time()
+    df = read_dvf_csv(source_path)
+    entree = {
+        "fichier": os.path.basename(source_path),
+        "taille": os.path.getsize(source_path),
+        "mtime": os.path.getmtime(source_path),
+        "lignes": len(df),
+        "date_min": str(df["date_mutation"].min().date()) if df["date_mutation"].notna().any() else None,
+        "date_max": str(df["date_mutation"].max().date()) if df["date_mutation"].notna().any() else None,
+    }
+    precedent = None
+    if precedent_folder and os.path.exists(department_path(dept_code, precedent_folder)):
+        precedent = pd.read_parquet(department_path(dept_code, precedent_folder))
+    lignes, count = ecrire_departement(fusionner_mutations(precedent, df), dept_code, dossier)
+    entree["lignes_entrepot"] = lignes
+    elapsed = time.time() - start_time
+    logging.info(f"✅ Département {dept_code} ingéré : {len(df)} lignes lues, {lignes} en entrepôt, "
+                 f"{count} codes postaux en {elapsed:.2f}s.")
+    return entree
+
+
+def _lier_departement(dept_code, source, cible):
+    """Reprend tel quel un département de la version `source` (liens physiques, copie à défaut)."""
+    chemins = [department_path(dept_code, source), aggregates_path(dept_code, source),
+               routage_path(dept_code, source)]
+    dept_folder = os.path.join(source, dept_code)
+    if os.path.isdir(dept_folder):
+        chemins += [os.path.join(dept_folder, nom) for nom in os.listdir(dept_folder) if nom.endswith(".parquet")]
+    for chemin in chemins:
+        if not os.path.exists(chemin):
+            continue
+        destination = os.path.join(cible, os.path.relpath(chemin, source))
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        try:
+            os.link(chemin, destination)
+        except OSError:
+            shutil.copy2(chemin, destination)
+
+
+def _departements_stockes(dossier):
+    if not os.path.isdir(dossier):
+        return set()
+    return {nom[:-len(".parquet")] for nom in os.listdir(dossier)
+            if nom.endswith(".parquet") and SOURCE_PATTERN.match(nom[:-len(".parquet")] + ".csv")}
+
+
+def construire_routage(dossier):
+    """Index de routage global de la version `dossier` : réunion des index départementaux."""
+    routage_folder = os.path.join(dossier, "routage")
+    tables = [pd.read_parquet(os.path.join(routage_folder, nom)) for nom in sorted(os.listdir(routage_folder))
+              if nom.endswith(".parquet")] if os.path.isdir(routage_folder) else []
+    if tables:
+        _write_parquet(pd.concat(tables, ignore_index=True), routage_path(store_folder=dossier))
+
+
+def publier_manifeste(manifeste, store_folder=DVF_STORE_FOLDER):
+    """Remplace atomiquement le manifeste : la nouvelle version devient celle de tous les processus."""
+    fd, tmp_path = tempfile.mkstemp(prefix=".manifest-", dir=store_folder)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifeste, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(store_folder, MANIFESTE))
+
+
+def purger_versions(store_folder=DVF_STORE_FOLDER, conserver=DVF_STORE_VERSIONS):
+    """Supprime les versions les plus anciennes au-delà des `conserver` dernières (la publiée incluse)."""
+    manifeste = lire_manifeste(store_folder)
+    versions_folder = os.path.join(store_folder, "versions")
+    if manifeste is None or not os.path.isdir(versions_folder):
+        return
+    versions = sorted(os.listdir(versions_folder), reverse=True)
+    for version in [v for v in versions if v != manifeste["version"]][max(0, conserver - 1):]:
+        shutil.rmtree(os.path.join(versions_folder, version), ignore_errors=True)
+        logging.info(f"🧹 Version DVF {version} supprimée.")
+
+
+def ingest_all(departements=None, folder=DVF_FOLDER, store_folder=DVF_STORE_FOLDER, force=False):
+    """
+    Ingère les sources nouvelles ou modifiées et publie une nouvelle version si besoin.
+    Renvoie le manifeste publié (ou le manifeste courant si rien n'a changé).
+    """
+    os.makedirs(store_folder, exist_ok=True)
+    precedent = lire_manifeste(store_folder) or {"version": None, "sources": {}}
+    precedent_folder = dossier_donnees(store_folder)
+    sources, ignores = inventaire_sources(folder)
+    for ignore in ignores:
+        logging.warning(f"⚠️ Source DVF ignorée : {ignore['fichier']} ({ignore['raison']}).")
+    if departements:
+        sources = {d: p for d, p in sources.items() if d in departements}
+
+    a_ingerer = {}
+    entrees = dict(precedent["sources"])
+    for dept_code, source_path in sources.items():
+        entree = entrees.get(dept_code)
+        stat = os.stat(source_path)
+        if not force and entree and entree["fichier"] == os.path.basename(source_path) \
+                and entree["taille"] == stat.st_size and entree["mtime"] == stat.st_mtime:
+            continue
+        empreinte = empreinte_fichier(source_path)
+        if not force and entree and entree["sha256"] == empreinte:
+            entrees[dept_code] = {**entree, "fichier": os.path.basename(source_path), "mtime": stat.st_mtime}
+            continue
+        a_ingerer[dept_code] = (source_path, empreinte)
+
+    if not a_ingerer:
+        logging.info("✅ Entrepôt DVF à jour : aucune source nouvelle ou modifiée.")
+        if entrees != precedent["sources"] or ignores != precedent.get("ignores"):
+            publier_manifeste({**precedent, "sources": entrees, "ignores": ignores}, store_folder)
+        return lire_manifeste(store_folder)
+
+    version = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    dossier = os.path.join(store_folder, "versions", version)
+    os.makedirs(dossier)
+    for dept_code in _departements_stockes(precedent_folder) - set(a_ingerer):
+        _lier_departement(dept_code, precedent_folder, dossier)
+    for dept_code, (source_path, empreinte) in sorted(a_ingerer.items()):
+        try:
+            entrees[dept_code] = {**ingest_department(dept_code, source_path, dossier, precedent_folder),
+                                  "sha256": empreinte}
+        except Exception as e:
+            logging.error(f"❌ Erreur d'ingestion pour {source_path}: {str(e)}")
+            # Le département garde ses données précédentes
+            _lier_departement(dept_code, precedent_folder, dossier)
+
+    construire_routage(dossier)
+    manifeste = {"version": version, "publie": datetime.now().isoformat(timespec="seconds"),
+                 "precedente": precedent["version"], "sources": entrees, "ignores": ignores}
+    publier_manifeste(manifeste, store_folder)
+    logging.info(f"📦 Version DVF {version} publiée ({len(a_ingerer)} département(s) ingéré(s)).")
+    purger_versions(store_folder)
+    return manifeste
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Entrepôt DVF colonnaire")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest = sub.add_parser("ingest", help="Convertit dvf_data/ en partitions Parquet")
+    ingest.add_argument("departements", nargs="*", help="Codes département (par défaut : tous)")
+    ingest.add_argument("--force", action="store_true", help="Relit les sources même inchangées")
+    sub.add_parser("statut", help="Version publiée et sources ingérées")
+    args = parser.parse_args()
+    if args.command == "ingest":
+        ingest_all(args.departements or None, force=args.force)
+    elif args.command == "statut":
+        manifeste = lire_manifeste()
+        if manifeste is None:
+            print("Aucune version publiée.")
+        else:
+            print(f"Version {manifeste['version']} (publiée le {manifeste.get('publie')})")
+            for dept_code, entree in sorted(manifeste["sources"].items()):
+                print(f"{dept_code:>4} | {entree['fichier']:<14} | {entree['lignes']:>9} lignes "
+                      f"| {entree['date_min']} → {entree['date_max']} | {entree['sha256'][:12]}")
+            for ignore in manifeste.get("ignores", []):
+                print(f"   - {ignore['fichier']} ignoré : {ignore['raison']}")
@@ -0,0 +1,417 @@
+"""
+Génération asynchrone des rapports : file d'attente bornée, pool de threads de taille fixe
+et état des jobs dans une base SQLite partagée par tous les workers gunicorn.
+
+- un `/progress` ou `/download_estimation` peut atterrir sur n'importe quel worker
+- file pleine : `soumettre` lève FilePleine, l'API répond 429 avec Retry-After
+- les jobs plus anciens que la durée de rétention sont purgés (les fichiers produits
+  vivent dans le stockage des rapports, qui a sa propre rétention : voir report_store.py)
+- `suivre` produit les changements d'étape d'un job (flux SSE /progress/stream)
+- un job peut porter une clé de rapport (empreinte du formulaire) : une demande identique
+  se rattache au job en cours ou à un rapport terminé récemment au lieu d'en créer un
+- battement : les jobs en file ou en cours voient leur `maj` rafraîchie régulièrement ; un
+  job sans battement (worker tué ou redémarré) est déclaré en erreur et ne capte plus
+  les demandes identiques
+- service ASGI (mon_projet/app.py) : AsyncJobScheduler exécute les jobs comme tâches de la
+  boucle asyncio, sans thread bloqué par job, avec le même JobStore
+"""
+import asyncio
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from base_sqlite import connexion, initialiser
+from metrics import registre, trace_courante, tracer
+
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "./pdf_reports/jobs.sqlite3")
+JOBS_MAX_WORKERS = int(os.environ.get("JOBS_MAX_WORKERS", "2"))
+JOBS_MAX_QUEUE = int(os.environ.get("JOBS_MAX_QUEUE", "20"))
+# Service ASGI : jobs en vol simultanément par processus (au-delà, FilePleine)
+JOBS_MAX_EN_VOL = int(os.environ.get("JOBS_MAX_EN_VOL", "500"))
+JOBS_RETENTION = float(os.environ.get("JOBS_RETENTION_H", "24")) * 3600
+# Durée pendant laquelle un rapport terminé est resservi à une demande identique
+JOBS_DEDUP_FRAICHEUR = float(os.environ.get("JOBS_DEDUP_FRAICHEUR_MIN", "60")) * 60
+JOBS_BATTEMENT = float(os.environ.get("JOBS_BATTEMENT_S", "15"))
+# Job en file ou en cours sans battement depuis ce délai : son worker a disparu
+JOBS_ORPHELIN = float(os.environ.get("JOBS_ORPHELIN_S", "120"))
+# Attente maximale d'un job par une requête synchrone
+JOBS_ATTENTE_MAX = float(os.environ.get("JOBS_ATTENTE_MAX_S", "600"))
+
+duree_jobs = registre.histogramme("jobs_duree_secondes", "Durée d'exécution des jobs par issue", ["statut"])
+
+EN_ATTENTE = "en_attente"
+EN_COURS = "en_cours"
+TERMINE = "termine"
+ERREUR = "erreur"
+
+ERREUR_ORPHELIN = "Job interrompu : le worker qui l'exécutait s'est arrêté"
+
+
+class FilePleine(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"File de génération pleine, réessayer dans {retry_after}s")
+        self.retry_after = retry_after
+
+
+def etat_job(job):
+    return job["statut"], job["etape"], job["progression"]
+
+
+class JobStore:
+    def __init__(self, path=JOBS_DB_PATH):
+        self.path = path
+        # Réveille les flux de ce processus à chaque mise à jour ; ceux qui suivent
+        # un job d'un autre worker relisent la base à intervalle court
+        self._changement = threading.Condition()
+        initialiser(path, self._schema)
+
+    @staticmethod
+    def _schema(conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY, statut TEXT NOT NULL, progression INTEGER NOT NULL,"
+            " chemin TEXT, erreur TEXT, cree REAL NOT NULL, maj REAL NOT NULL, etape TEXT,"
+            " empreinte TEXT, nom_fichier TEXT, cle TEXT, etapes TEXT)"
+        )
+        # Bases créées par une version précédente
+        colonnes = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        for colonne in ("etape", "empreinte", "nom_fichier", "cle", "etapes"):
+            if colonne not in colonnes:
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {colonne} TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_cle ON jobs (cle, cree)")
+
+    def _connexion(self):
+        return connexion(self.path, sqlite3.Row)
+
+    def creer(self, job_id, cle=None, force=False, fraicheur=JOBS_DEDUP_FRAICHEUR):
+        """
+        Enregistre un nouveau job, sauf si un job vivant de même `cle` est en cours ou a produit
+        un rapport encore disponible depuis moins de `fraicheur` secondes (et que `force`
+        est faux). Renvoie (job_id à suivre, True si le job vient d'être créé).
+        """
+        now = time.time()
+        with self._connexion() as conn:
+            # Verrou d'écriture dès la lecture : deux workers ne peuvent pas créer le même job
+            conn.execute("BEGIN IMMEDIATE")
+            if cle is not None and not force:
+                for job in conn.execute("SELECT * FROM jobs WHERE cle = ? ORDER BY cree DESC", (cle,)).fetchall():
+                    if job["statut"] in (EN_ATTENTE, EN_COURS):
+                        if job["maj"] >= now - JOBS_ORPHELIN:
+                            return job["job_id"], False
+                        self._declarer_orphelin(conn, job["job_id"], now)
+                        continue
+                    if (job["statut"] == TERMINE and job["maj"] >= now - fraicheur
+                            and job["chemin"] and os.path.exists(job["chemin"])):
+                        return job["job_id"], False
+            conn.execute("INSERT INTO jobs (job_id, statut, progression, cree, maj, etape, cle) VALUES (?, ?, 0, ?, ?, ?, ?)",
+                         (job_id, EN_ATTENTE, now, now, EN_ATTENTE, cle))
+        return job_id, True
+
+    def mettre_a_jour(self, job_id, **champs):
+        """
+        Met à jour les champs du job. Depuis le thread qui exécute le job, la répartition
+        par étape de sa trace (voir metrics.py) est enregistrée au passage.
+        """
+        champs["maj"] = time.time()
+        trace = trace_courante.get()
+        if trace is not None and "etapes" not in champs:
+            champs["etapes"] = trace.json()
+        colonnes = ", ".join(f"{nom} = ?" for nom in champs)
+        with self._connexion() as conn:
+            conn.execute(f"UPDATE jobs SET {colonnes} WHERE job_id = ?", (*champs.values(), job_id))
+        with self._changement:
+            self._changement.notify_all()
+
+    @staticmethod
+    def _declarer_orphelin(conn, job_id, now):
+        """Passe en erreur un job en file ou en cours resté sans battement (conditionnel : pas de course)."""
+        if conn.execute("UPDATE jobs SET statut = ?, etape = ?, progression = -1, erreur = ?, maj = ?"
+                        " WHERE job_id = ? AND statut IN (?, ?) AND maj < ?",
+                        (ERREUR, ERREUR, ERREUR_ORPHELIN, now, job_id, EN_ATTENTE, EN_COURS,
+                         now - JOBS_ORPHELIN)).rowcount:
+            logging.warning(f"💀 Job {job_id} sans battement depuis {JOBS_ORPHELIN:.0f}s : déclaré en erreur.")
+
+    def battre(self, job_ids):
+        """Battement des jobs de ce processus encore en file ou en cours (rafraîchit `maj`)."""
+        if not job_ids:
+            return
+        job_ids = list(job_ids)
+        with self._connexion() as conn:
+            conn.execute(f"UPDATE jobs SET maj = ? WHERE statut IN (?, ?) AND job_id IN ({', '.join('?' * len(job_ids))})",
+                         (time.time(), EN_ATTENTE, EN_COURS, *job_ids))
+
+    def verifier(self, job):
+        """État du job, passé en erreur s'il est en file ou en cours sans battement récent."""
+        now = time.time()
+        if job["statut"] not in (EN_ATTENTE, EN_COURS) or job["maj"] >= now - JOBS_ORPHELIN:
+            return job
+        with self._connexion() as conn:
+            self._declarer_orphelin(conn, job["job_id"], now)
+        return self.lire(job["job_id"])
+
+    def avancer(self, job_id, etape, pourcentage):
+        """Rappel de progression des pipelines : `partial(store.avancer, job_id)`."""
+        logging.info(f"⏱️ Job {job_id} : {etape} ({pourcentage} %)")
+        self.mettre_a_jour(job_id, etape=etape, progression=pourcentage)
+
+    def suivre(self, job_id, intervalle=0.5):
+        """
+        Générateur des états successifs du job, jusqu'à son terme (ou sa disparition).
+        Produit None quand rien n'a changé pendant `intervalle` secondes. Un job sans
+        battement est déclaré en erreur, ce qui termine le suivi.
+        """
+        dernier_etat = None
+        while True:
+            job = self.lire(job_id)
+            if job is None:
+                return
+            job = self.verifier(job)
+            # Le battement change `maj` sans changer l'état : pas d'événement pour lui
+            if etat_job(job) != dernier_etat:
+                dernier_etat = etat_job(job)
+                yield job
+            else:
+                yield None
+            if job["statut"] in (TERMINE, ERREUR):
+                return
+            with self._changement:
+                self._changement.wait(intervalle)
+
+    def supprimer(self, job_id):
+        with self._connexion() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def lire(self, job_id):
+        """État du job (dict) ou None s'il est inconnu ou déjà purgé ; `etapes` est décodé."""
+        with self._connexion() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["etapes"] = json.loads(job["etapes"]) if job["etapes"] else None
+        return job
+
+    def purger(self, retention=JOBS_RETENTION):
+        """Supprime les jobs sans activité depuis `retention` secondes."""
+        limite = time.time() - retention
+        with self._connexion() as conn:
+            supprimes = conn.execute("DELETE FROM jobs WHERE maj < ?", (limite,)).rowcount
+        if supprimes:
+            logging.info(f"🧹 {supprimes} job(s) expiré(s) purgé(s).")
+        return supprimes
+
+
+class JobScheduler:
+    """Pool de `max_workers` threads alimenté par une file de `max_queue` jobs (par processus)."""
+
+    def __init__(self, store, max_workers=JOBS_MAX_WORKERS, max_queue=JOBS_MAX_QUEUE):
+        self.store = store
+        self.max_workers = max_workers
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._threads = []
+        self._duree_moyenne = 30.0  # secondes, affinée au fil des jobs
+        self._actifs = 0
+        self._vivants = set()  # jobs de ce processus en file ou en cours
+
+    def _demarrer(self):
+        # Démarrage paresseux : les threads naissent dans le worker gunicorn, après le fork
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.max_workers):
+                thread = threading.Thread(target=self._boucle, name=f"job-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(target=self._battement, name="job-battement", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _battement(self):
+        while True:
+            time.sleep(JOBS_BATTEMENT)
+            with self._lock:
+                vivants = set(self._vivants)
+            try:
+                self.store.battre(vivants)
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ Battement des jobs impossible : {e}")
+
+    def retry_after(self):
+        """Délai estimé (s) avant qu'une place se libère dans la file."""
+        attente = (self._queue.qsize() + 1) * self._duree_moyenne / self.max_workers
+        return max(1, round(attente))
+
+    def soumettre(self, job_id, fonction, *args, cle=None, force=False):
+        """
+        Met `fonction(job_id, *args)` en file. Avec une `cle`, une demande identique se
+        rattache au job existant (voir JobStore.creer) : renvoie (job_id à suivre, nouveau).
+        """
+        self._demarrer()
+        self.store.purger()
+        job_id, nouveau = self.store.creer(job_id, cle, force)
+        if not nouveau:
+            return job_id, False
+        # Inscrit avant la mise en file, sous le verrou : un thread qui prend le job aussitôt
+        # ne peut pas le retirer de _vivants avant qu'il y soit entré
+        with self._lock:
+            self._vivants.add(job_id)
+            try:
+                self._queue.put_nowait((job_id, fonction, args))
+            except queue.Full:
+                self._vivants.discard(job_id)
+                plein = True
+            else:
+                plein = False
+        if plein:
+            self.store.supprimer(job_id)
+            raise FilePleine(self.retry_after())
+        return job_id, True
+
+    def executer(self, job_id, fonction, *args):
+        """
+        Exécute le job dans le thread appelant (thread du pool ou requête synchrone) et enregistre
+        son issue. Le job tourne dans une trace : sa répartition par étape suit ses mises à jour.
+        """
+        self._demarrer()
+        start = time.time()
+        statut = TERMINE
+        with self._lock:
+            self._actifs += 1
+            self._vivants.add(job_id)
+        try:
+            with tracer():
+                try:
+                    self.store.mettre_a_jour(job_id, statut=EN_COURS, etape=EN_COURS)
+                    fonction(job_id, *args)
+                except Exception as e:
+                    statut = ERREUR
+                    logging.error(f"Erreur dans le job {job_id}: {str(e)}")
+                    self.store.mettre_a_jour(job_id, statut=ERREUR, etape=ERREUR, progression=-1, erreur=str(e))
+        finally:
+            with self._lock:
+                self._actifs -= 1
+                self._vivants.discard(job_id)
+            duree = time.time() - start
+            duree_jobs.observer(duree, statut=statut)
+            self._duree_moyenne = 0.8 * self._duree_moyenne + 0.2 * duree
+
+    def stats(self):
+        return {"file": self._queue.qsize(), "actifs": self._actifs, "duree_moyenne": self._duree_moyenne}
+
+    def _boucle(self):
+        while True:
+            job_id, fonction, args = self._queue.get()
+            try:
+                self.executer(job_id, fonction, *args)
+            finally:
+                self._queue.task_done()
+
+
+class AsyncJobScheduler:
+    """
+    Équivalent asyncio de JobScheduler : chaque job est une tâche de la boucle du service
+    (coroutine `fonction(job_id, *args)`), `max_en_vol` au plus par processus, sans file.
+    Les accès à la base passent par des threads pour ne pas bloquer la boucle.
+    """
+
+    def __init__(self, store, max_en_vol=JOBS_MAX_EN_VOL):
+        self.store = store
+        self.max_en_vol = max_en_vol
+        self._taches = {}  # job_id -> tâche asyncio
+        self._duree_moyenne = 30.0
+        self._battement = None
+
+    def retry_after(self):
+        """Délai estimé (s) avant qu'un des jobs en vol se termine."""
+        return max(1, round(self._duree_moyenne / self.max_en_vol))
+
+    async def soumettre(self, job_id, fonction, *args, cle=None, force=False):
+        """Comme JobScheduler.soumettre : (job_id à suivre, nouveau) ; FilePleine si `max_en_vol` est atteint."""
+        await asyncio.to_thread(self.store.purger)
+        job_id, nouveau = await asyncio.to_thread(self.store.creer, job_id, cle, force)
+        if not nouveau:
+            return job_id, False
+        if len(self._taches) >= self.max_en_vol:
+            await asyncio.to_thread(self.store.supprimer, job_id)
+            raise FilePleine(self.retry_after())
+        self.lancer(job_id, fonction, *args)
+        return job_id, True
+
+    def lancer(self, job_id, fonction, *args):
+        """Démarre le job (déjà créé dans le store) sans limite : chemin synchrone /generate_estimation."""
+        if self._battement is None or self._battement.done():
+            self._battement = asyncio.create_task(self._battre())
+        tache = asyncio.create_task(self.executer(job_id, fonction, *args))
+        self._taches[job_id] = tache
+        tache.add_done_callback(lambda _: self._taches.pop(job_id, None))
+        return tache
+
+    async def _battre(self):
+        while self._taches:
+            await asyncio.sleep(JOBS_BATTEMENT)
+            try:
+                await asyncio.to_thread(self.store.battre, set(self._taches))
+            except sqlite3.Error as e:
+                logging.warning(f"⚠️ Battement des jobs impossible : {e}")
+
+    async def executer(self, job_id, fonction, *args):
+        """Comme JobScheduler.executer : le job tourne dans une trace, son issue est enregistrée."""
+        start = time.time()
+        statut = TERMINE
+        try:
+            with tracer():
+                try:
+                    await asyncio.to_thread(self.store.mettre_a_jour, job_id, statut=EN_COURS, etape=EN_COURS)
+                    await fonction(job_id, *args)
+                except Exception as e:
+                    statut = ERREUR
+                    logging.error(f"Erreur dans le job {job_id}: {str(e)}")
+                    await asyncio.to_thread(self.store.mettre_a_jour, job_id, statut=ERREUR, etape=ERREUR,
+                                            progression=-1, erreur=str(e))
+        finally:
+            duree = time.time() - start
+            duree_jobs.observer(duree, statut=statut)
+            self._duree_moyenne = 0.8 * self._duree_moyenne + 0.2 * duree
+
+    async def suivre(self, job_id, intervalle=0.5):
+        """Version asynchrone de JobStore.suivre (relecture de la base toutes les `intervalle` secondes)."""
+        dernier_etat = None
+        while True:
+            job = await asyncio.to_thread(self.store.lire, job_id)
+            if job is None:
+                return
+            job = await asyncio.to_thread(self.store.verifier, job)
+            if etat_job(job) != dernier_etat:
+                dernier_etat = etat_job(job)
+                yield job
+            else:
+                yield None
+            if job["statut"] in (TERMINE, ERREUR):
+                return
+            await asyncio.sleep(intervalle)
+
+    async def attendre(self, job_id, timeout=JOBS_ATTENTE_MAX):
+        """
+        État final du job (None s'il a disparu) : sa tâche s'il tourne ici, la base sinon.
+        TimeoutError au-delà de `timeout` secondes (le job, lui, continue).
+        """
+        async def terme():
+            tache = self._taches.get(job_id)
+            if tache is not None:
+                await asyncio.shield(tache)
+            async for _ in self.suivre(job_id):
+                pass
+
+        try:
+            await asyncio.wait_for(terme(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Job {job_id} toujours en cours après {timeout:.0f}s")
+        return await asyncio.to_thread(self.store.lire, job_id)
+
+    def stats(self):
+        return {"file": 0, "actifs": len(self._taches), "duree_moyenne": self._duree_moyenne}
@@ -0,0 +1,129 @@
+"""
+Cache disque (SQLite) des réponses OpenAI, partagé par tous les workers.
+
+- clé : modèle + prompt système + prompt utilisateur normalisé + paramètres
+- expiration (TTL) et budget en octets, les entrées les moins récemment lues partent d'abord
+- le client n'est désigné que par des marqueurs ([CLIENT]...) : ni le prompt envoyé à
+  OpenAI ni la réponse stockée ne contiennent son nom, réinjecté localement après lecture,
+  si bien qu'un même texte sert à tous les clients. Une réponse qui contient malgré tout un
+  mot du prénom ou du nom du client n'est pas stockée
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from base_sqlite import connexion, initialiser
+
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "./llm_cache.sqlite3")
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL_H", "168")) * 3600
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_MB", "64")) * 1024 * 1024
+# Version du format des réponses stockées : la changer invalide les entrées existantes
+# (3 : prompts envoyés avec leurs marqueurs, réponses contenant le nom du client exclues)
+FORMAT_REPONSES = 3
+MARQUEURS_IDENTITE = ("[PRENOM]", "[NOM]")
+
+
+def normaliser_prompt(prompt):
+    """Espaces et formes Unicode uniformisés : deux prompts qui ne diffèrent que par là partagent leur entrée."""
+    prompt = unicodedata.normalize("NFC", prompt)
+    return "\n".join(" ".join(ligne.split()) for ligne in prompt.strip().splitlines())
+
+
+def cle_reponse(model, system, prompt, **params):
+    payload = json.dumps([FORMAT_REPONSES, model, system, normaliser_prompt(prompt), params], sort_keys=True,
+                         ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def contient_identite(texte, personnalisation):
+    """Vrai si `texte` contient un mot (au moins 2 lettres) du prénom ou du nom du client."""
+    mots = {mot for marqueur in MARQUEURS_IDENTITE for mot in re.findall(r"\w{2,}", personnalisation.get(marqueur) or "")}
+    return any(re.search(rf"(?<!\w){re.escape(mot)}(?!\w)", texte, re.IGNORECASE) for mot in mots)
+
+
+def personnaliser(texte, personnalisation):
+    for marqueur, valeur in personnalisation.items():
+        texte = texte.replace(marqueur, valeur.strip())
+    return texte
+
+
+class ReponseCache:
+    def __init__(self, path=LLM_CACHE_PATH, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        initialiser(path, self._schema)
+
+    @staticmethod
+    def _schema(conn):
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS reponses ("
+            " cle TEXT PRIMARY KEY, contenu TEXT NOT NULL,"
+            " cree REAL NOT NULL, utilise REAL NOT NULL, taille INTEGER NOT NULL)"
+        )
+
+    def _connexion(self):
+        return connexion(self.path)
+
+    def get(self, cle):
+        """Renvoie le texte stocké sous `cle`, ou None s'il est absent ou expiré."""
+        now = time.time()
+        with self._connexion() as conn:
+            row = conn.execute("SELECT contenu FROM reponses WHERE cle = ? AND cree >= ?",
+                               (cle, now - self.ttl)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE reponses SET utilise = ? WHERE cle = ?", (now, cle))
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if row is None else row[0]
+
+    def set(self, cle, contenu):
+        now = time.time()
+        taille = len(contenu.encode("utf-8"))
+        with self._connexion() as conn:
+            conn.execute("INSERT OR REPLACE INTO reponses VALUES (?, ?, ?, ?, ?)",
+                         (cle, contenu, now, now, taille))
+            expirees = conn.execute("DELETE FROM reponses WHERE cree < ?", (now - self.ttl,)).rowcount
+            # Au-delà du budget, on garde les entrées lues le plus récemment
+            evincees = conn.execute(
+                "DELETE FROM reponses WHERE cle IN ("
+                " SELECT cle FROM (SELECT cle, SUM(taille) OVER (ORDER BY utilise DESC) AS cumul FROM reponses)"
+                " WHERE cumul > ?)", (self.max_bytes,)
+            ).rowcount
+        if expirees or evincees:
+            logging.info(f"🧹 Cache LLM : {expirees} entrée(s) expirée(s), {evincees} évincée(s).")
+        with self._lock:
+            self.evictions += expirees + evincees
+
+    def clear(self):
+        with self._connexion() as conn:
+            conn.execute("DELETE FROM reponses")
+
+    def stats(self):
+        with self._connexion() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(taille), 0) FROM reponses").fetchone()
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Instance unique du processus ; la base est partagée entre workers
+llm_cache = ReponseCache()
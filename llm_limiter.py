@@ -0,0 +1,173 @@
+"""
+Limiteur adaptatif des appels OpenAI (à utiliser depuis la boucle LLM, voir app.boucle_llm).
+
+- budgets requêtes/minute et tokens/minute (seaux à jetons) : on attend au lieu d'échouer
+- 429, 5xx et erreurs réseau : nouvel essai après un délai exponentiel avec gigue
+  (ou le Retry-After renvoyé par l'API)
+- le nombre d'appels simultanés s'ajuste (AIMD) : +1/limite par succès rapide,
+  réduit quand la latence dérive, divisé par deux sur limite de débit
+- la dérive de latence se mesure par taille d'appel (tranches de `max_tokens`) : une
+  estimation de 600 tokens n'est pas comparée à une recommandation d'une phrase
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+
+import openai
+
+OPENAI_RPM = float(os.environ.get("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.environ.get("OPENAI_TPM", "10000"))
+OPENAI_MAX_CONCURRENCE = int(os.environ.get("OPENAI_MAX_CONCURRENCE", "16"))
+OPENAI_MAX_TENTATIVES = int(os.environ.get("OPENAI_MAX_TENTATIVES", "6"))
+
+DELAI_BASE = 1.0   # secondes, premier délai avant un nouvel essai
+DELAI_MAX = 60.0
+
+
+def estimer_tokens(messages, max_tokens):
+    """Coût d'un appel pour le budget TPM : ~4 caractères par token + la réponse maximale."""
+    return sum(len(message["content"]) for message in messages) // 4 + max_tokens
+
+
+class SeauAJetons:
+    def __init__(self, par_minute):
+        self.capacite = par_minute
+        self.debit = par_minute / 60.0
+        self.jetons = par_minute
+        self.dernier = time.monotonic()
+
+    def _remplir(self):
+        now = time.monotonic()
+        self.jetons = min(self.capacite, self.jetons + (now - self.dernier) * self.debit)
+        self.dernier = now
+
+    def attente(self, quantite):
+        """Secondes à attendre avant de pouvoir consommer `quantite` (0 si disponible)."""
+        self._remplir()
+        quantite = min(quantite, self.capacite)
+        return max(0.0, (quantite - self.jetons) / self.debit)
+
+    def consommer(self, quantite):
+        self._remplir()
+        self.jetons -= quantite
+
+    def rendre(self, quantite):
+        self.jetons = min(self.capacite, self.jetons + quantite)
+
+
+class LimiteurOpenAI:
+    def __init__(self, rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_concurrence=OPENAI_MAX_CONCURRENCE,
+                 max_tentatives=OPENAI_MAX_TENTATIVES):
+        self.requetes = SeauAJetons(rpm)
+        self.tokens = SeauAJetons(tpm)
+        self.max_concurrence = max_concurrence
+        self.max_tentatives = max_tentatives
+        self.limite = min(4.0, max_concurrence)
+        self.en_vol = 0
+        self._condition = asyncio.Condition()
+        self._budget = asyncio.Lock()
+        self._latences = {}  # tranche de max_tokens -> [latence minimale, moyenne glissante]
+        self._latence_moyenne = None
+        self.succes = 0
+        self.nouveaux_essais = 0
+        self.echecs = 0
+
+    async def _reserver(self, tokens):
+        # Un seul appel attend les budgets à la fois : l'ordre d'arrivée est respecté
+        async with self._budget:
+            while True:
+                attente = max(self.requetes.attente(1), self.tokens.attente(tokens))
+                if attente <= 0:
+                    break
+                await asyncio.sleep(attente)
+            self.requetes.consommer(1)
+            self.tokens.consommer(tokens)
+
+    async def _entrer(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.en_vol < int(self.limite))
+            self.en_vol += 1
+
+    async def _sortir(self):
+        async with self._condition:
+            self.en_vol -= 1
+            self._condition.notify_all()
+
+    def _observer_succes(self, latence, max_tokens):
+        self.succes += 1
+        self._latence_moyenne = latence if self._latence_moyenne is None else 0.8 * self._latence_moyenne + 0.2 * latence
+        # Tranches en puissances de 2 : 300 et 400 tokens ensemble, 50 et 600 séparés
+        tranche = self._latences.setdefault(max(1, max_tokens).bit_length(), [latence, latence])
+        tranche[0] = min(tranche[0], latence)
+        tranche[1] = 0.8 * tranche[1] + 0.2 * latence
+        if tranche[1] > 2 * tranche[0]:
+            # L'API sature avant de refuser : on réduit doucement
+            self.limite = max(1.0, self.limite * 0.9)
+        else:
+            self.limite = min(float(self.max_concurrence), self.limite + 1 / self.limite)
+
+    def _observer_erreur(self, limite_de_debit):
+        if limite_de_debit:
+            self.limite = max(1.0, self.limite / 2)
+            # Le seau se croyait plein : on le vide pour s'aligner sur l'API
+            self.requetes.jetons = min(self.requetes.jetons, 0)
+        else:
+            self.limite = max(1.0, self.limite * 0.75)
+
+    def _delai(self, tentative, erreur):
+        retry_after = None
+        response = getattr(erreur, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        plafond = min(DELAI_MAX, DELAI_BASE * 2 ** tentative)
+        delai = random.uniform(0, plafond)  # gigue complète
+        return max(delai, retry_after) if retry_after is not None else delai
+
+    async def appeler(self, creer, messages, max_tokens):
+        """
+        Exécute `await creer()` (un appel chat.completions) dans les budgets RPM/TPM.
+        Les erreurs transitoires sont retentées ; la dernière est relevée après
+        `max_tentatives` essais.
+        """
+        tokens = estimer_tokens(messages, max_tokens)
+        for tentative in range(self.max_tentatives):
+            await self._reserver(tokens)
+            await self._entrer()
+            start = time.monotonic()
+            try:
+                response = await creer()
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+                limite_de_debit = isinstance(e, openai.RateLimitError)
+                self._observer_erreur(limite_de_debit)
+                if tentative + 1 == self.max_tentatives:
+                    self.echecs += 1
+                    raise
+                self.nouveaux_essais += 1
+                delai = self._delai(tentative, e)
+                logging.warning(f"⏳ OpenAI : {type(e).__name__}, nouvel essai dans {delai:.1f}s "
+                                f"(concurrence {int(self.limite)}).")
+            else:
+                self._observer_succes(time.monotonic() - start, max_tokens)
+                usage = getattr(response, "usage", None)
+                if usage is not None and getattr(usage, "total_tokens", None):
+                    # Rend au budget les tokens réservés mais non consommés
+                    self.tokens.rendre(max(0, tokens - usage.total_tokens))
+                return response
+            finally:
+                await self._sortir()
+            await asyncio.sleep(delai)
+
+    def stats(self):
+        return {
+            "limite": int(self.limite),
+            "en_vol": self.en_vol,
+            "succes": self.succes,
+            "nouveaux_essais": self.nouveaux_essais,
+            "echecs": self.echecs,
+            "latence_moyenne": self._latence_moyenne,
+        }
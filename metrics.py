@@ -0,0 +1,192 @@
+"""
+Mesures du pipeline : spans chronométrés par étape et métriques au format Prometheus
+(exposées par l'endpoint /metrics), sans dépendance externe.
+
+- `span("etape", **attributs)` chronomètre un bloc : la durée alimente l'histogramme
+  `rapport_etape_duree_secondes{etape=...}` et, si une trace est active (un job), la
+  trace du job (voir JobScheduler.executer), qui fournit la répartition par étape
+- la trace courante vit dans un ContextVar : `dans_trace` la transporte jusqu'aux
+  coroutines de la boucle LLM
+- les métriques sont propres au processus (un worker gunicorn avec des threads, voir Procfile)
+"""
+import contextvars
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Spans détaillés conservés par trace (un lot en produit des milliers) ; la répartition par étape les compte tous
+TRACE_MAX_SPANS = 200
+BORNES_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _etiquettes(noms, valeurs):
+    if not noms:
+        return ""
+    return "{" + ",".join(f'{nom}="{str(valeur)}"'.replace("\n", " ") for nom, valeur in zip(noms, valeurs)) + "}"
+
+
+def _nombre(valeur):
+    if valeur == math.inf:
+        return "+Inf"
+    return repr(float(valeur)) if isinstance(valeur, float) else str(valeur)
+
+
+class Compteur:
+    def __init__(self, nom, aide, etiquettes=()):
+        self.nom, self.aide, self.etiquettes = nom, aide, tuple(etiquettes)
+        self._lock = threading.Lock()
+        self._valeurs = {}
+
+    def inc(self, valeur=1, **etiquettes):
+        cle = tuple(etiquettes.get(nom, "") for nom in self.etiquettes)
+        with self._lock:
+            self._valeurs[cle] = self._valeurs.get(cle, 0) + valeur
+
+    def exposer(self):
+        lignes = [f"# HELP {self.nom} {self.aide}", f"# TYPE {self.nom} counter"]
+        with self._lock:
+            for cle, valeur in sorted(self._valeurs.items()):
+                lignes.append(f"{self.nom}{_etiquettes(self.etiquettes, cle)} {_nombre(valeur)}")
+        return lignes
+
+
+class Histogramme:
+    def __init__(self, nom, aide, etiquettes=(), bornes=BORNES_DUREE):
+        self.nom, self.aide, self.etiquettes = nom, aide, tuple(etiquettes)
+        self.bornes = tuple(bornes) + (math.inf,)
+        self._lock = threading.Lock()
+        self._series = {}  # clé -> [compte par borne, somme, total]
+
+    def observer(self, valeur, **etiquettes):
+        cle = tuple(etiquettes.get(nom, "") for nom in self.etiquettes)
+        with self._lock:
+            serie = self._series.setdefault(cle, [[0] * len(self.bornes), 0.0, 0])
+            for i, borne in enumerate(self.bornes):
+                if valeur <= borne:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valeur
+            serie[2] += 1
+
+    def exposer(self):
+        lignes = [f"# HELP {self.nom} {self.aide}", f"# TYPE {self.nom} histogram"]
+        with self._lock:
+            for cle, (comptes, somme, total) in sorted(self._series.items()):
+                cumul = 0
+                for borne, compte in zip(self.bornes, comptes):
+                    cumul += compte
+                    etiquettes = _etiquettes(self.etiquettes + ("le",), cle + (_nombre(borne),))
+                    lignes.append(f"{self.nom}_bucket{etiquettes} {cumul}")
+                lignes.append(f"{self.nom}_sum{_etiquettes(self.etiquettes, cle)} {_nombre(somme)}")
+                lignes.append(f"{self.nom}_count{_etiquettes(self.etiquettes, cle)} {total}")
+        return lignes
+
+
+class Collecteur:
+    """Métrique lue au moment de l'export : `fonction()` renvoie [(valeurs d'étiquettes, valeur)]."""
+
+    def __init__(self, nom, aide, type_, etiquettes, fonction):
+        self.nom, self.aide, self.type, self.etiquettes, self.fonction = nom, aide, type_, tuple(etiquettes), fonction
+
+    def exposer(self):
+        lignes = [f"# HELP {self.nom} {self.aide}", f"# TYPE {self.nom} {self.type}"]
+        for cle, valeur in self.fonction():
+            lignes.append(f"{self.nom}{_etiquettes(self.etiquettes, cle)} {_nombre(valeur)}")
+        return lignes
+
+
+class Registre:
+    def __init__(self):
+        self._metriques = []
+
+    def compteur(self, nom, aide, etiquettes=()):
+        return self._ajouter(Compteur(nom, aide, etiquettes))
+
+    def histogramme(self, nom, aide, etiquettes=(), bornes=BORNES_DUREE):
+        return self._ajouter(Histogramme(nom, aide, etiquettes, bornes))
+
+    def collecteur(self, nom, aide, type_, etiquettes, fonction):
+        return self._ajouter(Collecteur(nom, aide, type_, etiquettes, fonction))
+
+    def _ajouter(self, metrique):
+        self._metriques.append(metrique)
+        return metrique
+
+    def exposer(self):
+        """Texte au format d'exposition Prometheus (version 0.0.4)."""
+        lignes = []
+        for metrique in self._metriques:
+            lignes.extend(metrique.exposer())
+        return "\n".join(lignes) + "\n"
+
+
+registre = Registre()
+duree_etapes = registre.histogramme("rapport_etape_duree_secondes", "Durée des étapes du pipeline de rapport",
+                                    ["etape"])
+
+
+class Trace:
+    """Spans d'un job : début relatif au lancement du job, durée et attributs (tokens...)."""
+
+    def __init__(self):
+        self.debut = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def ajouter(self, etape, debut, duree, attributs):
+        with self._lock:
+            self.spans.append({"etape": etape, "debut": round(debut - self.debut, 3),
+                               "duree": round(duree, 3), **attributs})
+
+    def resume(self):
+        """Répartition par étape (durée cumulée, nombre de spans) et détail des spans."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["debut"])
+        etapes = {}
+        for span in spans:
+            etape = etapes.setdefault(span["etape"], {"duree": 0.0, "nombre": 0})
+            etape["duree"] = round(etape["duree"] + span["duree"], 3)
+            etape["nombre"] += 1
+        return {"total": round(time.perf_counter() - self.debut, 3), "etapes": etapes, "spans": spans[:TRACE_MAX_SPANS]}
+
+    def json(self):
+        return json.dumps(self.resume(), ensure_ascii=False)
+
+
+trace_courante = contextvars.ContextVar("trace_courante", default=None)
+
+
+@contextmanager
+def tracer():
+    """Ouvre une trace pour le bloc (un job) : les spans qui s'y exécutent y sont enregistrés."""
+    trace = Trace()
+    jeton = trace_courante.set(trace)
+    try:
+        yield trace
+    finally:
+        trace_courante.reset(jeton)
+
+
+@contextmanager
+def span(etape, **attributs):
+    """
+    Chronomètre le bloc. Le dictionnaire produit peut être complété pendant le bloc
+    (tokens consommés, réponse servie par le cache...) : il est joint au span de la trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield attributs
+    finally:
+        duree = time.perf_counter() - start
+        duree_etapes.observer(duree, etape=etape)
+        trace = trace_courante.get()
+        if trace is not None:
+            trace.ajouter(etape, start, duree, attributs)
+
+
+async def dans_trace(coroutine, trace):
+    """Exécute `coroutine` (sur une autre boucle ou un autre thread) dans la trace `trace`."""
+    trace_courante.set(trace)
+    return await coroutine
@@ -1,7 +1,60 @@
-from fastapi import FastAPI
+"""
+Service ASGI (FastAPI) : mêmes contrats que l'application Flask pour /start_estimation,
+/progress, /progress/stream, /download_estimation et /generate_estimation.
+
+- un rapport est une tâche asyncio (AsyncJobScheduler, jobs.py) et non un thread bloqué :
+  les appels OpenAI sont attendus sur la boucle du service (limiteur partagé)
+- le travail CPU (comparables DVF, graphique, rendu PDF) part dans un pool de processus
+- les rapports sont servis par morceaux depuis le stockage (FileResponse : Range, ETag)
+- état des jobs dans le même JobStore SQLite : un job peut être suivi depuis Flask ou ASGI
+
+Lancement (depuis la racine du dépôt, un seul worker suffit) : uvicorn asgi:app
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
-app = FastAPI()
+from app import (REPORT_MAX_AGE, SSE_BATTEMENT, analyse_dvf, cle_formulaire, evenement_progression, graphique_dvf,
+                 job_store, nom_rapport, personnalisation_client, redaction_recommandation, rediger_estimation,
+                 rendre_pdf)
+from jobs import TERMINE, AsyncJobScheduler, FilePleine
+from metrics import registre, span
+from report_store import report_store
+
+ASGI_PROCESSUS = int(os.environ.get("ASGI_PROCESSUS", str(os.cpu_count() or 2)))
+
+ordonnanceur = AsyncJobScheduler(job_store)
+processus = None  # pool du travail CPU, créé au démarrage du service
+
+
+def creer_pool():
+    # spawn : les processus n'héritent ni de la boucle ni des connexions du service
+    return ProcessPoolExecutor(max_workers=ASGI_PROCESSUS, mp_context=multiprocessing.get_context("spawn"))
+
+
+@asynccontextmanager
+async def cycle_de_vie(app):
+    global processus
+    processus = creer_pool()
+    logging.info(f"✅ Service ASGI démarré ({ASGI_PROCESSUS} processus pour le travail CPU)")
+    try:
+        yield
+    finally:
+        processus.shutdown(wait=False, cancel_futures=True)
+
+
+app = FastAPI(lifespan=cycle_de_vie)
 
 class Prospect(BaseModel):
     name: str
@@ -17,3 +70,176 @@ def add_prospect(prospect: Prospect):
     # Ici tu pourras ajouter le code pour insérer un prospect dans ta base de données
     return {"message": f"Prospect {prospect.name} ajouté"}
 
+
+# --- Pipeline asynchrone ---
+async def dans_processus(fonction, *args):
+    """
+    Exécute `fonction(*args)` dans le pool de processus. Si un processus meurt (mémoire
+    épuisée sur un gros département...), le pool est inutilisable : il est recréé et
+    l'appel relancé une fois ; un second échec ne fait échouer que ce job.
+    """
+    global processus
+    for tentative in range(2):
+        pool = processus
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, fonction, *args)
+        except BrokenProcessPool:
+            if tentative:
+                raise
+            # Les jobs touchés en même temps ne recréent le pool qu'une fois
+            if processus is pool:
+                logging.error("💥 Pool de processus cassé (processus arrêté) : recréé.")
+                processus = creer_pool()
+                pool.shutdown(wait=False, cancel_futures=True)
+
+async def calculer_contenu_async(form_data, progression, force=False):
+    """
+    Équivalent de app.calculer_contenu : les textes OpenAI sont des tâches de la boucle,
+    comparables et graphique sont calculés en parallèle dans le pool de processus.
+    `force` : textes régénérés sans lire le cache LLM.
+    """
+    await progression("donnees_dvf", 10)
+    recommandation = asyncio.create_task(redaction_recommandation(form_data, force))
+    graphique = asyncio.ensure_future(dans_processus(graphique_dvf, form_data))
+    estimation = None
+    try:
+        with span("processus_dvf"):
+            dvf_table_md, valeur, (prompt, min_tokens) = await dans_processus(analyse_dvf, form_data)
+        estimation = asyncio.create_task(rediger_estimation(prompt, personnalisation_client(form_data), min_tokens,
+                                                            force))
+        with span("processus_graphique"):
+            png = await graphique
+        await progression("redaction", 60)
+        with span("attente_redaction"):
+            textes = await asyncio.gather(estimation, recommandation)
+    finally:
+        # Si une étape échoue, les autres sont annulées (sans effet sur celles terminées)
+        for tache in (recommandation, graphique, estimation):
+            if tache is not None:
+                tache.cancel()
+    await progression("mise_en_page", 90)
+    return {
+        "dvf_table_md": dvf_table_md,
+        "valeur": valeur,
+        "graphique": png,
+        "estimation": textes[0],
+        "recommandation": textes[1],
+    }
+
+async def generer_estimation(job_id, form_data, force=False):
+    logging.info(f"Démarrage de la génération asynchrone pour job {job_id}...")
+
+    async def progression(etape, pourcentage):
+        await asyncio.to_thread(job_store.avancer, job_id, etape, pourcentage)
+
+    contenu = await calculer_contenu_async(form_data, progression, force)
+    with span("processus_pdf"):
+        pdf = await dans_processus(rendre_pdf, form_data, contenu)
+    with span("stockage"):
+        empreinte = await asyncio.to_thread(report_store.ajouter, pdf)
+    await asyncio.to_thread(job_store.mettre_a_jour, job_id, statut=TERMINE, etape=TERMINE, progression=100,
+                            empreinte=empreinte, chemin=report_store.chemin(empreinte),
+                            nom_fichier=nom_rapport(form_data))
+    logging.info(f"✅ Rapport finalisé pour job {job_id}")
+
+
+# --- Endpoints ---
+async def lire_formulaire(request):
+    """Formulaire JSON de la requête et drapeau `force` (paramètre ?force=1 ou clé "force" du JSON)."""
+    try:
+        form_data = dict(await request.json() or {})
+    except ValueError:
+        form_data = {}
+    force = str(form_data.pop("force", request.query_params.get("force", ""))).lower() in ("1", "true", "oui")
+    return form_data, force
+
+def erreur(message, status_code, headers=None):
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+async def envoyer_rapport(request, empreinte, nom_fichier, suffixe=".pdf"):
+    """Comme app.envoyer_rapport : ETag = empreinte du contenu, requêtes conditionnelles et Range."""
+    path = report_store.chemin(empreinte, suffixe)
+    if not await asyncio.to_thread(os.path.exists, path):
+        return erreur("Rapport expiré ou introuvable", 404)
+    headers = {"ETag": f'"{empreinte}"', "Cache-Control": f"private, max-age={REPORT_MAX_AGE}, immutable"}
+    if empreinte in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, filename=nom_fichier, headers=headers)
+
+@app.post("/generate_estimation")
+async def generate_estimation(request: Request):
+    try:
+        form_data, force = await lire_formulaire(request)
+        logging.info("Début de la génération synchrone du rapport...")
+        # Une demande identique attend le job existant, comme côté Flask
+        job_id, nouveau = await asyncio.to_thread(job_store.creer, str(uuid.uuid4()), cle_formulaire(form_data), force)
+        if nouveau:
+            ordonnanceur.lancer(job_id, generer_estimation, form_data, force)
+        else:
+            logging.info(f"♻️ Rapport identique en cours ou récent (job {job_id}) : réutilisé.")
+        job = await ordonnanceur.attendre(job_id)
+        if job is None or job["statut"] != TERMINE:
+            raise RuntimeError(job["erreur"] if job else "Job introuvable")
+        logging.info("PDF généré avec succès.")
+        return await envoyer_rapport(request, job["empreinte"], nom_rapport(form_data))
+
+    except Exception as e:
+        logging.error(f"Erreur dans generate_estimation: {str(e)}")
+        return erreur(str(e), 500)
+
+@app.post("/start_estimation")
+async def start_estimation(request: Request):
+    form_data, force = await lire_formulaire(request)
+    try:
+        job_id, nouveau = await ordonnanceur.soumettre(str(uuid.uuid4()), generer_estimation, form_data, force,
+                                                       cle=cle_formulaire(form_data), force=force)
+    except FilePleine as e:
+        logging.warning(f"⏳ {e}")
+        return erreur(str(e), 429, {"Retry-After": str(e.retry_after)})
+    if nouveau:
+        logging.info(f"Démarrage du job asynchrone {job_id}...")
+    else:
+        logging.info(f"♻️ Demande identique rattachée au job {job_id}.")
+    return {"job_id": job_id, "deduplique": not nouveau}
+
+@app.get("/progress/stream")
+async def progress_stream(job_id: str | None = None):
+    """Flux SSE de la progression d'un job (mêmes événements que la version Flask)."""
+    if not job_id or await asyncio.to_thread(job_store.lire, job_id) is None:
+        return erreur("Job introuvable", 404)
+
+    async def flux():
+        dernier_envoi = time.time()
+        async for job in ordonnanceur.suivre(job_id):
+            if job is not None:
+                dernier_envoi = time.time()
+                yield f"event: progress\ndata: {json.dumps(evenement_progression(job))}\n\n"
+            elif time.time() - dernier_envoi >= SSE_BATTEMENT:
+                dernier_envoi = time.time()
+                yield ": ping\n\n"
+
+    return StreamingResponse(flux(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/progress")
+async def get_progress(job_id: str | None = None):
+    job = await asyncio.to_thread(job_store.lire, job_id) if job_id else None
+    if job is None:
+        return erreur("Job introuvable", 404)
+    return {"progress": job["progression"], **evenement_progression(job)}
+
+@app.get("/download_estimation")
+async def download_estimation(request: Request, job_id: str | None = None):
+    job = await asyncio.to_thread(job_store.lire, job_id) if job_id else None
+    if job is None:
+        return erreur("Job introuvable", 404)
+    if not job["empreinte"]:
+        return erreur("PDF introuvable ou non généré", 404)
+    return await envoyer_rapport(request, job["empreinte"], job["nom_fichier"], os.path.splitext(job["chemin"])[1])
+
+registre.collecteur("jobs_asgi_en_vol", "Jobs en cours dans le service ASGI", "gauge", [],
+                    lambda: [((), ordonnanceur.stats()["actifs"])])
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(await asyncio.to_thread(registre.exposer), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,122 @@
+"""
+Optimisation de la sortie PDF selon un profil de qualité (`email` par défaut, `print`).
+
+- couvertures encodées une fois par processus en JPEG à la résolution du profil : ReportLab
+  embarque le JPEG tel quel (DCTDecode), une seule fois par document
+- graphique en PNG RVB sans couche alpha (pas de masque), couleurs réduites pour l'email
+- flux compressés (Flate) écrits en binaire : plus d'encodage ASCII85 (+25 % par flux)
+- bilan de taille de chaque rapport : octets produits et estimation sans optimisation
+  (mêmes images encodées comme avant : PNG 72 DPI en Flate + ASCII85)
+
+Le profil vient du champ `profil_pdf` du formulaire, à défaut de PDF_PROFIL.
+"""
+import base64
+import io
+import logging
+import os
+import re
+import zlib
+from functools import lru_cache
+
+from PIL import Image as PILImage
+from reportlab import rl_config
+
+from metrics import registre
+
+PROFILS_PDF = {
+    # dpi : résolution des images à leur taille d'affichage (plafonnée par la source)
+    "email": {"dpi_images": 110, "qualite_jpeg": 70, "dpi_graphique": 144, "couleurs_graphique": 64},
+    "print": {"dpi_images": 300, "qualite_jpeg": 90, "dpi_graphique": 300, "couleurs_graphique": None},
+}
+PDF_PROFIL = os.environ.get("PDF_PROFIL", "email")
+
+rl_config.useA85 = 0
+
+octets_pdf = registre.compteur("rapport_pdf_octets_total", "Octets des rapports PDF produits", ["profil"])
+octets_economises = registre.compteur("rapport_pdf_octets_economises_total",
+                                      "Octets économisés par l'optimisation PDF (estimation)", ["profil"])
+
+IMAGE_XOBJECT = re.compile(rb"<<[^<>]*/Subtype /Image[^<>]*>>")
+LONGUEUR = re.compile(rb"/Length (\d+)")
+
+
+def profil_pdf(form_data):
+    """Nom du profil du formulaire (PDF_PROFIL si absent ou inconnu)."""
+    nom = str(form_data.get("profil_pdf") or PDF_PROFIL).lower()
+    if nom not in PROFILS_PDF:
+        logging.warning(f"⚠️ Profil PDF inconnu : {nom}, profil {PDF_PROFIL} utilisé.")
+        return PDF_PROFIL
+    return nom
+
+
+class ImageOptimisee:
+    """Image prête à embarquer et coût de son encodage d'origine (pour le bilan de taille)."""
+
+    def __init__(self, donnees, octets_reference):
+        self.donnees = donnees
+        self.octets_reference = octets_reference
+
+    @property
+    def nbytes(self):
+        return len(self.donnees)
+
+
+def cout_flux(pixels):
+    """Octets d'un flux d'image encodé à l'ancienne (Flate puis ASCII85)."""
+    return len(base64.a85encode(zlib.compress(pixels)))
+
+
+@lru_cache(maxsize=64)
+def cout_reference(png):
+    """Coût d'origine d'une image PNG : pixels RVB, plus le masque si elle a une couche alpha."""
+    with PILImage.open(io.BytesIO(png)) as img:
+        cout = cout_flux(img.convert("RGB").tobytes())
+        if img.mode in ("RGBA", "LA"):
+            cout += cout_flux(img.getchannel("A").tobytes())
+    return cout
+
+
+def encoder_couverture(image_path, taille_pt, profil):
+    """JPEG de la couverture à `taille_pt` (largeur, hauteur en points) et à la résolution du profil."""
+    reglages = PROFILS_PDF[profil]
+    with PILImage.open(image_path) as img:
+        img = img.convert("RGB")
+        largeur = min(img.width, round(taille_pt[0] * reglages["dpi_images"] / 72))
+        hauteur = min(img.height, round(taille_pt[1] * reglages["dpi_images"] / 72))
+        buffer = io.BytesIO()
+        img.resize((largeur, hauteur), PILImage.LANCZOS).save(buffer, format="JPEG", quality=reglages["qualite_jpeg"],
+                                                              optimize=True)
+        # Ancien encodage : PNG redimensionné à 1 pixel par point
+        reference = cout_flux(img.resize(taille_pt, PILImage.LANCZOS).tobytes())
+    return ImageOptimisee(buffer.getvalue(), reference)
+
+
+def encoder_graphique(png, profil):
+    """PNG du graphique sans couche alpha (fond blanc), en couleurs réduites si le profil le demande."""
+    couleurs = PROFILS_PDF[profil]["couleurs_graphique"]
+    with PILImage.open(io.BytesIO(png)) as img:
+        fond = PILImage.new("RGB", img.size, "white")
+        fond.paste(img, mask=img.getchannel("A") if img.mode == "RGBA" else None)
+    if couleurs:
+        fond = fond.quantize(couleurs)
+    buffer = io.BytesIO()
+    fond.save(buffer, format="PNG", optimize=True)
+    return buffer.getvalue()
+
+
+def octets_images(pdf):
+    """Octets des flux d'images (et de leurs masques) d'un PDF produit par ReportLab."""
+    return sum(int(LONGUEUR.search(match.group(0)).group(1)) for match in IMAGE_XOBJECT.finditer(pdf))
+
+
+def bilan_taille(pdf, references, profil):
+    """
+    Taille du rapport et estimation sans optimisation : les images embarquées remplacées par
+    leur coût d'origine (`references`). Alimente les compteurs Prometheus.
+    """
+    taille = len(pdf)
+    sans_optimisation = max(taille, taille - octets_images(pdf) + sum(references))
+    octets_pdf.inc(taille, profil=profil)
+    octets_economises.inc(sans_optimisation - taille, profil=profil)
+    return {"profil": profil, "octets": taille, "octets_sans_optimisation": sans_optimisation,
+            "reduction": round(1 - taille / sans_optimisation, 3)}
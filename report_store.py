@@ -0,0 +1,97 @@
+"""
+Stockage des rapports finaux (PDF, archives de lot) adressé par contenu.
+
+- chemin = empreinte SHA-256 du contenu : aucune collision entre clients homonymes,
+  un même rapport n'est stocké qu'une fois, l'empreinte sert d'ETag
+- écritures atomiques (fichier temporaire dans le même dossier puis os.replace)
+- éviction par âge puis par budget disque, les fichiers les moins récemment écrits d'abord
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+REPORT_STORE_FOLDER = os.environ.get("REPORT_STORE_FOLDER", "./pdf_reports/store/")
+REPORT_STORE_MAX_BYTES = int(os.environ.get("REPORT_STORE_MAX_MB", "2048")) * 1024 * 1024
+REPORT_STORE_RETENTION = float(os.environ.get("REPORT_STORE_RETENTION_H", "168")) * 3600
+
+TAILLE_BLOC = 1024 * 1024
+
+
+class ReportStore:
+    def __init__(self, folder=REPORT_STORE_FOLDER, max_bytes=REPORT_STORE_MAX_BYTES, retention=REPORT_STORE_RETENTION):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self._lock = threading.Lock()
+
+    def chemin(self, empreinte, suffixe=".pdf"):
+        return os.path.join(self.folder, empreinte[:2], f"{empreinte}{suffixe}")
+
+    def fichier_temporaire(self, suffixe=""):
+        """Chemin temporaire dans le dossier du stockage (même système de fichiers, pour `importer`)."""
+        os.makedirs(self.folder, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=".tmp-", suffix=suffixe, dir=self.folder)
+        os.close(fd)
+        return path
+
+    def ajouter(self, data, suffixe=".pdf"):
+        """Stocke `data` (bytes) et renvoie son empreinte."""
+        path = self.fichier_temporaire(suffixe)
+        with open(path, "wb") as f:
+            f.write(data)
+        return self.importer(path, suffixe)
+
+    def importer(self, path, suffixe=".pdf"):
+        """Déplace le fichier `path` (créé via fichier_temporaire) dans le stockage ; renvoie son empreinte."""
+        empreinte = hashlib.sha256()
+        with open(path, "rb") as f:
+            for bloc in iter(lambda: f.read(TAILLE_BLOC), b""):
+                empreinte.update(bloc)
+        empreinte = empreinte.hexdigest()
+        destination = self.chemin(empreinte, suffixe)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if os.path.exists(destination):
+            # Contenu déjà stocké : on le rajeunit simplement
+            os.remove(path)
+            os.utime(destination)
+        else:
+            os.replace(path, destination)
+        self.evincer()
+        return empreinte
+
+    def evincer(self):
+        """Supprime les fichiers expirés puis les plus anciens tant que le budget est dépassé."""
+        with self._lock:
+            fichiers = []
+            limite = time.time() - self.retention
+            for racine, _, noms in os.walk(self.folder):
+                for nom in noms:
+                    path = os.path.join(racine, nom)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    # Les temporaires orphelins (écriture interrompue) expirent aussi
+                    if nom.startswith(".tmp-") and stat.st_mtime >= limite:
+                        continue
+                    fichiers.append((stat.st_mtime, stat.st_size, path))
+            fichiers.sort()
+            total = sum(taille for _, taille, _ in fichiers)
+            supprimes = 0
+            for mtime, taille, path in fichiers:
+                if mtime >= limite and total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= taille
+                supprimes += 1
+            if supprimes:
+                logging.info(f"🧹 Stockage des rapports : {supprimes} fichier(s) supprimé(s), {total / 1e6:.0f} Mo conservés.")
+
+
+report_store = ReportStore()
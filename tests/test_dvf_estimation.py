@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+from dvf_estimation import estimation_fiable, estimer_valeur, ventes_par_mutation
+from dvf_index import DvfIndex
+
+
+def ventes_multilots():
+    """20 ventes d'un lot à 10 000 €/m², puis un immeuble de 60 lots vendu 20 M€ (prix répété sur chaque ligne)."""
+    simples = pd.DataFrame({
+        "id_mutation": [f"2024-{i}" for i in range(20)],
+        "date_mutation": pd.to_datetime("2024-06-01"),
+        "valeur_fonciere": np.linspace(480_000, 520_000, 20),
+        "surface_reelle_bati": 50.0,
+    })
+    immeuble = pd.DataFrame({
+        "id_mutation": "2024-555555",
+        "date_mutation": pd.to_datetime("2024-03-01"),
+        "valeur_fonciere": 20_000_000.0,
+        "surface_reelle_bati": np.tile([40.0, 55.0, 120.0], 20),
+    })
+    df = pd.concat([simples, immeuble], ignore_index=True)
+    df["code_postal"] = "75011"
+    df["type_local"] = "Appartement"
+    return df
+
+
+def test_mutation_multilots_comptee_une_fois():
+    ventes = ventes_par_mutation(ventes_multilots())
+    assert len(ventes) == 21
+    immeuble = ventes[ventes["id_mutation"] == "2024-555555"]
+    assert immeuble["surface_reelle_bati"].item() == 4300.0
+
+
+def test_estimation_ignore_le_prix_repete_des_lots():
+    valeur = estimer_valeur(ventes_multilots(), 50)
+    assert 9_000 <= valeur["prix_m2_bas"] <= valeur["prix_m2_haut"] <= 11_000
+    assert valeur["haut"] <= 550_000
+    assert valeur["confiance"] > 0.5
+
+
+def test_surface_de_toute_la_mutation_depuis_l_index():
+    # Seuls les lots de 40 et 55 m² passent le filtre de surface : le prix de l'immeuble
+    # reste rapporté à ses 4 300 m², pas aux seules lignes retenues
+    index = DvfIndex(ventes_multilots())
+    df = index.find_comparables("75011", "Appartement", (35, 65))
+    ventes = ventes_par_mutation(df)
+    assert ventes.loc[ventes["id_mutation"] == "2024-555555", "surface_reelle_bati"].item() == 4300.0
+    assert estimer_valeur(df, 50)["prix_m2_haut"] <= 11_000
+
+
+def test_estimation_peu_fiable_ecartee():
+    valeur = estimer_valeur(ventes_multilots(), 50)
+    assert estimation_fiable(valeur)
+    assert not estimation_fiable(dict(valeur, confiance=0.0))
+    assert not estimation_fiable(dict(valeur, bas=438_000.0, haut=20_387_000.0))
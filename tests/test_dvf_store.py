@@ -0,0 +1,23 @@
+import pandas as pd
+
+from dvf_store import TOUS_TYPES, TOUTES_COMMUNES, compute_aggregates
+
+
+def test_agregats_une_vente_par_mutation():
+    # Quatre appartements à 10 000 €/m², puis un immeuble de 30 lots vendu 9 M€ (prix répété sur
+    # chaque ligne, plus une dépendance sans surface) : 300 000 €/m² par ligne, 10 000 €/m² en réalité
+    df = pd.DataFrame({
+        "id_mutation": ["a", "b", "c", "d"] + ["immeuble"] * 31,
+        "date_mutation": pd.to_datetime("2024-05-01"),
+        "valeur_fonciere": [500_000.0, 600_000.0, 400_000.0, 450_000.0] + [9_000_000.0] * 31,
+        "surface_reelle_bati": [50.0, 60.0, 40.0, 45.0] + [30.0] * 30 + [float("nan")],
+        "type_local": ["Appartement"] * 34 + ["Dépendance"],
+        "code_postal": "75011",
+        "nom_commune": "Paris 11e Arrondissement",
+    })
+    agregats = compute_aggregates(df)
+    annuel = agregats[(agregats["nom_commune"] == TOUTES_COMMUNES) & (agregats["type_local"] == TOUS_TYPES)
+                      & (agregats["trimestre"] == 0)]
+    assert annuel["nb_ventes"].item() == 5
+    assert annuel["prix_m2_p75"].item() == 10_000
+    assert "Dépendance" not in set(agregats["type_local"].astype(str))